@@ -29,10 +29,12 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import functools
 import logging
 import os
 import sys
 from pathlib import Path
+from typing import *
 
 import click
 import colorlog
@@ -41,10 +43,16 @@ try:
 except ImportError:  # pragma: no cover - backport for older Pythons
     from importlib_metadata import PackageNotFoundError, version as _get_version
 from http.server import HTTPServer
-from RangeHTTPServer import RangeRequestHandler
 
 from cvdupdate import auto_updater
+from cvdupdate import output
 from cvdupdate.cvdupdate import CVDUpdate
+from cvdupdate.daemon import DnsWatcher, UpdateDaemon
+from cvdupdate.dirindex import DirectoryIndex
+from cvdupdate.dns_responder import DnsTxtResponder
+from cvdupdate.profiles import MirrorGroup
+from cvdupdate.readonly import ReadOnlyView
+from cvdupdate.server import ManifestCache, MirrorRequestHandler, ProfilesRequestHandler
 
 handler = colorlog.StreamHandler()
 handler.setFormatter(
@@ -81,53 +89,146 @@ def cli():
     pass
 
 
+def _read_only_view(config: str, verbose: bool, log_stdout: bool = True) -> Optional[ReadOnlyView]:
+    """
+    Use the state cache from the last update, if it's still up to date.
+    """
+    return ReadOnlyView.open(Path(config) if config != "" else CVDUpdate.default_config_path, verbose, log_stdout)
+
+
+def _record_writer(output_format: str) -> Optional[output.RecordWriter]:
+    return output.RecordWriter(output_format) if output_format != "text" else None
+
+
 @cli.command("list")
 @click.option("--config", "-c", type=click.Path(), required=False, default="", help="Config path. [optional]")
 @click.option("--verbose", "-V", is_flag=True, default=False, help="Verbose output. [optional]")
-def db_list(config: str, verbose: bool):
+@click.option("--slow", is_flag=True, default=False, help="Rank the servers by recent download times instead. [optional]")
+@click.option("--output", "-o", "output_format", type=click.Choice(output.FORMATS), required=False, default="text", help="Print log messages (text), or one JSON record per DB (json, ndjson). [optional]")
+def db_list(config: str, verbose: bool, slow: bool, output_format: str):
     """
     List the DBs found in the database directory.
     """
-    m = CVDUpdate(config=config, verbose=verbose)
-    m.db_list()
+    writer = _record_writer(output_format)
+    m = (_read_only_view(config, verbose, log_stdout=writer is None) or
+         CVDUpdate(config=config, verbose=verbose, log_stdout=writer is None))
+    m.db_list(slow=slow, writer=writer)
+    if writer is not None:
+        writer.close()
 
 @cli.command("show")
 @click.option("--config", "-c", type=click.Path(), required=False, default="", help="Config path. [optional]")
 @click.option("--verbose", "-V", is_flag=True, default=False, help="Verbose output. [optional]")
 @click.argument("db", required=True)
-def db_show(config: str, verbose: bool, db: str):
+@click.option("--output", "-o", "output_format", type=click.Choice(output.FORMATS), required=False, default="text", help="Print log messages (text), or one JSON record per DB (json, ndjson). [optional]")
+def db_show(config: str, verbose: bool, db: str, output_format: str):
     """
     Show details about a specific database.
     """
-    m = CVDUpdate(config=config, verbose=verbose)
-    if not m.db_show(db):
+    writer = _record_writer(output_format)
+    m = (_read_only_view(config, verbose, log_stdout=writer is None) or
+         CVDUpdate(config=config, verbose=verbose, log_stdout=writer is None))
+    found = m.db_show(db, writer=writer)
+    if writer is not None:
+        writer.close()
+    if not found:
         sys.exit(1)
 
 @cli.command("update")
 @click.option("--config", "-c", type=click.Path(), required=False, default="", help="Config path. [optional]")
 @click.option("--verbose", "-V", is_flag=True, default=False, help="Verbose output. [optional]")
 @click.option("--debug-mode", "-D", is_flag=True, default=False, help="Print out HTTP headers for debugging purposes. [optional]")
+@click.option("--verify", is_flag=True, default=False, help="Verify each download before saving it, even if not enabled in the config. [optional]")
+@click.option("--dry-run", is_flag=True, default=False, help="Print what would be downloaded, with estimated sizes, without downloading anything. [optional]")
 @click.argument("db", required=False, default="")
-def db_update(config: str, verbose: bool, db: str, debug_mode: bool):
+@click.option("--output", "-o", "output_format", type=click.Choice(output.FORMATS), required=False, default="text", help="Print log messages (text), or one JSON record per DB (json, ndjson). [optional]")
+def db_update(config: str, verbose: bool, db: str, debug_mode: bool, verify: bool, dry_run: bool, output_format: str):
     """
     Update the DBs from the internet. Will update all DBs if DB not specified.
     """
+    writer = _record_writer(output_format)
+    m = CVDUpdate(config=config, verbose=verbose, log_stdout=writer is None)
+    if verify:
+        m.verify_downloads = True
+    errors = m.db_update(db, debug_mode, dry_run=dry_run, writer=writer)
+    if writer is not None:
+        writer.close()
+    m.wait_for_hooks()
+    if errors > 0:
+        sys.exit(errors)
+
+@cli.command("verify")
+@click.option("--config", "-c", type=click.Path(), required=False, default="", help="Config path. [optional]")
+@click.option("--verbose", "-V", is_flag=True, default=False, help="Verbose output. [optional]")
+@click.option("--no-quarantine", is_flag=True, default=False, help="Only report files that fail, don't move them to the quarantine directory. [optional]")
+@click.argument("db", required=False, default="")
+def db_verify(config: str, verbose: bool, db: str, no_quarantine: bool):
+    """
+    Verify the integrity of the DBs, CDIFFs and sign files in the database directory.
+    Will verify all DBs if DB not specified.
+    """
     m = CVDUpdate(config=config, verbose=verbose)
-    errors = m.db_update(db, debug_mode)
+    failures = m.db_verify(db, quarantine=not no_quarantine)
+    if failures > 0:
+        sys.exit(failures)
+
+@cli.command("sync")
+@click.option("--config", "-c", type=click.Path(), required=False, default="", help="Config path. [optional]")
+@click.option("--verbose", "-V", is_flag=True, default=False, help="Verbose output. [optional]")
+@click.argument("peer_url", required=True)
+def db_sync(config: str, verbose: bool, peer_url: str):
+    """
+    Update the DBs from another CVD-Update mirror, eg: one running `cvd serve`.
+    Only files that differ from the upstream manifest are downloaded.
+    """
+    m = CVDUpdate(config=config, verbose=verbose)
+    errors = m.db_sync(peer_url)
+    m.wait_for_hooks()
     if errors > 0:
         sys.exit(errors)
 
+@cli.command("rollback")
+@click.option("--config", "-c", type=click.Path(), required=False, default="", help="Config path. [optional]")
+@click.option("--verbose", "-V", is_flag=True, default=False, help="Verbose output. [optional]")
+@click.option("--list", "list_snapshots", is_flag=True, default=False, help="List the snapshots instead. [optional]")
+@click.option("--release", is_flag=True, default=False, help="Undo the rollback, serving the newest snapshot. [optional]")
+@click.argument("steps", type=int, required=False, default=1)
+def db_rollback(config: str, verbose: bool, list_snapshots: bool, release: bool, steps: int):
+    """
+    Serve an older snapshot of the DBs. Requires "snapshots" to be enabled in the config.
+
+    Rolls back STEPS snapshots (default: 1) from the one being served. Later
+    updates are not served until the rollback is released with --release.
+    """
+    m = CVDUpdate(config=config, verbose=verbose)
+    if list_snapshots:
+        m.snapshot_list()
+    elif release:
+        if not m.db_rollback_release():
+            sys.exit(1)
+    elif not m.db_rollback(steps):
+        sys.exit(1)
+
 @cli.command("add")
 @click.option("--config", "-c", type=click.Path(), required=False, default="", help="Config path. [optional]")
 @click.option("--verbose", "-V", is_flag=True, default=False, help="Verbose output. [optional]")
-@click.argument("db", required=True)
-@click.argument("url", required=True)
-def db_add(config: str, verbose: bool, db: str, url: str):
+@click.option("--from", "feeds_file", type=click.Path(exists=True), required=False, default="", help="Add every DB listed in a JSON file, eg: {\"<db>\": \"<url>\"}. [optional]")
+@click.option("--prefetch", is_flag=True, default=False, help="With --from, download the new DBs right away, in parallel. [optional]")
+@click.argument("db", required=False, default="")
+@click.argument("url", required=False, default="")
+def db_add(config: str, verbose: bool, feeds_file: str, prefetch: bool, db: str, url: str):
     """
     Add a db to the list of known DBs.
     """
+    if feeds_file == "" and (db == "" or url == ""):
+        raise click.UsageError("Requires a DB and URL, or --from <file>.")
+
     m = CVDUpdate(config=config, verbose=verbose)
-    if not m.config_add_db(db, url=url):
+    if feeds_file != "":
+        errors = m.config_import_dbs(Path(feeds_file), prefetch=prefetch)
+        if errors > 0:
+            sys.exit(errors)
+    elif not m.config_add_db(db, url=url):
         sys.exit(1)
 
 @cli.command("remove")
@@ -173,7 +274,7 @@ def config_show(config: str, verbose: bool):
     """
     Print out the current configuration.
     """
-    m = CVDUpdate(config=config, verbose=verbose)
+    m = _read_only_view(config, verbose) or CVDUpdate(config=config, verbose=verbose)
     m.config_show()
 
 
@@ -212,24 +313,140 @@ def clean_all(config: str, verbose: bool):
     m.clean_all()
 
 
+def _serve_dir_of(m: CVDUpdate) -> Callable[[], Path]:
+    """
+    Look up the directory to serve each time, as it changes when a snapshot is published or rolled back.
+    """
+    return lambda: m.serve_dir
+
 @cli.command("serve")
 @click.option("--config", "-c", type=click.Path(), required=False, default="", help="Config path. [optional]")
 @click.option("--verbose", "-V", is_flag=True, default=False, help="Verbose output. [optional]")
 @click.option("--update-interval-seconds", "-U", type=click.INT, required=False, default=0, help="Time in seconds before the next database update")
+@click.option("--dns-domain", type=click.STRING, required=False, default="", help="Also answer DNS TXT queries for current.cvd.<domain>, for FreshClam's DNSDatabaseInfo. [optional]")
+@click.option("--dns-port", type=click.INT, required=False, default=53, help="UDP port for --dns-domain. [optional]")
 @click.argument("port", type=int, required=False, default=8000)
-def serve(port: int, config: str, verbose: bool, update_interval_seconds: int):
+def serve(port: int, config: str, verbose: bool, update_interval_seconds: int, dns_domain: str, dns_port: int):
     """
     Serve up the database directory. Not a production quality server.
     Intended for testing purposes.
     """
     m = CVDUpdate(config=config, verbose=verbose)
-    os.chdir(str(m.db_dir))
-    m.logger.info(f"Serving up {m.db_dir} on localhost:{port}...")
-    auto_updater.start(update_interval_seconds)
-
-    RangeRequestHandler.protocol_version = 'HTTP/1.0'
+    m.logger.info(f"Serving up {m.serve_dir} on localhost:{port}...")
+    serve_dir = _serve_dir_of(m)
+    # Requests are looked up in this listing of the directory, rather than on disk.
+    index = DirectoryIndex(serve_dir)
+    auto_updater.start(update_interval_seconds, config=config, verbose=verbose, on_update=index.invalidate)
+
+    if dns_domain != "":
+        responder = DnsTxtResponder(dns_domain, lambda: serve_dir() / 'dns.txt', port=dns_port, logger=m.logger)
+        m.logger.info(f"Answering DNS TXT queries for current.cvd.{dns_domain} on UDP port {responder.port}...")
+        responder.start()
+
+    MirrorRequestHandler.protocol_version = 'HTTP/1.0'
+    MirrorRequestHandler.manifest_cache = ManifestCache(serve_dir)
+    MirrorRequestHandler.directory_index = index
+    # The directory is looked up again at each index refresh, so a rollback
+    # (or the first snapshot, if snapshots were just enabled) is served right away.
+    handler = functools.partial(MirrorRequestHandler, directory=str(m.serve_dir))
     # TODO(danvk): pick a random, available port
-    httpd = HTTPServer(('', port), RangeRequestHandler)
+    httpd = HTTPServer(('', port), handler)
+    httpd.serve_forever()
+
+
+@cli.command("daemon")
+@click.option("--config", "-c", type=click.Path(), required=False, default="", help="Config path. [optional]")
+@click.option("--verbose", "-V", is_flag=True, default=False, help="Verbose output. [optional]")
+@click.option("--interval", "-i", type=click.INT, required=False, default=0, help="Seconds between checks for DBs that can't be checked with DNS. Overrides the config. [optional]")
+@click.option("--jitter", "-j", type=click.INT, required=False, default=-1, help="Max random delay in seconds added to each check. Overrides the config. [optional]")
+def daemon(config: str, verbose: bool, interval: int, jitter: int):
+    """
+    Keep the DBs up-to-date, instead of running `cvd update` from cron.
+
+    DBs are checked again when the DNS TXT record expires, or after the
+    update interval for DBs that can't be checked with DNS.
+    Send SIGHUP to reload the config.
+    """
+    m = CVDUpdate(config=config, verbose=verbose)
+    d = UpdateDaemon(m, interval=interval, jitter=jitter)
+    d.install_signal_handlers()
+    d.run()
+
+@cli.command("watch")
+@click.option("--config", "-c", type=click.Path(), required=False, default="", help="Config path. [optional]")
+@click.option("--verbose", "-V", is_flag=True, default=False, help="Verbose output. [optional]")
+@click.option("--min-interval", type=click.INT, required=False, default=60, help="Min seconds between DNS polls. [optional]")
+@click.option("--max-interval", type=click.INT, required=False, default=3600, help="Max seconds between DNS polls. [optional]")
+def watch(config: str, verbose: bool, min_interval: int, max_interval: int):
+    """
+    Poll the DNS TXT record and update DBs as soon as a new version is advertised.
+
+    Only DBs with a DNS field (eg: main, daily, bytecode) are updated. The poll
+    interval adapts to how often new versions are published.
+    Send SIGHUP to reload the config.
+    """
+    m = CVDUpdate(config=config, verbose=verbose)
+    w = DnsWatcher(m, min_interval=min_interval, max_interval=max_interval)
+    w.install_signal_handlers()
+    w.run()
+
+@cli.group(help="Commands to update and serve several mirror profiles from one process.")
+def profiles():
+    pass
+
+def _load_mirror_group(profiles_file: str, verbose: bool) -> MirrorGroup:
+    try:
+        return MirrorGroup(Path(profiles_file), verbose=verbose)
+    except (OSError, ValueError) as exc:
+        module_logger.error(f"Failed to load profiles file {profiles_file}: {exc}")
+        sys.exit(1)
+
+@profiles.command("update")
+@click.option("--verbose", "-V", is_flag=True, default=False, help="Verbose output. [optional]")
+@click.option("--debug-mode", "-D", is_flag=True, default=False, help="Print out HTTP headers for debugging purposes. [optional]")
+@click.option("--dry-run", is_flag=True, default=False, help="Print what would be downloaded, with estimated sizes, without downloading anything. [optional]")
+@click.argument("profiles_file", type=click.Path(exists=True), required=True)
+def profiles_update(verbose: bool, debug_mode: bool, dry_run: bool, profiles_file: str):
+    """
+    Update the DBs for every profile that isn't pinned.
+
+    Files already downloaded for one profile are linked into the others,
+    rather than downloaded again.
+    """
+    group = _load_mirror_group(profiles_file, verbose)
+    errors = group.update(debug_mode=debug_mode, dry_run=dry_run)
+    for profile in group.profiles.values():
+        profile.m.wait_for_hooks()
+    if errors > 0:
+        sys.exit(errors)
+
+@profiles.command("serve")
+@click.option("--verbose", "-V", is_flag=True, default=False, help="Verbose output. [optional]")
+@click.option("--update-interval-seconds", "-U", type=click.INT, required=False, default=0, help="Time in seconds before the next database update")
+@click.argument("profiles_file", type=click.Path(exists=True), required=True)
+@click.argument("port", type=int, required=False, default=8000)
+def profiles_serve(verbose: bool, update_interval_seconds: int, profiles_file: str, port: int):
+    """
+    Serve up the database directory of each profile under /<profile>/.
+    Not a production quality server. Intended for testing purposes.
+    """
+    group = _load_mirror_group(profiles_file, verbose)
+    for name, profile in group.profiles.items():
+        profile.m.logger.info(f"Serving up {profile.m.serve_dir} on localhost:{port}/{name}/...")
+
+    ProfilesRequestHandler.protocol_version = 'HTTP/1.0'
+    ProfilesRequestHandler.profiles = {
+        name: (ManifestCache(_serve_dir_of(profile.m)), DirectoryIndex(_serve_dir_of(profile.m)))
+        for name, profile in group.profiles.items()
+    }
+
+    def invalidate_indexes() -> None:
+        for _, index in ProfilesRequestHandler.profiles.values():
+            index.invalidate()
+
+    auto_updater.start_profiles(update_interval_seconds, group, on_update=invalidate_indexes)
+
+    httpd = HTTPServer(('', port), ProfilesRequestHandler)
     httpd.serve_forever()
 
 
@@ -240,7 +457,9 @@ def serve(port: int, config: str, verbose: bool, update_interval_seconds: int):
 @click.pass_context
 @click.option("--config", "-c", type=click.Path(), required=False, default="", help="Config path. [optional]")
 @click.option("--verbose", "-V", is_flag=True, default=False, help="Verbose output. [optional]")
-def list_alias(ctx, config: str, verbose: bool):
+@click.option("--slow", is_flag=True, default=False, help="Rank the servers by recent download times instead. [optional]")
+@click.option("--output", "-o", "output_format", type=click.Choice(output.FORMATS), required=False, default="text", help="Print log messages (text), or one JSON record per DB (json, ndjson). [optional]")
+def list_alias(ctx, config: str, verbose: bool, slow: bool, output_format: str):
     """
     List the DBs found in the database directory.
 
@@ -253,7 +472,8 @@ def list_alias(ctx, config: str, verbose: bool):
 @click.option("--config", "-c", type=click.Path(), required=False, default="", help="Config path. [optional]")
 @click.option("--verbose", "-V", is_flag=True, default=False, help="Verbose output. [optional]")
 @click.argument("db", required=True)
-def show_alias(ctx, config: str, verbose: bool, db: str):
+@click.option("--output", "-o", "output_format", type=click.Choice(output.FORMATS), required=False, default="text", help="Print log messages (text), or one JSON record per DB (json, ndjson). [optional]")
+def show_alias(ctx, config: str, verbose: bool, db: str, output_format: str):
     """
     Show details about a specific database.
 
@@ -266,8 +486,11 @@ def show_alias(ctx, config: str, verbose: bool, db: str):
 @click.option("--config", "-c", type=click.Path(), required=False, default="", help="Config path. [optional]")
 @click.option("--verbose", "-V", is_flag=True, default=False, help="Verbose output. [optional]")
 @click.option("--debug-mode", "-D", is_flag=True, default=False, help="Print out HTTP headers for debugging purposes. [optional]")
+@click.option("--verify", is_flag=True, default=False, help="Verify each download before saving it, even if not enabled in the config. [optional]")
+@click.option("--dry-run", is_flag=True, default=False, help="Print what would be downloaded, with estimated sizes, without downloading anything. [optional]")
 @click.argument("db", required=False, default="")
-def update_alias(ctx, config: str, verbose: bool, db: str, debug_mode: bool):
+@click.option("--output", "-o", "output_format", type=click.Choice(output.FORMATS), required=False, default="text", help="Print log messages (text), or one JSON record per DB (json, ndjson). [optional]")
+def update_alias(ctx, config: str, verbose: bool, db: str, debug_mode: bool, verify: bool, dry_run: bool, output_format: str):
     """
     Update local copy of DBs.
 
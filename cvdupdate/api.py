@@ -0,0 +1,170 @@
+"""
+Copyright (C) 2021-2025 Cisco Systems, Inc. and/or its affiliates. All rights reserved.
+
+This module is for using CVD-Update from another Python program, eg: a
+service that keeps many mirrors up to date.
+
+Unlike the `cvd` command, an Updater:
+
+- Takes its config and state as dicts, and never reads or writes the config,
+  state or log files. The state dict is updated in place, to save as you like.
+- Doesn't change the logging configuration. It logs to the "cvdupdate" logger,
+  or to the logger you give it.
+- Doesn't check PyPI for a newer CVD-Update.
+- Returns an UpdateResult describing every database and download, instead of
+  just a count of errors.
+
+Updaters can share one HTTP session, and so one connection pool, whether they
+are run with `update()` from threads or with `update_async()` from asyncio:
+
+    session = new_session()
+    mirrors = [Updater(config, state, session=session) for config, state in ...]
+    results = await asyncio.gather(*(mirror.update_async() for mirror in mirrors))
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Executor
+from typing import *
+
+from cvdupdate.cvdupdate import CVDUpdate, CvdStatus, requests
+
+
+class FileResult(NamedTuple):
+    db: str
+    name: str
+    url: str
+    status: int         # HTTP status, or 0 if there was no response.
+    bytes: int          # Received.
+    elapsed: float      # Seconds.
+    changed: bool       # Saved to the database directory.
+
+
+class DbResult(NamedTuple):
+    db: str
+    status: CvdStatus
+    elapsed: float
+    files: List[FileResult]
+
+    @property
+    def bytes(self) -> int:
+        return sum(file.bytes for file in self.files)
+
+
+class UpdateResult(NamedTuple):
+    errors: int
+    elapsed: float
+    dbs: Dict[str, DbResult]
+    files_changed: List[str]
+
+    @property
+    def ok(self) -> bool:
+        return self.errors == 0
+
+    @property
+    def bytes(self) -> int:
+        return sum(db.bytes for db in self.dbs.values())
+
+
+def new_session(pool_size: int = 10) -> "requests.Session":
+    """
+    An HTTP session with a connection pool big enough to share between Updaters.
+
+    Args:
+        pool_size:  Connections to keep per server. About the number of updates you'll run at once.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class Updater:
+
+    def __init__(self,
+                 config: dict,
+                 state: Optional[dict] = None,
+                 session: Any = None,
+                 logger: Optional[logging.Logger] = None,
+                 executor: Optional[Executor] = None) -> None:
+        """
+        Args:
+            config:     Settings, as in a config file. Those missing take the default.
+            state:      The state from the last update, updated in place. Default: a new state.
+            session:    HTTP session to share with other Updaters. Default: a new one.
+            logger:     Where to log. Default: the "cvdupdate" logger.
+            executor:   Where `update_async()` runs updates. Default: the event loop's default executor.
+        """
+        self.m = CVDUpdate(configure_logging=False, logger=logger, config_data=config, state_data=state, session=session)
+        self.m.check_pypi = False
+        self.executor = executor
+        # A CVDUpdate isn't safe to update from two threads at once.
+        self.lock = threading.Lock()
+
+    @property
+    def state(self) -> dict:
+        return self.m.state
+
+    def update(self, db: str = "") -> UpdateResult:
+        """
+        Update one or all of the databases.
+        """
+        with self.lock:
+            start = time.monotonic()
+            self.m.fetch_log = []
+            try:
+                errors = self.m.db_update(db)
+            finally:
+                fetch_log, self.m.fetch_log = self.m.fetch_log, None
+
+            changed = set()
+            for _, _, files in self.m.db_results.values():
+                changed |= files
+
+            files: Dict[str, List[FileResult]] = {}
+            for fetched_for, result in fetch_log:
+                name = result.request.url.rsplit('/', 1)[-1]
+                files.setdefault(fetched_for, []).append(FileResult(
+                    db=fetched_for,
+                    name=name,
+                    url=result.request.url,
+                    status=result.status,
+                    bytes=result.received,
+                    elapsed=result.elapsed,
+                    changed=name in changed))
+
+            return UpdateResult(
+                errors=errors,
+                elapsed=time.monotonic() - start,
+                dbs={
+                    name: DbResult(name, status, elapsed, files.get(name, []))
+                    for name, (status, elapsed, _) in self.m.db_results.items()
+                },
+                files_changed=sorted(changed))
+
+    async def update_async(self, db: str = "") -> UpdateResult:
+        """
+        Update one or all of the databases, without blocking the event loop.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.update, db)
+
+    def wait_for_hooks(self) -> int:
+        """
+        Wait for the post update hooks, if any. Returns the number that failed.
+        """
+        return self.m.wait_for_hooks()
@@ -1,25 +1,64 @@
 from threading import Event, Thread
+from typing import *
 
 from cvdupdate.cvdupdate import CVDUpdate
+from cvdupdate.profiles import MirrorGroup
 
-def start(interval: int) -> None:
+def start(interval: int, config: str = "", verbose: bool = False, on_update: Optional[Callable[[], None]] = None) -> None:
     """Spawn a thread to update the AV db after "interval" seconds
     :param interval: the interval in seconds between 2 updates of the db
+    :param config: the config path, same as for the other commands
+    :param verbose: enable DEBUG-level logs
+    :param on_update: called after each update completes, eg: to refresh a directory index
     """
     if interval > 0:
-        Thread(target=_update, daemon=True, args=[interval]).start()
+        Thread(target=_update, daemon=True, args=[interval, config, verbose, on_update]).start()
 
 
-def _update(interval: int) -> None:
+def start_profiles(interval: int, group: MirrorGroup, on_update: Optional[Callable[[], None]] = None) -> None:
+    """Spawn a thread to update every profile in the group after "interval" seconds
+    :param interval: the interval in seconds between 2 updates of the db
+    :param group: the mirror profiles to update
+    :param on_update: called after each update completes, eg: to refresh a directory index
+    """
+    if interval > 0:
+        Thread(target=_update_profiles, daemon=True, args=[interval, group, on_update]).start()
+
+
+def _update(interval: int, config: str, verbose: bool, on_update: Optional[Callable[[], None]] = None) -> None:
     """Don't call this directly
 
     Updates the AV db after every "interval" seconds when it was started
     :param interval: the interval in seconds between 2 updates of the db
+    :param config: the config path, same as for the other commands
+    :param verbose: enable DEBUG-level logs
+    :param on_update: called after each update completes
     """
     ticker = Event()
-    m = CVDUpdate()
+    m = CVDUpdate(config=config, verbose=verbose)
     m.logger.info(f"Updating the database every {interval} seconds")
     while not ticker.wait(interval):
         errors = m.db_update(debug_mode=True)
+        if on_update is not None:
+            on_update()
         if errors > 0:
             m.logger.error("Failed to fetch updates from ClamAV databases")
+
+
+def _update_profiles(interval: int, group: MirrorGroup, on_update: Optional[Callable[[], None]] = None) -> None:
+    """Don't call this directly
+
+    Updates every profile in the group after every "interval" seconds when it was started
+    :param interval: the interval in seconds between 2 updates of the db
+    :param group: the mirror profiles to update
+    :param on_update: called after each update completes
+    """
+    ticker = Event()
+    logger = next(iter(group.profiles.values())).m.logger
+    logger.info(f"Updating {len(group.profiles)} profiles every {interval} seconds")
+    while not ticker.wait(interval):
+        errors = group.update(debug_mode=True)
+        if on_update is not None:
+            on_update()
+        if errors > 0:
+            logger.error("Failed to fetch updates from ClamAV databases")
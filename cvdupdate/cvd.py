@@ -0,0 +1,157 @@
+"""
+Copyright (C) 2021-2025 Cisco Systems, Inc. and/or its affiliates. All rights reserved.
+
+This module reads CVD headers.
+
+A CVD starts with a 512 byte header, padded with spaces, in this format:
+
+    ClamAV-VDB:build time:version:# signatures:functionality level:MD5:DSIG:builder:build timestamp
+
+The rest of the file is the signed tar.gz archive of the signature files.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import mmap
+import os
+import threading
+from pathlib import Path
+from typing import *
+
+CVD_HEADER_SIZE = 512
+# Anything shorter isn't a CVD. The build time and version are in the first 96 bytes.
+CVD_MIN_HEADER_SIZE = 96
+CVD_MAGIC = b"ClamAV-VDB:"
+
+
+class CvdHeader(NamedTuple):
+    build_time: str
+    version: int
+    signatures: int
+    functionality_level: int
+    md5: str
+    dsig: str
+    builder: str
+    build_timestamp: int
+
+
+def _int_field(fields: List[bytes], index: int) -> int:
+    try:
+        return int(fields[index])
+    except (IndexError, ValueError):
+        return 0
+
+
+def _str_field(fields: List[bytes], index: int) -> str:
+    try:
+        return fields[index].decode('utf-8', 'ignore')
+    except IndexError:
+        return ""
+
+
+def parse_cvd_header(buf: Union[bytes, bytearray, memoryview, mmap.mmap]) -> CvdHeader:
+    """
+    Parse a CVD header from the start of a buffer.
+
+    The buffer may be shorter than a full header (eg: the first 96 bytes from an
+    HTTP range request), in which case the missing fields are left empty.
+    Only the header is ever copied out of the buffer, so this is cheap to call
+    on a memoryview of a whole mmap'd CVD.
+
+    Raises ValueError if the buffer is not a CVD header or lacks a version.
+    """
+    with memoryview(buf) as view:
+        header = view[:CVD_HEADER_SIZE].tobytes()
+
+    if not header.startswith(CVD_MAGIC):
+        raise ValueError("Missing CVD header magic")
+
+    fields = header.rstrip(b' \0\r\n').split(b':')
+
+    version = _int_field(fields, 2)
+    if version == 0:
+        raise ValueError("Missing CVD version in header")
+
+    return CvdHeader(
+        build_time=_str_field(fields, 1),
+        version=version,
+        signatures=_int_field(fields, 3),
+        functionality_level=_int_field(fields, 4),
+        md5=_str_field(fields, 5),
+        dsig=_str_field(fields, 6),
+        builder=_str_field(fields, 7),
+        build_timestamp=_int_field(fields, 8),
+    )
+
+
+# Headers we've already read (parsed, and raw without the padding), keyed by path.
+# The (inode, mtime, size) is kept with each entry so we notice when a file is replaced.
+_header_cache: Dict[str, Tuple[Tuple[int, int, int], CvdHeader, bytes]] = {}
+_header_cache_lock = threading.Lock()
+_HEADER_CACHE_MAX = 4096
+
+
+def _stat_key(st: os.stat_result) -> Tuple[int, int, int]:
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def read_cvd_header(path: Path, st: Optional[os.stat_result] = None) -> CvdHeader:
+    """
+    Read the header from a CVD file.
+
+    The result is cached by (inode, mtime, size), so asking again for an
+    unchanged file costs just a stat() (or nothing, if the caller already has one).
+
+    A file shorter than a full header is read as far as it goes, like
+    `parse_cvd_header()` does with a partial header.
+
+    Raises ValueError if the file is shorter than CVD_MIN_HEADER_SIZE or is not a CVD.
+    Raises OSError if the file can't be read.
+    """
+    return _read_cached(path, st)[1]
+
+
+def read_raw_cvd_header(path: Path, st: Optional[os.stat_result] = None) -> bytes:
+    """
+    Read the header from a CVD file as it is in the file, without the padding.
+    Cached along with `read_cvd_header()`, and raises the same.
+    """
+    return _read_cached(path, st)[2]
+
+
+def _read_cached(path: Path, st: Optional[os.stat_result]) -> Tuple[Tuple[int, int, int], CvdHeader, bytes]:
+    if st is None:
+        st = os.stat(str(path))
+    key = _stat_key(st)
+
+    with _header_cache_lock:
+        cached = _header_cache.get(str(path))
+    if cached is not None and cached[0] == key:
+        return cached
+
+    if st.st_size < CVD_MIN_HEADER_SIZE:
+        raise ValueError(f"{path.name} is too short to be a CVD")
+
+    length = min(st.st_size, CVD_HEADER_SIZE)
+    with open(str(path), 'rb') as cvd_fd:
+        with mmap.mmap(cvd_fd.fileno(), length, access=mmap.ACCESS_READ) as cvd_map:
+            header = parse_cvd_header(cvd_map)
+            raw = cvd_map[:length].rstrip(b' \0')
+
+    cached = (key, header, raw)
+    with _header_cache_lock:
+        if len(_header_cache) >= _HEADER_CACHE_MAX:
+            _header_cache.clear()
+        _header_cache[str(path)] = cached
+
+    return cached
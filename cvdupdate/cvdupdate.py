@@ -19,16 +19,19 @@ limitations under the License.
 
 import copy
 import datetime
+import hashlib
 import http.client as http_client
 import json
 import logging
 import os
 import platform
 import re
+import shutil
 import subprocess
 import sys
 import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 from pathlib import Path
 from typing import *
@@ -59,11 +62,42 @@ except ModuleNotFoundError:
     resolver = _DNSMissing()
 from packaging import version
 
+from cvdupdate import cvd
+from cvdupdate.downloader import Downloader, DownloadRequest, DownloadResult, ThreadedDownloader, http_date
+from cvdupdate import freshness
+from cvdupdate import hooks
+from cvdupdate import latency
+from cvdupdate import manifest
+from cvdupdate import output
+from cvdupdate import readonly
+from cvdupdate import retention
+from cvdupdate import snapshots
+from cvdupdate import statecache
+from cvdupdate import verify
+
 class CvdStatus(Enum):
     NO_UPDATE = 0
     UPDATED = 1
     ERROR = 2
 
+class PlanAction(Enum):
+    UP_TO_DATE = 0  # Nothing to download.
+    UPDATE = 1      # A newer version is advertised by DNS.
+    SIGNS = 2       # Up-to-date, but missing a sign file.
+    CHECK = 3       # Can't tell without asking the server.
+    COOLDOWN = 4    # Skipped until the cool-down expires.
+    INVALID_URL = 5 # Skipped, can't be updated.
+
+class DbPlan(NamedTuple):
+    db: str
+    action: PlanAction
+    local_version: int = 0
+    advertised_version: int = 0
+    cdiffs: Sequence[str] = ()
+    signs: Sequence[str] = ()
+    estimated_bytes: int = 0
+    corrupt: bool = False   # The local CVD can't be read, and will be downloaded again.
+
 class CVDUpdate:
 
     default_config_path: Path = Path.home() / ".cvdupdate" / "config.json"
@@ -81,6 +115,42 @@ class CVDUpdate:
         "rotate cdiffs" : True,
         "# cdiffs to keep" : 30,
         "state file": "",
+
+        # Also prune CDIFFs by age and by total size per database. 0 means no limit.
+        "cdiff max age" : 0,   # days
+        "cdiff max bytes" : 0,
+
+        "verify downloads" : False,
+        "quarantine directory" : str(Path.home() / ".cvdupdate" / "quarantine"),
+
+        # Commands, webhooks or unix sockets to notify when an update changes any files.
+        # See cvdupdate/hooks.py for the format.
+        "post update hooks" : [],
+        "hook workers" : 4,
+
+        # Publish each update as a snapshot, and serve the `current` snapshot.
+        # Old snapshots are pruned along with old CDIFFs, keeping "# cdiffs to keep".
+        "snapshots" : False,
+        "snapshot directory" : str(Path.home() / ".cvdupdate" / "snapshots"),
+
+        # Used by `cvd daemon` for databases that can't be checked with DNS.
+        "update interval" : 60 * 60 * 4, # seconds, same as the default cron schedule.
+        "update jitter" : 60 * 5,        # seconds, random delay added to each scheduled update.
+
+        # Don't ask again for a sign file that wasn't found, for this long.
+        "missing sign ttl" : 60 * 60 * 24, # seconds
+
+        # Download CVDs of at least "segment min size" bytes over this many connections at once,
+        # if the server supports Range requests. 0 or 1 means one connection.
+        "download segments" : 0,
+        "segment min size" : 32 * 1024 * 1024,
+
+        # `cvd update` saves new files here, and moves them into the database directory once
+        # every download is done. Must be on the same filesystem as the database directory.
+        # Default: ".<db directory name>.staging", next to the database directory.
+        "staging directory" : "",
+        # Don't start an update, or save a file, that would leave less than this free.
+        "min free space" : 64 * 1024 * 1024, # bytes
     }
 
     default_state: dict = {
@@ -122,6 +192,48 @@ class CVDUpdate:
     log_dir: Path
     version: str
 
+    # Reused across updates, so a long running process keeps its connections
+    # and its DNS answer warm.
+    _session = None
+    _resolver = None
+    dns_version_tokens: List[str] = []
+    dns_expires: float = 0
+    pypi_checked: float = 0
+
+    # Check PyPI for a newer CVD-Update before each update.
+    check_pypi: bool = True
+
+    # False for an instance given its config and state, rather than reading them from files.
+    # It then never writes the config, state or state cache files.
+    persist: bool = True
+
+    # Every download made by the current update, as (db, result).
+    fetch_log: Optional[List[Tuple[str, DownloadResult]]] = None
+
+    # Set when several mirror profiles are updated together (see cvdupdate.profiles),
+    # so a file downloaded for one profile is hardlinked into the others. Maps URL -> path.
+    shared_downloads: Optional[Dict[str, Path]] = None
+
+    _hook_runner: Optional[hooks.HookRunner] = None
+
+    # HEAD responses for the files the current update planned to download, by URL.
+    # Made to find out their sizes, then used instead of asking again. See `_head()`.
+    planned_heads: Dict[str, DownloadResult] = {}
+
+    # The manifest as it was when the current update started, read once to look up
+    # the hashes of the files we already have. See `_run_manifest()`.
+    _loaded_manifest: Optional[dict] = None
+    _manifest_loaded: bool = False
+
+    # The files saved to the staging directory by the current update, by name.
+    # None when not staging, in which case files are saved straight to the database directory.
+    staged: Optional[Dict[str, Path]] = None
+
+    # Makes our HTTP requests. Batches of independent requests (eg: the CDIFFs for a database)
+    # are made in parallel. Set to Downloader to make them one at a time, or to your own subclass.
+    downloader_class: Type[Downloader] = ThreadedDownloader
+    _downloader: Optional[Downloader] = None
+
     def __init__(
         self,
         config: str  = "",
@@ -129,26 +241,53 @@ class CVDUpdate:
         db_dir: str  = "",
         nameserver: str  = "",
         verbose: bool = False,
+        log_stdout: bool = True,
+        configure_logging: bool = True,
+        logger: Optional[logging.Logger] = None,
+        config_data: Optional[dict] = None,
+        state_data: Optional[dict] = None,
+        session: Any = None,
     ) -> None:
         """
         CVDUpdate class.
 
         Args:
-            log_dir:        path output log.
-            db_dir:         path where databases will be downloaded.
-            verbose:        Enable DEBUG-level logs and other verbose messages.
+            log_dir:            path output log.
+            db_dir:             path where databases will be downloaded.
+            verbose:            Enable DEBUG-level logs and other verbose messages.
+            log_stdout:         Print INFO and DEBUG-level logs to stdout, as well as the log file.
+                                Disable to keep stdout for machine-readable output.
+            configure_logging:  Set up the root logger and the log file, and prune old logs.
+                                Disable when embedding CVD-Update in another program.
+            logger:             Logger to use if not configure_logging. Default: the "cvdupdate" logger.
+            config_data:        Use this config instead of reading the config file.
+                                Missing settings take the default.
+            state_data:         With config_data, use this state (it will be updated in place)
+                                instead of reading the state file. Default: a new state.
+            session:            HTTP session to use, eg: to share a connection pool. Default: a new one.
         """
         try:
             self.version = _get_version('cvdupdate')
         except PackageNotFoundError:
             self.version = "0.0"
         self.verbose = verbose
-        self._read_config(
-            config,
-            db_dir,
-            log_dir,
-            nameserver)
-        self._init_logging()
+        self.log_stdout = log_stdout
+        self.files_changed = set()
+        if session is not None:
+            self._session = session
+        if config_data is not None:
+            self._use_config(config, config_data, state_data, db_dir, log_dir, nameserver)
+        else:
+            self._read_config(
+                config,
+                db_dir,
+                log_dir,
+                nameserver)
+        self.verify_downloads = self._config_value('verify downloads')
+        if configure_logging:
+            self._init_logging()
+        else:
+            self.logger = logger if logger is not None else logging.getLogger("cvdupdate")
 
     def _init_logging(self) -> None:
         """
@@ -189,9 +328,8 @@ class CVDUpdate:
             force=True,  # an import might already have the root logger configured
             handlers=[
                 stderr_handler,
-                stdout_handler,
                 logging.FileHandler(log_file),
-            ],
+            ] + ([stdout_handler] if self.log_stdout else []),
         )
 
         self.logger = logging.getLogger(f"cvdupdate-{self.version}")
@@ -201,6 +339,35 @@ class CVDUpdate:
         urllib3_logger = logging.getLogger("urllib3.connectionpool")
         urllib3_logger.setLevel(self.logger.level)
 
+    def _use_config(self,
+                    config: str,
+                    config_data: dict,
+                    state_data: Optional[dict],
+                    db_dir: str,
+                    log_dir: str,
+                    nameserver: str) -> None:
+        """
+        Use the config and state we were given, without reading or writing any files.
+        """
+        self.persist = False
+        self.config_path = Path(config) if config != "" else self.default_config_path
+
+        self.config = copy.deepcopy(self.default_config)
+        self.config.update(config_data)
+        if db_dir != "":
+            self.config["db directory"] = db_dir
+        if log_dir != "":
+            self.config["log directory"] = log_dir
+        if nameserver != "":
+            self.config['nameserver'] = nameserver
+        self.db_dir = Path(self.config["db directory"])
+        self.log_dir = Path(self.config["log directory"])
+
+        self.state = state_data if state_data is not None else copy.deepcopy(self.default_state)
+        self.state.setdefault('dbs', {})
+        if 'uuid' not in self.state:
+            self.state['uuid'] = str(uuid.uuid4())
+
     def _read_config(self,
                      config: str,
                      db_dir: str,
@@ -285,10 +452,82 @@ class CVDUpdate:
         if need_save:
             self._save_config()
 
+    @property
+    def session(self) -> "requests.Session":
+        '''
+        HTTP session, so connections to the same server are reused.
+        '''
+        if self._session is None:
+            self._session = requests.Session()
+        return self._session
+
+    @property
+    def downloader(self) -> Downloader:
+        '''
+        Makes our HTTP requests, retrying truncated responses, over our session.
+        '''
+        if self._downloader is None:
+            self._downloader = self.downloader_class(
+                self.session,
+                f'CVDUPDATE/{self.version} ({self.state["uuid"]})',
+                self.config['max retry'],
+                self.logger)
+        # The session may have been shared with us since, or the config reloaded.
+        self._downloader.session = self.session
+        self._downloader.max_retry = max(self.config['max retry'], 1)
+        return self._downloader
+
+    def _record_fetch(self, db: str, result: DownloadResult) -> None:
+        '''
+        Add a download to the database's record of recent downloads, for `cvd show` and `cvd list --slow`.
+        '''
+        if self.fetch_log is not None:
+            self.fetch_log.append((db, result))
+
+        details = self.state['dbs'].get(db)
+        if details is None:
+            return
+        ring = latency.FetchRing.from_state(details)
+        ring.add(latency.Fetch(result.elapsed, result.received, result.status))
+        details['fetches'] = ring.to_state()
+
+    def _start_cooldown(self, db: str, result: DownloadResult) -> None:
+        '''
+        Don't try a database again until the server says we may, after a 429 response.
+        '''
+        try_again_seconds = result.retry_after
+        self.state['dbs'][db]['retry after'] = time.time() + float(try_again_seconds)
+
+        try_again_string = str(datetime.timedelta(seconds=try_again_seconds))
+        self.logger.warning(f"We won't try {db} again for {try_again_string} hours.")
+
+    def reload_config(self) -> None:
+        '''
+        Re-read the config and state files, eg: after someone edited them.
+        The HTTP session is kept, but the DNS answer is thrown out in case the
+        nameserver changed.
+        '''
+        self._read_config(str(self.config_path), "", "", "")
+        self.verify_downloads = self._config_value('verify downloads')
+        self._resolver = None
+        self.dns_version_tokens = []
+        self.dns_expires = 0
+        self._init_logging()
+
+    def _config_value(self, key: str) -> Any:
+        '''
+        Get a config value, falling back to the default for settings that older
+        config files don't have.
+        '''
+        return self.config.get(key, self.default_config[key])
+
     def _save_config(self) -> None:
         """
         Save the current configuration.
         """
+        if not self.persist:
+            return
+
         for fi in (self.config_path, Path(self.config['state file'])):
             if not fi.parent.exists():
                 # parent directory doesn't exist yet
@@ -312,7 +551,7 @@ class CVDUpdate:
             print("Failed to create state file!")
             raise exc
 
-        if self.verbose:
+        if self.verbose and self.log_stdout:
             print(f"Saved: {self.config_path}\n")
             print(f"Saved: {self.config['state file']}\n")
 
@@ -341,10 +580,12 @@ class CVDUpdate:
                 try:
                     self.logger.info(f"Deleting: {db}")
                     os.remove(str(cvddb))
+                    self.files_changed.add(db)
 
                     # If there is a matching .sign digital signature file, remove it too
                     if os.path.exists(str(cvddb) + ".sign"):
                         os.remove(str(cvddb) + ".sign")
+                        self.files_changed.add(db + ".sign")
 
                 except Exception as exc:
                     self.logger.debug(f"Tried to remove {db}")
@@ -356,10 +597,12 @@ class CVDUpdate:
             try:
                 self.logger.info(f"Deleting CDIFF: {cdiff.name}")
                 os.remove(str(cdiff))
+                self.files_changed.add(cdiff.name)
 
                 # If there is a matching .sign digital signature file, remove it too
                 if os.path.exists(str(cdiff) + ".sign"):
                     os.remove(str(cdiff) + ".sign")
+                    self.files_changed.add(cdiff.name + ".sign")
 
             except Exception as exc:
                 self.logger.debug(f"Tried to remove CDIFFs.")
@@ -374,6 +617,9 @@ class CVDUpdate:
         # Save config
         self._save_config()
 
+        if self.db_dir.exists():
+            self._write_manifest()
+
     def clean_logs(self):
         """
         Delete all files in the log directory.
@@ -397,116 +643,134 @@ class CVDUpdate:
         os.remove(str(self.config['state file']))
         print(f"Deleted: {self.config['state file']}")
 
-    def _index_local_databases(self) -> dict:
-        need_save = False
-        dbs = copy.deepcopy(self.state['dbs'])
+    # Above this many unknown files in the database directory, stat them in parallel.
+    _parallel_index_threshold = 64
 
-        db_paths = self.db_dir.glob('*')
-        for db in db_paths:
-            if db.name.endswith('.cdiff') or db.name.endswith('.sign'):
-                # Ignore CDIFFs and sign files, they'll get printed later.
-                continue
+    def _iter_local_databases(self) -> Iterator[Tuple[str, dict]]:
+        """
+        Yield (name, details) for each database in our state, followed by any
+        other files found in the database directory.
 
-            if db.name not in dbs:
-                version = 0
-
-                # Found a file in here that ISN'T a part of the config
-                if db.name.endswith('.cvd'):
-                    # Found a CVD in here that ISN'T a part of the config!
-                    # Very odd BTW.
-                    self.logger.warning(f"Found a CVD in the DB directory that isn't in the config: {db.name}")
-                    try:
-                        version = self._get_cvd_version_from_file(db)
-                    except Exception as exc:
-                        self.logger.debug(f"EXCEPTION OCCURRED: {exc}")
-                        self.logger.error(f"Failed to determine version for {db.name}")
-
-                dbs[db.name] = {
-                    "url" : "n/a",
-                    "retry after" : 0,
-                    "last modified" : os.path.getmtime(str(db)),
-                    "last checked" : 0,
-                    "DNS field" : 0,
-                    "local version" : version,
-                    "CDIFFs" : []
-                }
-            else:
-                # DB on disk is from our config
-                if db.name.endswith(".cvd") and self.state['dbs'][db.name]['local version'] == 0:
-                    # Seems like we somehow got a (config'd) CVD file in our database directory without
-                    # saving the CVD info to the config. Let's just update the version field.
-                    self.logger.info(f"Found {db.name} in the DB directory, though it wasn't downloaded using this tool.")
-                    try:
-                        dbs[db.name]['local version'] = self._get_cvd_version_from_file(self.db_dir / db.name)
-                        self.logger.info(f"Identified mysterious {db.name} version: {dbs[db.name]['local version']}")
-
-                        # Add the version info for this mysteriously deposited CVD to our config.
-                        self.state['dbs'][db.name]['local version'] = dbs[db.name]['local version']
-                        need_save = True
-                    except Exception as exc:
-                        self.logger.debug(f"EXCEPTION OCCURRED: {exc}")
-                        self.logger.error(f"Failed to determine version # of mysterious {db.name} file. Perhaps it is corrupted?")
+        CDIFFs and sign files are skipped by name, without a stat() call.
+        The details for databases in our state are the live state entries, so
+        callers must not modify them.
+        """
+        try:
+            entries = {
+                entry.name: entry for entry in os.scandir(str(self.db_dir))
+                if not (entry.name.endswith('.cdiff') or entry.name.endswith('.sign'))
+            }
+        except FileNotFoundError:
+            entries = {}
+
+        need_save = False
+        for db, details in self.state['dbs'].items():
+            if db in entries and db.endswith(".cvd") and details['local version'] == 0:
+                # Seems like we somehow got a (config'd) CVD file in our database directory without
+                # saving the CVD info to the config. Let's just update the version field.
+                self.logger.info(f"Found {db} in the DB directory, though it wasn't downloaded using this tool.")
+                header = self._get_cvd_header_from_file(Path(entries[db].path))
+                if header is not None:
+                    # Add the version info for this mysteriously deposited CVD to our config.
+                    details['local version'] = header.version
+                    self.logger.info(f"Identified mysterious {db} version: {header.version}")
+                    need_save = True
+                else:
+                    self.logger.error(f"Failed to determine version # of mysterious {db} file. Perhaps it is corrupted?")
 
         if need_save:
             self._save_config()
 
-        return dbs
+        yield from self.state['dbs'].items()
+
+        unknown = sorted(
+            (entry for name, entry in entries.items()
+                if name not in self.state['dbs'] and manifest.is_listed(name) and entry.is_file()),
+            key=lambda entry: entry.name)
+
+        if len(unknown) > self._parallel_index_threshold:
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                yield from pool.map(self._describe_unknown_file, unknown)
+        else:
+            for entry in unknown:
+                yield self._describe_unknown_file(entry)
 
-    def db_list(self) -> None:
+    def _describe_unknown_file(self, entry: os.DirEntry) -> Tuple[str, dict]:
         """
-        Print list of databases
+        Describe a file in the database directory that isn't a part of the config.
         """
-        dbs = self._index_local_databases()
+        st = entry.stat()
+        version = 0
 
-        for db in dbs:
-            updated = datetime.datetime.fromtimestamp(dbs[db]['last modified']).strftime('%Y-%m-%d %H:%M:%S')
-            checked = datetime.datetime.fromtimestamp(dbs[db]['last checked']).strftime('%Y-%m-%d %H:%M:%S')
-            self.logger.info(f"Database: {db}")
-            if dbs[db]['last modified'] == 0:
-                self.logger.info("  last modified: not downloaded")
+        if entry.name.endswith('.cvd'):
+            # Found a CVD in here that ISN'T a part of the config!
+            # Very odd BTW.
+            self.logger.warning(f"Found a CVD in the DB directory that isn't in the config: {entry.name}")
+            header = self._get_cvd_header_from_file(Path(entry.path), st)
+            if header is not None:
+                version = header.version
+            else:
+                self.logger.error(f"Failed to determine version for {entry.name}")
+
+        return entry.name, {
+            "url" : "n/a",
+            "retry after" : 0,
+            "last modified" : st.st_mtime,
+            "last checked" : 0,
+            "DNS field" : 0,
+            "local version" : version,
+            "CDIFFs" : []
+        }
+
+    def _index_local_databases(self) -> dict:
+        """
+        Index the databases in our state plus any other files in the database directory.
+        See `_iter_local_databases()`.
+        """
+        return dict(self._iter_local_databases())
+
+    def db_list(self, slow: bool = False, writer: Optional[output.RecordWriter] = None) -> None:
+        """
+        Print list of databases
+
+        With slow=True, rank the servers by their recent download times instead.
+        With a writer, write a record for each instead of logging it.
+        """
+        if slow:
+            if writer is not None:
+                for origin, summary in latency.rank_origins(self.state['dbs']):
+                    writer.write(output.origin_record(origin, summary))
             else:
-                self.logger.info(f"  last modified: {updated}")
-            if dbs[db]['last checked'] == 0:
-                self.logger.debug(" last checked:  n/a")
+                readonly.log_slow_origins(self.logger, self.state['dbs'])
+            return
+
+        # Print each database as it is found, rather than waiting to index the whole directory.
+        for db, details in self._iter_local_databases():
+            if writer is not None:
+                writer.write(output.db_record(db, details))
             else:
-                self.logger.debug(f" last checked:  {checked}")
-            self.logger.debug(f" url:           {dbs[db]['url']}")
-            if db.endswith(".cvd"):
-                # Only CVD's have versions.
-                self.logger.debug(f" local version: {dbs[db]['local version']}")
-            if len(dbs[db]['CDIFFs']) > 0:
-                self.logger.debug(f" CDIFFs:")
-                for cdiff in dbs[db]['CDIFFs']:
-                    self.logger.debug(f"   {cdiff}")
-
-
-    def db_show(self, name) -> bool:
+                readonly.log_db_summary(self.logger, db, details)
+
+    def db_show(self, name, writer: Optional[output.RecordWriter] = None) -> bool:
         """
         Show details for a specific database
+
+        With a writer, write a record for it instead of logging it.
         """
         found = False
-        dbs = self._index_local_databases()
 
-        for db in dbs:
+        # Stop indexing as soon as we find it.
+        for db, details in self._iter_local_databases():
             if db == name:
                 found = True;
 
-                updated = datetime.datetime.fromtimestamp(dbs[db]['last modified']).strftime('%Y-%m-%d %H:%M:%S')
-                checked = datetime.datetime.fromtimestamp(dbs[db]['last checked']).strftime('%Y-%m-%d %H:%M:%S')
-                self.logger.info(f"Database: {db}")
-                if dbs[db]['last modified'] == 0:
-                    self.logger.info("  last modified: not downloaded")
-                else:
-                    self.logger.info(f"  last modified: {updated}")
-                if dbs[db]['last checked'] == 0:
-                    self.logger.info("  last checked:  n/a")
+                header = None
+                if db.endswith(".cvd") and (self.db_dir / db).exists():
+                    header = self._get_cvd_header_from_file(self.db_dir / db)
+                if writer is not None:
+                    writer.write(output.db_record(db, details, header))
                 else:
-                    self.logger.info(f"  last checked:  {checked}")
-                self.logger.info(f"  url:           {dbs[db]['url']}")
-                if db.endswith(".cvd"):
-                    self.logger.info(f"  local version: {dbs[db]['local version']}")
-                if len(dbs[db]['CDIFFs']) > 0:
-                    self.logger.info(f"  CDIFFs: \n{json.dumps(dbs[db]['CDIFFs'], indent=4)}")
+                    readonly.log_db_details(self.logger, db, details, header)
                 return True
 
         if not found:
@@ -521,19 +785,24 @@ class CVDUpdate:
         self.logger.debug(f"Checking available versions via DNS TXT entry query of current.cvd.clamav.net")
 
         try:
-            our_resolver = resolver.Resolver()
-            our_resolver.timeout = 5 # Explicitly setting query timeout to mitigate https://github.com/Cisco-Talos/cvdupdate/issues/17
-            nameservers = self._get_nameserver_configuration()
-
-            if nameservers:
-                our_resolver.nameservers = nameservers
-                self.logger.info(f"Using nameservers: {nameservers}")
-            else:
-                self.logger.info("Using system configured nameservers")
+            if self._resolver is None:
+                our_resolver = resolver.Resolver()
+                our_resolver.timeout = 5 # Explicitly setting query timeout to mitigate https://github.com/Cisco-Talos/cvdupdate/issues/17
+                nameservers = self._get_nameserver_configuration()
+
+                if nameservers:
+                    our_resolver.nameservers = nameservers
+                    self.logger.info(f"Using nameservers: {nameservers}")
+                else:
+                    self.logger.info("Using system configured nameservers")
+                self._resolver = our_resolver
 
-            answer = str(our_resolver.resolve("current.cvd.clamav.net","TXT").response.answer[0])
+            response = self._resolver.resolve("current.cvd.clamav.net","TXT")
+            answer = str(response.response.answer[0])
             versions = re.search('".*"', answer).group().strip('"')
             self.dns_version_tokens = versions.split(':')
+            # Remember when the answer goes stale, so a long running process can reuse it until then.
+            self.dns_expires = time.time() + response.rrset.ttl
             got_it = True
         except Exception as exc:
             self.logger.debug(f"EXCEPTION OCCURRED: {exc}")
@@ -541,6 +810,19 @@ class CVDUpdate:
 
         return got_it
 
+    def _dns_changed_dbs(self, old_tokens: List[str], new_tokens: List[str]) -> List[str]:
+        '''
+        List the databases whose DNS TXT field differs between two DNS answers.
+        '''
+        changed = []
+        for db, details in self.state['dbs'].items():
+            field = details['DNS field']
+            if field <= 0 or field >= len(new_tokens):
+                continue
+            if field >= len(old_tokens) or old_tokens[field] != new_tokens[field]:
+                changed.append(db)
+        return changed
+
     def _get_nameserver_configuration(self) -> List[str]:
         '''
         Parse comma delimited nameserver string into a list for Resolver
@@ -632,61 +914,36 @@ class CVDUpdate:
 
         self.logger.debug(f"Checking {db} version via HTTP download of CVD header.")
 
-        ims = datetime.datetime.fromtimestamp(self.state['dbs'][db]['last modified'], tz=datetime.timezone.utc).strftime('%a, %d %b %Y %H:%M:%S GMT')
-
-        retry = 0
-        response = None
-        while retry < self.config['max retry']:
-            response = requests.get(url, headers = {
-                'User-Agent': f'CVDUPDATE/{self.version} ({self.state["uuid"]})',
-                'Range': 'bytes=0-95',
-                'If-Modified-Since': ims,
-            })
+        last_modified = self.state['dbs'][db]['last modified']
+        result = self.downloader.fetch(DownloadRequest(url, if_modified_since=last_modified, byte_range='bytes=0-95'))
+        self._record_fetch(db, result)
 
-            if ((response.status_code == 200 or response.status_code == 206) and
-                ('content-length' in response.headers) and
-                (int(response.headers['content-length']) > len(response.content))):
-                self.logger.warning(f"Response was truncated somehow...")
-                self.logger.warning(f"   Expected {response.headers['content-length']}")
-                self.logger.warning(f"   Received {response.content}, let's retry.")
-                retry += 1
-            else:
-                break
-        if response is None:
+        if result.status == 0:
             self.logger.error(f"No response received requesting CVD header from {url}.")
             return 0
 
-        if response.status_code == 200 or response.status_code == 206:
+        if result.status == 200 or result.status == 206:
             # Looks like we downloaded something...
-            if (('content-length' in response.headers) and int(response.headers['content-length']) > len(response.content)):
+            if result.truncated:
                 self.logger.error(f"Failed to download {db} header to check the version #.")
                 return 0
 
             # Successfully downloaded the header.
             # We used the IMS header so this means it's probably newer, but we'll check just in case.
-            cvd_header = response.content
-            version = self._get_version_from_cvd_header(cvd_header)
+            version = self._get_version_from_cvd_header(result.content)
             self.logger.debug(f"{db} version available by HTTP download: {version}")
 
-        elif response.status_code == 304:
+        elif result.status == 304:
             # HTTP Not-Modified, it's not newer.than what we already have.
             # Just return the current local version.
             version = self.state['dbs'][db]['local version']
-            self.logger.debug(f"{db} not-modified since: {ims} (local version {version})")
+            self.logger.debug(f"{db} not-modified since: {http_date(last_modified)} (local version {version})")
 
-        elif response.status_code == 429:
+        elif result.status == 429:
             # Rejected because downloading the same file too frequently.
             self.logger.warning(f"Failed to download {db} header to check the version #.")
             self.logger.warning(f"Download request rejected because we've downloaded the same file too frequently.")
-
-            try_again_seconds = 60 * 60 * 12 # 12 hours
-            if 'Retry-After' in response.headers.keys():
-                try_again_seconds = int(response.headers['Retry-After'])
-
-            self.state['dbs'][db]['retry after'] = time.time() + float(try_again_seconds)
-
-            try_again_string = str(datetime.timedelta(seconds=try_again_seconds))
-            self.logger.warning(f"We won't try {db} again for {try_again_string} hours.")
+            self._start_cooldown(db, result)
 
         else:
             # Check failed!
@@ -698,41 +955,84 @@ class CVDUpdate:
 
         return version
 
-    def _download_db_from_url(self, db: str, url: str, last_modified: int, version=0) -> CvdStatus:
+    def _download_db_from_url(self, db: str, url: str, last_modified: int, version=0,
+                              prefetched: Optional[DownloadResult] = None) -> CvdStatus:
         '''
         Download contents from a url and save to a filename in the database directory.
         Will use If-Modified-Since
         If Not-Modified, it will not replace the current database.
+
+        If `prefetched`, use that response (from a batch) instead of making the request.
         '''
-        ims: str = datetime.datetime.fromtimestamp(last_modified, tz=datetime.timezone.utc).strftime('%a, %d %b %Y %H:%M:%S GMT')
+        ims = http_date(last_modified)
 
-        retry = 0
-        response = None
-        while retry < self.config['max retry']:
-            response = requests.get(url, headers = {
-                'User-Agent': f'CVDUPDATE/{self.version} ({self.state["uuid"]})',
-                'If-Modified-Since': ims,
-            })
+        shared = self._link_shared_download(url, db)
+        if shared == CvdStatus.NO_UPDATE:
+            return CvdStatus.NO_UPDATE
+        elif shared == CvdStatus.UPDATED:
+            self.state['dbs'][db]['last modified'] = time.time()
+            if db.endswith('.cvd'):
+                self.state['dbs'][db]['local version'] = self._get_cvd_version_from_file(self._local_path(db))
+            self._download_sign_file_for(
+                db,
+                url,
+                last_modified=0,
+                version=version)
+            return CvdStatus.UPDATED
 
-            if ((response.status_code == 200 or response.status_code == 206) and
-                ('content-length' in response.headers) and
-                (int(response.headers['content-length']) > len(response.content))):
-                self.logger.warning(f"Response was truncated somehow...")
-                self.logger.warning(f"   Expected {response.headers['content-length']}")
-                self.logger.warning(f"   Received {response.content}, let's retry.")
-                retry += 1
-            else:
-                break
-        if response is None:
+        if prefetched is None and db.endswith('.cvd') and self._config_value('download segments') > 1:
+            segmented = self._download_segmented(db, url, last_modified, version)
+            if segmented is not None:
+                return segmented
+
+        request = DownloadRequest(url, if_modified_since=last_modified)
+
+        # CVDs are checked with DNS or their header instead.
+        check_freshness = not db.endswith('.cvd')
+        if check_freshness and (self.db_dir / db).exists():
+            saved = freshness.validators_from_state(self.state['dbs'][db])
+            request = request._replace(if_none_match=saved.etag)
+
+            if self._is_unchanged_upstream(db, url):
+                # Same as a 304 Not Modified.
+                self.logger.info(f"{db} not-modified since: {ims}")
+                self._download_sign_file_for(
+                    db,
+                    url,
+                    last_modified=0,
+                    version=self.state['dbs'][db]['local version'])
+                return CvdStatus.NO_UPDATE
+
+        result = prefetched if prefetched is not None else self.downloader.fetch(request)
+        self._record_fetch(db, result)
+        if result.status == 0:
             self.logger.error(f"No response received requesting {url}.")
             return CvdStatus.ERROR
 
-        if response.status_code == 200:
+        # Only learn from a response once we've kept it (or confirmed we already have it).
+        # Otherwise, after a failed download, we would ask for the file "if changed since"
+        # the version we failed to save, and keep the old one.
+        conditional = last_modified > 0 or request.if_none_match != ""
+
+        if result.status == 200:
             # Looks like we downloaded something...
-            if (('content-length' in response.headers) and int(response.headers['content-length']) > len(response.content)):
+            if result.truncated:
                 self.logger.error(f"Failed to download {db}")
                 return CvdStatus.ERROR
 
+            if self._matches_local_file(db, result.content):
+                if check_freshness:
+                    self._learn_from_response(db, url, conditional, result)
+                # Eg: a server that ignores If-Modified-Since. Leave the file (and its mtime) alone,
+                # so HTTP caches and ClamAV don't think it changed.
+                self.logger.info(f"{db} was sent again, but has not changed.")
+                self._download_sign_file_for(
+                    db,
+                    url,
+                    last_modified=0,
+                    version=self.state['dbs'][db]['local version'])
+                return CvdStatus.NO_UPDATE
+
             # Download Success
             if version > 0:
                 self.logger.info(f"Downloaded {db}. Version: {version}")
@@ -740,21 +1040,26 @@ class CVDUpdate:
                 self.logger.info(f"Downloaded {db}")
 
             try:
-                with (self.db_dir / db).open('wb') as new_db:
-                    new_db.write(response.content)
+                if not self._publish_file(db, result.content, version):
+                    return CvdStatus.ERROR
+                self._remember_shared_download(url, db)
+                if check_freshness:
+                    self._learn_from_response(db, url, conditional, result)
 
                 # Update config w/ new db info
                 self.state['dbs'][db]['last modified'] = time.time()
                 if db.endswith('.cvd'):
-                    self.state['dbs'][db]['local version'] = self._get_version_from_cvd_header(response.content[:96])
+                    self.state['dbs'][db]['local version'] = self._get_version_from_cvd_header(memoryview(result.content))
 
             except Exception as exc:
                 self.logger.debug(f"EXCEPTION OCCURRED: {exc}")
                 self.logger.error(f"Failed to save {db} to {self.db_dir}")
                 return CvdStatus.ERROR
 
-        elif response.status_code == 304:
+        elif result.status == 304:
             # Not modified since IMS. We have the latest version.
+            if check_freshness:
+                self._learn_from_response(db, url, conditional, result)
             version = self.state['dbs'][db]['local version']
             self.logger.info(f"{db} not-modified since: {ims} (local version {version})")
 
@@ -768,21 +1073,13 @@ class CVDUpdate:
 
             return CvdStatus.NO_UPDATE
 
-        elif response.status_code == 429:
+        elif result.status == 429:
             # Rejected because downloading the same file too frequently.
             self.logger.warning(f"Failed to download {db}.")
             self.logger.warning(f"Download request rejected because we've downloaded the same file too frequently.")
 
-            try_again_seconds = 60 * 60 * 12 # 12 hours
-            if 'Retry-After' in response.headers.keys():
-                try_again_seconds = int(response.headers['Retry-After'])
-
-            self.state['dbs'][db]['retry after'] = time.time() + float(try_again_seconds)
-
-            try_again_string = str(datetime.timedelta(seconds=try_again_seconds))
-            self.logger.warning(f"We won't try {db} again for {try_again_string} hours.")
-
             # We'll have to retry after the cooldown.
+            self._start_cooldown(db, result)
             return CvdStatus.ERROR
 
         else:
@@ -800,10 +1097,215 @@ class CVDUpdate:
 
         return CvdStatus.UPDATED
 
-    def _download_cdiff(self, db: str, file: str, db_url: str, last_modified: int, desired_version: int, available_version: int) -> CvdStatus:
+    def _download_segmented(self, db: str, url: str, last_modified: int, version: int) -> Optional[CvdStatus]:
+        '''
+        Download a large CVD over several connections at once, each getting one byte range.
+
+        Returns None if the file is too small or the server doesn't support Range requests
+        (or if a segment fails), to download it the usual way instead.
+        '''
+        head = self._head(url, if_modified_since=last_modified)
+        if head.status != 200:
+            # Including 304 Not Modified, which the usual way handles.
+            return None
+
+        content_length = head.headers.get('Content-Length', '')
+        size = int(content_length) if content_length.isdigit() else 0
+        if head.headers.get('Accept-Ranges', '').lower() != 'bytes' or size < self._config_value('segment min size'):
+            return None
+
+        if not self._has_room_for(db, size):
+            return CvdStatus.ERROR
+
+        segments = self._config_value('download segments')
+        self.logger.debug(f"Downloading {db} ({size} bytes) over {segments} connections.")
+
+        tmp_path = self._partial_path(db)
+        try:
+            result = self.downloader.fetch_segmented(
+                DownloadRequest(url),
+                tmp_path,
+                size,
+                segments,
+                validator=head.headers.get('ETag', '') or head.headers.get('Last-Modified', ''))
+        except OSError as exc:
+            # Eg: No room to preallocate the file.
+            self.logger.debug(f"EXCEPTION OCCURRED: {exc}")
+            self.logger.error(f"Failed to save {db} to {self.db_dir}")
+            if tmp_path.exists():
+                os.remove(str(tmp_path))
+            return CvdStatus.ERROR
+
+        self._record_fetch(db, result)
+        if not result.ok:
+            self.logger.warning(f"Segmented download of {db} failed: {result.error}")
+            self.logger.warning(f"Will download {db} over one connection instead.")
+            os.remove(str(tmp_path))
+            return None
+
+        if version > 0:
+            self.logger.info(f"Downloaded {db}. Version: {version}")
+        else:
+            self.logger.info(f"Downloaded {db}")
+
+        try:
+            if not self._publish_partial(tmp_path, db, version):
+                return CvdStatus.ERROR
+            self._remember_shared_download(url, db)
+
+            self.state['dbs'][db]['last modified'] = time.time()
+            self.state['dbs'][db]['local version'] = self._get_cvd_version_from_file(self._local_path(db))
+
+        except Exception as exc:
+            self.logger.debug(f"EXCEPTION OCCURRED: {exc}")
+            self.logger.error(f"Failed to save {db} to {self.db_dir}")
+            return CvdStatus.ERROR
+
+        self._download_sign_file_for(
+            db,
+            url,
+            last_modified=0,
+            version=version)
+
+        return CvdStatus.UPDATED
+
+    def _head(self, url: str, if_modified_since: Optional[float] = None) -> DownloadResult:
+        '''
+        Make a HEAD request, or use the response to the one made while planning the update.
+        '''
+        if not if_modified_since and url in self.planned_heads:
+            return self.planned_heads.pop(url)
+        return self.downloader.fetch(DownloadRequest(url, method='HEAD', if_modified_since=if_modified_since))
+
+    def _matches_local_file(self, name: str, content: bytes) -> bool:
+        '''
+        Check if a download is identical to the file we already have.
+
+        Sizes are compared first, so a changed file is usually caught without hashing.
+        The local file's hash comes from the manifest, if the file hasn't changed since.
+        '''
+        path = self.db_dir / name
+        try:
+            st = os.stat(str(path))
+        except OSError:
+            return False
+
+        if st.st_size != len(content):
+            return False
+
+        listed = self._run_manifest()
+        entry = listed['files'].get(name) if listed is not None else None
+        if entry is not None and entry['size'] == st.st_size and entry['mtime'] == st.st_mtime:
+            local_sha256 = entry['sha256']
+        else:
+            local_sha256 = manifest.file_sha256(path)
+
+        return hashlib.sha256(content).hexdigest() == local_sha256
+
+    def _run_manifest(self) -> Optional[dict]:
+        '''
+        Get the manifest, reading it just once per update.
+
+        It goes stale as the update replaces files, which is fine for looking up
+        hashes: an entry is only trusted if the file's size and mtime still match.
+        '''
+        if not self._manifest_loaded:
+            self._loaded_manifest = manifest.load_manifest(self.db_dir / manifest.MANIFEST_FILE)
+            self._manifest_loaded = True
+        return self._loaded_manifest
+
+    def _origin_strategy(self, url: str) -> freshness.ProbeStrategy:
+        '''
+        Get the cheapest way we've learned to check if a file changed on this URL's server.
+        '''
+        learned = self.state.get('origins', {}).get(freshness.origin_of(url))
+        if learned is None or time.time() - learned['learned'] > freshness.RELEARN_AFTER:
+            return freshness.ProbeStrategy.UNKNOWN
+        return freshness.ProbeStrategy(learned['strategy'])
+
+    def _learn_origin_strategy(self, url: str, strategy: freshness.ProbeStrategy) -> None:
+        origins = self.state.setdefault('origins', {})
+        origin = freshness.origin_of(url)
+        if origins.get(origin, {}).get('strategy') != strategy.value:
+            self.logger.debug(f"Will check for updates from {origin} with {strategy.value} requests.")
+        origins[origin] = {'strategy': strategy.value, 'learned': time.time()}
+
+    def _probe(self, url: str, strategy: freshness.ProbeStrategy) -> Optional[freshness.Validators]:
+        '''
+        Get the validators for a URL with a HEAD or a 1-byte Range request, without downloading it.
+        '''
+        if strategy == freshness.ProbeStrategy.HEAD:
+            result = self._head(url)
+            expected_status = 200
+        else:
+            # In case the server ignores the Range and sends the whole file.
+            result = self.downloader.fetch(DownloadRequest(url, byte_range='bytes=0-0', read_body=False))
+            expected_status = 206
+
+        if result.status != expected_status:
+            return None
+
+        validators = freshness.validators_from_headers(result.headers)
+        return validators if validators.usable() else None
+
+    def _is_unchanged_upstream(self, db: str, url: str) -> bool:
+        '''
+        For servers that ignore conditional requests, check with a HEAD or Range
+        request if the database changed since we last downloaded it.
+        '''
+        strategy = self._origin_strategy(url)
+        if strategy not in (freshness.ProbeStrategy.HEAD, freshness.ProbeStrategy.RANGE):
+            return False
+
+        saved = freshness.validators_from_state(self.state['dbs'][db])
+        if not saved.usable():
+            return False
+
+        probed = self._probe(url, strategy)
+        if probed is None:
+            # That used to work. Start over.
+            self.logger.debug(f"{strategy.value} request for {url} failed, will learn how to check it again.")
+            self.state['origins'].pop(freshness.origin_of(url), None)
+            return False
+
+        return freshness.is_unchanged(saved, probed) is True
+
+    def _learn_from_response(self, db: str, url: str, conditional: bool, result: DownloadResult) -> None:
+        '''
+        Learn from a GET response if the server honors conditional requests,
+        and save the validators to compare with next time.
+        '''
+        if result.status == 304:
+            self._learn_origin_strategy(url, freshness.ProbeStrategy.CONDITIONAL)
+            return
+
+        if result.status != 200:
+            return
+
+        saved = freshness.validators_from_state(self.state['dbs'][db])
+        received = freshness.validators_from_headers(result.headers)
+        self.state['dbs'][db]['validators'] = freshness.validators_to_state(received)
+
+        if (conditional and
+            freshness.is_unchanged(saved, received) is True and
+            self._origin_strategy(url) in (freshness.ProbeStrategy.UNKNOWN, freshness.ProbeStrategy.CONDITIONAL)):
+            # The server sent the whole file again, though it hasn't changed.
+            # Find a cheaper way to check next time.
+            self.logger.debug(f"{freshness.origin_of(url)} ignores conditional requests.")
+            for strategy in (freshness.ProbeStrategy.HEAD, freshness.ProbeStrategy.RANGE):
+                if self._probe(url, strategy) is not None:
+                    self._learn_origin_strategy(url, strategy)
+                    break
+            else:
+                self._learn_origin_strategy(url, freshness.ProbeStrategy.NONE)
+
+    def _download_cdiff(self, db: str, file: str, db_url: str, last_modified: int, desired_version: int, available_version: int,
+                        prefetched: Optional[DownloadResult] = None) -> CvdStatus:
         '''
         Download a CDIFF file given a file name and version.
         The file name should be in the format of "daily-12345.cdiff"
+
+        If `prefetched`, use that response (from a batch) instead of making the request.
         '''
 
         self.logger.debug(f"Checking for {file}")
@@ -812,67 +1314,43 @@ class CVDUpdate:
         base_url = db_url.rsplit('/', 1)[0]
         url = f"{base_url}/{file}"
 
-        retry = 0
-        response = None
-        while retry < self.config['max retry']:
-            response = requests.get(url, headers = {
-                'User-Agent': f'CVDUPDATE/{self.version} ({self.state["uuid"]})',
-            })
+        shared = self._link_shared_download(url, file)
+        if shared is not None:
+            if file not in self.state['dbs'][db]['CDIFFs']:
+                self.state['dbs'][db]['CDIFFs'].append(file)
+            return CvdStatus.UPDATED
 
-            if ((response.status_code == 200 or response.status_code == 206) and
-                ('content-length' in response.headers) and
-                (int(response.headers['content-length']) > len(response.content))):
-                self.logger.warning(f"Response was truncated somehow...")
-                self.logger.warning(f"   Expected {response.headers['content-length']}")
-                self.logger.warning(f"   Received {response.content}, let's retry.")
-                retry += 1
-            else:
-                break
-        if response is None:
+        result = prefetched if prefetched is not None else self.downloader.fetch(DownloadRequest(url))
+        self._record_fetch(db, result)
+        if result.status == 0:
             self.logger.error(f"No response received requesting {url}.")
             return CvdStatus.ERROR
 
-        if response.status_code == 200:
+        if result.status == 200:
             # Looks like we downloaded something...
-            if (('content-length' in response.headers) and int(response.headers['content-length']) > len(response.content)):
+            if result.truncated:
                 self.logger.error(f"Failed to download CDIFF.")
                 return CvdStatus.ERROR
 
             # Download Success
             self.logger.info(f"Downloaded {file}")
             try:
-                with (self.db_dir / f"{file}").open('wb') as new_db:
-                    new_db.write(response.content)
+                if not self._publish_file(file, result.content, desired_version):
+                    return CvdStatus.ERROR
+                self._remember_shared_download(url, file)
             except Exception as exc:
                 self.logger.debug(f"EXCEPTION OCCURRED: {exc}")
                 self.logger.error(f"Failed to save {file} to {self.db_dir}.")
 
-            # Update config with CDIFF, for posterity
+            # Update config with CDIFF, for posterity.
+            # Old CDIFFs are pruned by _prune_cdiffs() once the update is done.
             self.state['dbs'][db]['CDIFFs'].append(file)
 
-            # Prune old CDIFFs if needed
-            if len(self.state['dbs'][db]['CDIFFs']) > self.config['# cdiffs to keep']:
-                try:
-                    os.remove(self.db_dir / self.state['dbs'][db]['CDIFFs'][0])
-                except Exception as exc:
-                    self.logger.debug(f"EXCEPTION OCCURRED: {exc}")
-                    self.logger.debug(f"Tried to prune old cdiffs, but they weren't found, maybe someone else removed them already.")
-
-                self.state['dbs'][db]['CDIFFs'] = self.state['dbs'][db]['CDIFFs'][1:]
-
-        elif response.status_code == 429:
+        elif result.status == 429:
             # Rejected because downloading the same file too frequently.
             self.logger.warning(f"Failed to download {file}")
             self.logger.warning(f"Download request rejected because we've downloaded the same file too frequently.")
-
-            try_again_seconds = 60 * 60 * 12 # 12 hours
-            if 'Retry-After' in response.headers.keys():
-                try_again_seconds = int(response.headers['Retry-After'])
-
-            self.state['dbs'][db]['retry after'] = time.time() + float(try_again_seconds)
-
-            try_again_string = str(datetime.timedelta(seconds=try_again_seconds))
-            self.logger.warning(f"We won't try {db} again for {try_again_string} hours.")
+            self._start_cooldown(db, result)
 
             # Sure only a CDIFF failed, but if we want any chance of trying the CDIFF again
             # in the future, let's bail out now and retry the CVD + CDIFFs after the cooldown.
@@ -892,60 +1370,78 @@ class CVDUpdate:
         return CvdStatus.UPDATED
 
 
-    def _download_sign_file_for(self, file: str, file_url: str, last_modified: int, version=0) -> CvdStatus:
+    def _sign_file_url(self, file: str, file_url: str, version: int = 0) -> Tuple[str, str]:
         '''
-        Download signature file given a file name.
+        Get the name and URL of a file's sign file.
         If version > 0, will ensure sign file includes version in the filename, like this:
         - file-version.ext.sign
-        '''
-        ims: str = datetime.datetime.fromtimestamp(last_modified, tz=datetime.timezone.utc).strftime('%a, %d %b %Y %H:%M:%S GMT')
 
+        Returns: (sign file, url), or ("", "") if the file name lacks an extension.
+        '''
         sign_file = file + ".sign"
         if version > 0 and str(version) not in file:
             # the sign file name should include the version in this format: "file-version.ext.sign"
             # reconstruct.
             name_parts = file.rsplit('.', 1)
             if len(name_parts) == 1:
-                self.logger.error(f"Invalid file name. Lacks extension: {file}")
-                return CvdStatus.ERROR
+                return "", ""
 
             file_name = name_parts[0]
             ext = name_parts[-1]
             sign_file = f"{file_name}-{version}.{ext}.sign"
 
+        # now remove the old file name from the file_url and add the new sign file name
+        base_url = file_url.rsplit('/', 1)[0]
+        return sign_file, f"{base_url}/{sign_file}"
+
+    def _sign_file_request(self, file: str, file_url: str, last_modified: int, version=0) -> Optional[DownloadRequest]:
+        '''
+        Get the request `_download_sign_file_for()` would make, to make it in a batch.
+        None if there's nothing to ask for, eg: we already have the sign file.
+        '''
+        sign_file, url = self._sign_file_url(file, file_url, version)
+        if (sign_file == "" or
+            self._local_path(sign_file).exists() or
+            self._sign_known_missing(url, self._learns_sign_origin(file)) or
+            (self.shared_downloads is not None and url in self.shared_downloads)):
+            return None
+        return DownloadRequest(url, if_modified_since=last_modified)
+
+    def _download_sign_file_for(self, file: str, file_url: str, last_modified: int, version=0,
+                                prefetched: Optional[DownloadResult] = None) -> CvdStatus:
+        '''
+        Download signature file given a file name. See `_sign_file_url()` for the name.
+
+        If `prefetched`, use that response (from a batch) instead of making the request.
+        '''
+        sign_file, url = self._sign_file_url(file, file_url, version)
+        if sign_file == "":
+            self.logger.error(f"Invalid file name. Lacks extension: {file}")
+            return CvdStatus.ERROR
+
         # check if we already have it.
-        if (self.db_dir / sign_file).exists():
+        if self._local_path(sign_file).exists():
             self.logger.debug(f"We already have {sign_file}. Skipping...")
             return CvdStatus.NO_UPDATE
 
-        # now remove the old file name from the file_url and add the new sign file name
-        base_url = file_url.rsplit('/', 1)[0]
-        url = f"{base_url}/{sign_file}"
-
-        retry = 0
-        response = None
-        while retry < self.config['max retry']:
-            response = requests.get(url, headers = {
-                'User-Agent': f'CVDUPDATE/{self.version} ({self.state["uuid"]})',
-                'If-Modified-Since': ims,
-            })
+        per_origin = self._learns_sign_origin(file)
+        if self._sign_known_missing(url, per_origin):
+            self.logger.debug(f"{sign_file} was not found last time. Skipping...")
+            return CvdStatus.NO_UPDATE
 
-            if ((response.status_code == 200 or response.status_code == 206) and
-                ('content-length' in response.headers) and
-                (int(response.headers['content-length']) > len(response.content))):
-                self.logger.warning(f"Response was truncated somehow...")
-                self.logger.warning(f"   Expected {response.headers['content-length']}")
-                self.logger.warning(f"   Received {response.content}, let's retry.")
-                retry += 1
-            else:
-                break
-        if response is None:
+        shared = self._link_shared_download(url, sign_file)
+        if shared is not None:
+            return shared
+
+        result = prefetched if prefetched is not None else self.downloader.fetch(DownloadRequest(url, if_modified_since=last_modified))
+        self._record_fetch(file, result)
+        if result.status == 0:
             self.logger.error(f"No response received requesting {url}.")
             return CvdStatus.ERROR
 
-        if response.status_code == 200:
+        if result.status == 200:
             # Looks like we downloaded something...
-            if (('content-length' in response.headers) and int(response.headers['content-length']) > len(response.content)):
+            if result.truncated:
                 self.logger.error(f"Failed to download {sign_file}")
                 return CvdStatus.ERROR
 
@@ -956,20 +1452,22 @@ class CVDUpdate:
                 self.logger.info(f"Downloaded {sign_file}")
 
             try:
-                with (self.db_dir / sign_file).open('wb') as new_db:
-                    new_db.write(response.content)
+                if not self._publish_file(sign_file, result.content):
+                    return CvdStatus.ERROR
+                self._remember_shared_download(url, sign_file)
+                self._learn_sign_file(url, found=True, per_origin=per_origin)
 
             except Exception as exc:
                 self.logger.debug(f"EXCEPTION OCCURRED: {exc}")
                 self.logger.error(f"Failed to save {sign_file} to {self.db_dir}")
                 return CvdStatus.ERROR
 
-        elif response.status_code == 304:
+        elif result.status == 304:
             # Not modified since IMS. We have the latest version.
-            self.logger.info(f"{sign_file} not-modified since: {ims} (local version {version})")
+            self.logger.info(f"{sign_file} not-modified since: {http_date(last_modified)} (local version {version})")
             return CvdStatus.NO_UPDATE
 
-        elif response.status_code == 429:
+        elif result.status == 429:
             # Rejected because downloading the same file too frequently.
             self.logger.warning(f"Failed to download {sign_file} from {url} with 429 response.")
             return CvdStatus.ERROR
@@ -977,26 +1475,91 @@ class CVDUpdate:
         else:
             # HTTP Get failed.
             self.logger.info(f"Request failed for {url}. Probably no external digital signature provided for {file}")
+            if result.status in (404, 410):
+                self._learn_sign_file(url, found=False, per_origin=per_origin)
             return CvdStatus.ERROR
 
         return CvdStatus.UPDATED
 
-    def _download_cvd(self, db: str, available_version: int) -> CvdStatus:
+    def _learns_sign_origin(self, file: str) -> bool:
         '''
-        Download the latest available version
-        If we already have some version of the database, attempt to download all CDIFFs in between.
-        If we don't, just get the last two CDIFFs.
+        Check if we may learn that a server has no sign files at all, from the sign files for this file.
+
+        Not for the official CVDs (those with a DNS field) and their CDIFFs: FreshClam needs
+        their sign files, so a few missing during a rollout or an outage mustn't stop us
+        asking for the rest. For those, we only remember each missing sign file.
         '''
-        local_version = self.state['dbs'][db]['local version']
-        desired_version = local_version + 1
+        db = f"{file.rsplit('-', 1)[0]}.cvd" if file.endswith('.cdiff') else file
+        details = self.state['dbs'].get(db)
+        return not (db.endswith('.cvd') and details is not None and details['DNS field'] > 0)
 
-        if local_version >= available_version:
-            # Oh! We're already up to date, don't worry about it.
-            self.logger.info(f"{db} is up-to-date. Version: {local_version}")
+    def _sign_known_missing(self, url: str, per_origin: bool = True) -> bool:
+        '''
+        Check if we already know there's no sign file at this URL, so we don't have to ask.
 
-            db_url = self.state['dbs'][db]['url']
+        That is if it wasn't found recently, or (if per_origin) if its server has never had a sign file for us.
+        '''
+        now = time.time()
+        if self.state.get('missing signs', {}).get(url, 0) > now:
+            return True
+        if not per_origin:
+            return False
 
-            # Check for the .cvd.sign file, just in case we don't have that yet.
+        learned = self.state.get('sign origins', {}).get(freshness.origin_of(url))
+        return (learned is not None and
+                learned['found'] == 0 and
+                learned['missing'] >= freshness.SIGN_ORIGIN_MISSES and
+                now - learned['learned'] <= freshness.RELEARN_AFTER)
+
+    def _learn_sign_file(self, url: str, found: bool, per_origin: bool = True) -> None:
+        '''
+        Remember if a sign file was found, for this URL and (if per_origin) for its server.
+        '''
+        now = time.time()
+        missing = self.state.setdefault('missing signs', {})
+        # Drop the expired ones, so this doesn't grow with every version of every database.
+        for expired in [key for key, expires in missing.items() if expires <= now]:
+            del missing[expired]
+
+        if not per_origin:
+            if found:
+                missing.pop(url, None)
+            else:
+                missing[url] = now + self._config_value('missing sign ttl')
+            return
+
+        origins = self.state.setdefault('sign origins', {})
+        origin = freshness.origin_of(url)
+        learned = origins.get(origin)
+        if learned is None or now - learned['learned'] > freshness.RELEARN_AFTER:
+            learned = origins[origin] = {'found': 0, 'missing': 0, 'learned': now}
+
+        if found:
+            missing.pop(url, None)
+            learned['found'] += 1
+            return
+
+        missing[url] = now + self._config_value('missing sign ttl')
+        learned['missing'] += 1
+        if learned['found'] == 0 and learned['missing'] == freshness.SIGN_ORIGIN_MISSES:
+            self.logger.debug(f"{origin} doesn't seem to have sign files. Won't ask for them again for a while.")
+
+    def _download_cvd(self, db: str, available_version: int) -> CvdStatus:
+        '''
+        Download the latest available version
+        If we already have some version of the database, attempt to download all CDIFFs in between.
+        If we don't, just get the last two CDIFFs.
+        '''
+        local_version = self.state['dbs'][db]['local version']
+        desired_version = local_version + 1
+
+        if local_version >= available_version:
+            # Oh! We're already up to date, don't worry about it.
+            self.logger.info(f"{db} is up-to-date. Version: {local_version}")
+
+            db_url = self.state['dbs'][db]['url']
+
+            # Check for the .cvd.sign file, just in case we don't have that yet.
             # It won't download if we already have it.
             self._download_sign_file_for(
                 db,
@@ -1012,44 +1575,63 @@ class CVDUpdate:
 
         # First try to get CDIFFs
         self.logger.debug(f"Downloading CDIFFs first...")
-        while desired_version <= available_version:
-            # Attempt to download each CDIFF between our local version and the available version.
-            # The url for CVDs should be https://database.clamav.net/<db>
-            # Eg:
-            #   https://database.clamav.net/daily.cvd
-            # For the daily CDIFFs, we would want:
-            #   https://database.clamav.net/daily-<version>.cdiff
-            cdiff_file = f"{db[:-len('.cvd')]}-{desired_version}.cdiff"
-
-            if (self.db_dir / cdiff_file).exists():
+        db_url = self.state['dbs'][db]['url']
+        base_url = db_url.rsplit('/', 1)[0]
+
+        # Attempt to download each CDIFF between our local version and the available version.
+        # The url for CVDs should be https://database.clamav.net/<db>
+        # Eg:
+        #   https://database.clamav.net/daily.cvd
+        # For the daily CDIFFs, we would want:
+        #   https://database.clamav.net/daily-<version>.cdiff
+        cdiffs: Dict[str, int] = {}
+        for version in range(desired_version, available_version + 1):
+            cdiff_file = f"{db[:-len('.cvd')]}-{version}.cdiff"
+            if self._local_path(cdiff_file).exists():
                 self.logger.debug(f"We already have {cdiff_file}. Skipping...")
-                desired_version += 1
-                continue
+            else:
+                cdiffs[cdiff_file] = version
 
-            db_url = self.state['dbs'][db]['url']
+        # Only the requests are made together. The responses are handled one at a time, in order.
+        prefetched = self._fetch_batch({
+            cdiff_file: DownloadRequest(f"{base_url}/{cdiff_file}") for cdiff_file in cdiffs
+            if self.shared_downloads is None or f"{base_url}/{cdiff_file}" not in self.shared_downloads
+        })
 
+        downloaded: Dict[str, int] = {}
+        for cdiff_file, version in cdiffs.items():
             # Download the .cdiff
             result = self._download_cdiff(
                 db,
                 cdiff_file,
                 db_url,
                 last_modified=0,
-                desired_version=desired_version,
-                available_version=available_version)
+                desired_version=version,
+                available_version=available_version,
+                prefetched=prefetched.get(cdiff_file))
 
             if result != CvdStatus.UPDATED:
                 self.logger.error(f"Failed to download {cdiff_file}.")
                 break
 
-            # Now try downloading the corresponding .cdiff.sign.
-            # It's okay if it doesn't exist.
+            downloaded[cdiff_file] = version
+
+        # Now try downloading the corresponding .cdiff.sign files.
+        # It's okay if they don't exist.
+        sign_requests = {}
+        for cdiff_file, version in downloaded.items():
+            request = self._sign_file_request(cdiff_file, db_url, last_modified=0, version=version)
+            if request is not None:
+                sign_requests[cdiff_file] = request
+        prefetched = self._fetch_batch(sign_requests)
+
+        for cdiff_file, version in downloaded.items():
             self._download_sign_file_for(
                 cdiff_file,
                 db_url,
                 last_modified=0,
-                version=desired_version)
-
-            desired_version += 1
+                version=version,
+                prefetched=prefetched.get(cdiff_file))
 
         # Now download the available version.
         desired_version = available_version
@@ -1058,48 +1640,353 @@ class CVDUpdate:
 
         return self._download_db_from_url(db, url, last_modified=0, version=desired_version)
 
+    def _fetch_batch(self, requests: Dict[str, DownloadRequest]) -> Dict[str, DownloadResult]:
+        '''
+        Make independent requests together, keyed by file name.
+
+        Only the requests are made in parallel (with a ThreadedDownloader). The caller
+        handles the results (state, saving files) one at a time, on its own thread.
+        '''
+        if len(requests) == 0:
+            return {}
+        return dict(zip(requests, self.downloader.fetch_all(requests.values())))
+
     def _get_version_from_cvd_header(self, cvd_header: bytes) -> int:
         '''
         Parse a CVD header to read the database version.
         '''
-        header_fields = cvd_header.decode('utf-8', 'ignore').strip().split(':')
-
         version_found = 0
         try:
-            version_found = int(header_fields[2])
+            version_found = cvd.parse_cvd_header(cvd_header).version
         except Exception as exc:
             self.logger.debug(f"EXCEPTION OCCURRED: {exc}")
             self.logger.error(f"Failed to determine version from CVD header!")
 
         return version_found
 
-    def _get_cvd_version_from_file(self, path: Path) -> int:
-        cvd_header: bytes = b''
-        version_found = 0
+    def _get_cvd_header_from_file(self, path: Path, st: Optional[os.stat_result] = None) -> Optional[cvd.CvdHeader]:
+        '''
+        Read the CVD header from a file.
+        Headers are cached, so this won't reopen a file that hasn't changed.
 
+        A file too short to hold even the version (under 96 bytes) is most likely
+        corrupted, and will be deleted.
+        '''
         try:
-            with path.open('rb') as cvd_fd:
-                cvd_header = cvd_fd.read(96)
+            if st is None:
+                st = os.stat(str(path))
 
-            if len(cvd_header) < 96:
+            if st.st_size < cvd.CVD_MIN_HEADER_SIZE:
                 # Most likely a corrupted CVD. Delete.
                 self.logger.debug(f"Failed to read CVD header, perhaps {path.name} is corrupted.")
                 self.logger.debug(f"Will delete {path.name} so it will not cause further problems.")
                 os.remove(str(path))
-            else:
-                # Got the header, lets parse out the version.
-                version_found = self._get_version_from_cvd_header(cvd_header)
+                self.files_changed.add(path.name)
+                return None
+
+            return cvd.read_cvd_header(path, st)
 
         except Exception as exc:
             self.logger.debug(f"EXCEPTION OCCURRED: {exc}")
-            self.logger.error(f"Failed to read version from CVD header from {path}.")
+            self.logger.error(f"Failed to read CVD header from {path}.")
 
-        if version_found == 0:
+        return None
+
+    def _get_cvd_version_from_file(self, path: Path) -> int:
+        header = self._get_cvd_header_from_file(path)
+        if header is None:
             self.logger.error(f"Failed to determine version from CVD header.")
+            return 0
 
-        return version_found
+        return header.version
+
+    def _link_shared_download(self, url: str, name: str) -> Optional[CvdStatus]:
+        '''
+        If another mirror profile already downloaded this URL, link its file into
+        our database directory instead of downloading it again.
+
+        Returns None if we still need to download it. Otherwise UPDATED, or
+        NO_UPDATE if we already have that same file.
+        '''
+        if self.shared_downloads is None or url not in self.shared_downloads:
+            return None
+
+        source = self.shared_downloads[url]
+        destination = self._local_path(name)
+        try:
+            if destination.exists() and os.path.samefile(str(source), str(destination)):
+                return CvdStatus.NO_UPDATE
+
+            tmp_path = self._partial_path(name)
+            if tmp_path.exists():
+                os.remove(str(tmp_path))
+            try:
+                os.link(str(source), str(tmp_path))
+            except OSError:
+                # Eg: on another filesystem.
+                shutil.copy2(str(source), str(tmp_path))
+            self._move_into_place(tmp_path, name)
+
+        except Exception as exc:
+            self.logger.debug(f"EXCEPTION OCCURRED: {exc}")
+            self.logger.debug(f"Failed to link {source}, will download {name} instead.")
+            return None
+
+        self.files_changed.add(name)
+        self.logger.info(f"Linked {name} from {source.parent}, already downloaded for another profile.")
+        return CvdStatus.UPDATED
+
+    def _remember_shared_download(self, url: str, name: str) -> None:
+        if self.shared_downloads is not None:
+            self.shared_downloads[url] = self.db_dir / name
+
+    def _publish_file(self, name: str, content: bytes, version: int = 0) -> bool:
+        '''
+        Save a downloaded file to the database directory.
+
+        The file is written under a temporary name and then renamed, so a
+        half-written file is never served. If download verification is enabled,
+        the file is verified first and quarantined instead if it is corrupt.
+
+        During an update, the file is saved to the staging directory instead.
+        See `_commit_staging()`.
+        '''
+        if not self._has_room_for(name, len(content)):
+            return False
+
+        tmp_path = self._partial_path(name)
+        with tmp_path.open('wb') as new_file:
+            new_file.write(content)
+
+        return self._publish_partial(tmp_path, name, version)
+
+    def _publish_partial(self, tmp_path: Path, name: str, version: int = 0) -> bool:
+        '''
+        Move a file that was downloaded to a temporary path into the database directory.
+        See `_publish_file()`.
+        '''
+        if self.verify_downloads:
+            result = verify.verify_file(tmp_path, version, name=name)
+            if not result.ok:
+                self.logger.error(f"Downloaded {name}, but it failed verification: {result.reason}")
+                self._quarantine(tmp_path, name)
+                return False
+            self.logger.debug(f"Verified {name}: {result.reason}")
+
+        self._move_into_place(tmp_path, name)
+        return True
+
+    def _move_into_place(self, tmp_path: Path, name: str) -> None:
+        '''
+        Rename a finished file into the staging directory if staging, else the database directory.
+        '''
+        if self.staged is not None:
+            destination = self.staging_dir / name
+            os.replace(str(tmp_path), str(destination))
+            self.staged[name] = destination
+        else:
+            os.replace(str(tmp_path), str(self.db_dir / name))
+        self.files_changed.add(name)
+
+    @property
+    def staging_dir(self) -> Path:
+        staging_dir = self._config_value('staging directory')
+        if staging_dir != "":
+            return Path(staging_dir)
+        # Next to the database directory, so staged files are renamed into it rather than copied.
+        return self.db_dir.parent / f".{self.db_dir.name}.staging"
+
+    def _partial_path(self, name: str) -> Path:
+        '''
+        Where to write a file while it is downloaded.
+        '''
+        directory = self.staging_dir if self.staged is not None else self.db_dir
+        return directory / f".{name}.partial"
+
+    def _local_path(self, name: str) -> Path:
+        '''
+        The newest copy of a file we have: staged by the current update, or in the database directory.
+        '''
+        if self.staged is not None and name in self.staged:
+            return self.staged[name]
+        return self.db_dir / name
+
+    def _free_space(self) -> int:
+        '''
+        Bytes free where new files are saved, or -1 if we can't tell.
+        '''
+        directory = self.staging_dir if self.staged is not None else self.db_dir
+        try:
+            return shutil.disk_usage(str(directory)).free
+        except OSError as exc:
+            self.logger.debug(f"EXCEPTION OCCURRED: {exc}")
+            self.logger.debug(f"Failed to check the free space in {directory}.")
+            return -1
+
+    def _has_room_for(self, name: str, size: int) -> bool:
+        '''
+        Check there's room to save a file of this size, leaving "min free space" free.
+        '''
+        free = self._free_space()
+        min_free = self._config_value('min free space')
+        if free >= 0 and free - size < min_free:
+            self.logger.error(f"Not enough disk space to save {name} ({size} bytes). {free} bytes free, and {min_free} must be left free.")
+            return False
+        return True
+
+    def _begin_staging(self) -> bool:
+        '''
+        Create an empty staging directory, and save new files there until `_commit_staging()`.
+        '''
+        staging_dir = self.staging_dir
+        try:
+            if staging_dir.exists():
+                # Left over from an update that didn't finish, so its state wasn't saved.
+                self.logger.debug(f"Removing files left in {staging_dir} by an earlier update.")
+                shutil.rmtree(str(staging_dir))
+            os.makedirs(str(staging_dir))
+        except OSError as exc:
+            self.logger.debug(f"EXCEPTION OCCURRED: {exc}")
+            self.logger.error(f"Failed to create the staging directory: {staging_dir}")
+            return False
+
+        self.staged = {}
+        return True
+
+    def _commit_staging(self) -> int:
+        '''
+        Move the files saved by the update into the database directory, all at once.
+
+        Until now, the database directory is just as it was before the update, so
+        an update that fails part way never leaves it with a half-written file.
+        The databases are moved last, so a new CVD is never served before its
+        CDIFFs and sign files.
+
+        Returns: Number of errors.
+        '''
+        staged, self.staged = self.staged or {}, None
+        errors = 0
+        for name in sorted(staged, key=lambda name: (name in self.state['dbs'], name)):
+            try:
+                os.replace(str(staged[name]), str(self.db_dir / name))
+            except OSError as exc:
+                self.logger.debug(f"EXCEPTION OCCURRED: {exc}")
+                self.logger.error(f"Failed to move {name} from {self.staging_dir} to {self.db_dir}")
+                self.files_changed.discard(name)
+                errors += 1
+
+        if len(staged) > 0:
+            self.logger.debug(f"Moved {len(staged) - errors} new files into {self.db_dir}")
+        self._discard_staging()
+        return errors
+
+    def _discard_staging(self) -> None:
+        '''
+        Stop staging, and remove the staging directory along with anything still in it.
+        '''
+        self.staged = None
+        if self.staging_dir.exists():
+            try:
+                shutil.rmtree(str(self.staging_dir))
+            except OSError as exc:
+                self.logger.debug(f"EXCEPTION OCCURRED: {exc}")
+                self.logger.warning(f"Failed to remove the staging directory: {self.staging_dir}")
+
+    def _preflight_disk_space(self, plans: Dict[str, DbPlan]) -> bool:
+        '''
+        Check there's room for everything the update plans to download, before downloading any of it.
+        '''
+        needed = sum(plan.estimated_bytes for plan in plans.values())
+        free = self._free_space()
+        min_free = self._config_value('min free space')
+        if free >= 0 and free - needed < min_free:
+            self.logger.error(f"Not enough disk space to update. Need ~{needed} bytes, {free} bytes free, and {min_free} must be left free.")
+            return False
+        return True
+
+    def _quarantine(self, path: Path, name: str) -> None:
+        '''
+        Move a file that failed verification out of the database directory,
+        keeping it for inspection.
+        '''
+        quarantine_dir = Path(self._config_value('quarantine directory'))
+        if not quarantine_dir.exists():
+            os.makedirs(str(quarantine_dir))
+
+        today = datetime.datetime.now()
+        destination = quarantine_dir / f"{name}.{today:%Y-%m-%d_%H-%M-%S}"
+        shutil.move(str(path), str(destination))
+        self.logger.warning(f"Quarantined {name} to {destination}")
+
+    def db_verify(self, db: str = "", quarantine: bool = True) -> int:
+        """
+        Verify the integrity of the files in the database directory.
+        If a database is given, verify only that database and its CDIFFs and sign files.
+
+        Files that fail are moved to the quarantine directory, so they will be
+        downloaded again by the next update.
+
+        Returns: Number of files that failed verification.
+        """
+        if db != "" and db not in self.state['dbs']:
+            self.logger.error(f"Verify failed. Unknown database: {db}")
+            return 1
+
+        if not self.db_dir.exists():
+            self.logger.info(f"Nothing to verify, {self.db_dir} does not exist.")
+            return 0
+
+        names = []
+        versions = []
+        for entry in sorted(os.scandir(str(self.db_dir)), key=lambda e: e.name):
+            if not manifest.is_listed(entry.name) or not entry.is_file():
+                continue
+            owner, file_version = manifest.describe_file(entry.name, self.state['dbs'])
+            if db != "" and owner != db:
+                continue
+            names.append(entry.name)
+            versions.append(file_version if not entry.name.endswith('.sign') else 0)
+
+        self.logger.info(f"Verifying {len(names)} files in {self.db_dir}...")
+        results = verify.verify_files([self.db_dir / name for name in names], versions)
+
+        failures = 0
+        for result in results:
+            if result.ok:
+                self.logger.info(f"OK:     {result.name} ({result.reason})")
+                continue
+
+            failures += 1
+            self.logger.error(f"FAILED: {result.name} ({result.reason})")
+            if not quarantine:
+                continue
+
+            self._quarantine(self.db_dir / result.name, result.name)
+            self.files_changed.add(result.name)
+
+            # Forget about the quarantined file, so the next update replaces it.
+            if result.name in self.state['dbs']:
+                self.state['dbs'][result.name]['local version'] = 0
+                self.state['dbs'][result.name]['last modified'] = 0
+            else:
+                owner = manifest.describe_file(result.name, self.state['dbs'])[0]
+                if owner in self.state['dbs'] and result.name in self.state['dbs'][owner]['CDIFFs']:
+                    self.state['dbs'][owner]['CDIFFs'].remove(result.name)
+
+        if failures > 0 and quarantine:
+            self._save_config()
+            self._write_manifest()
+
+        self.logger.info(f"Verified {len(results) - failures} of {len(results)} files.")
+
+        return failures
 
     def pypi_update_check(self):
+        if time.time() - self.pypi_checked < 60 * 60 * 24:
+            # Already checked today. Only matters for long running processes.
+            return True
+        self.pypi_checked = time.time()
+
         def check(name):
             """Checks if a newer version of the specified module is available on PyPI."""
             self.logger.debug(f'Checking for a newer version of {name}.')
@@ -1107,7 +1994,7 @@ class CVDUpdate:
                 current_version_str = _get_version(name)
                 current_version = version.parse(current_version_str)
 
-                response = requests.get(f"https://pypi.org/pypi/{name}/json")  # Get package info
+                response = self.session.get(f"https://pypi.org/pypi/{name}/json")  # Get package info
                 response.raise_for_status() # Raise an exception for bad status codes (4xx or 5xx)
                 latest_version_str = response.json()["info"]["version"]
                 latest_version = version.parse(latest_version_str)
@@ -1135,30 +2022,206 @@ class CVDUpdate:
 
         return check('cvdupdate')
 
-    def db_update(self, db="", debug_mode=False) -> int:
+    def _plan_db(self, db: str, advertised_size: int = -1) -> DbPlan:
+        '''
+        Work out what an update of a database will need to download, using just
+        the DNS TXT answer and the files we already have.
+
+        The database is estimated to be `advertised_size` bytes, if the server told us
+        (see `_plan_update()`), or else the size of the one we have.
+        '''
+        details = self.state['dbs'][db]
+
+        if details['retry after'] > time.time():
+            return DbPlan(db, PlanAction.COOLDOWN)
+
+        if not details['url'].startswith('http'):
+            return DbPlan(db, PlanAction.INVALID_URL)
+
+        db_path = self.db_dir / db
+        try:
+            db_size = os.stat(str(db_path)).st_size
+        except OSError:
+            db_size = 0
+        download_size = advertised_size if advertised_size >= 0 else db_size
+
+        if not db.endswith('.cvd') or details['DNS field'] <= 0:
+            # Third-party databases and CVDs without a DNS field need an HTTP request to find out.
+            return DbPlan(db, PlanAction.CHECK, estimated_bytes=download_size)
+
+        try:
+            advertised_version = int(self.dns_version_tokens[details['DNS field']])
+        except (IndexError, ValueError):
+            return DbPlan(db, PlanAction.CHECK, estimated_bytes=download_size)
+
+        local_version = details['local version'] if db_size > 0 else 0
+        corrupt = False
+        if db_size > 0 and local_version == 0:
+            # Not `_get_cvd_header_from_file()`, which deletes a corrupt CVD. Planning must not change anything.
+            try:
+                local_version = cvd.read_cvd_header(db_path).version
+            except (OSError, ValueError):
+                corrupt = True
+
+        base = db[:-len('.cvd')]
+        signs = []
+
+        if local_version >= advertised_version:
+            sign = f"{base}-{advertised_version}.cvd.sign"
+            if (self.db_dir / sign).exists():
+                return DbPlan(db, PlanAction.UP_TO_DATE, local_version, advertised_version)
+            return DbPlan(db, PlanAction.SIGNS, local_version, advertised_version, signs=[sign],
+                          estimated_bytes=self._estimate_size(f"{base}-*.cvd.sign"))
+
+        # Same as _download_cvd(): all the CDIFFs we don't have, or just the last one if we have no CVD.
+        first_version = local_version + 1 if local_version > 0 else advertised_version
+        cdiffs = [
+            f"{base}-{cdiff_version}.cdiff" for cdiff_version in range(first_version, advertised_version + 1)
+            if not (self.db_dir / f"{base}-{cdiff_version}.cdiff").exists()
+        ]
+        signs = [f"{cdiff}.sign" for cdiff in cdiffs] + [f"{base}-{advertised_version}.cvd.sign"]
+
+        estimated_bytes = (download_size +
+            len(cdiffs) * self._estimate_size(f"{base}-*.cdiff") +
+            len(signs) * self._estimate_size(f"{base}-*.sign"))
+
+        return DbPlan(db, PlanAction.UPDATE, local_version, advertised_version, cdiffs, signs, estimated_bytes, corrupt)
+
+    def _estimate_size(self, pattern: str) -> int:
+        '''
+        Guess the size of a file we don't have yet, from the average size of the ones we do.
+        '''
+        sizes = [path.stat().st_size for path in self.db_dir.glob(pattern)]
+        if sizes == []:
+            return 0
+        return sum(sizes) // len(sizes)
+
+    def _plan_update(self, dbs: Sequence[str] = ()) -> Dict[str, DbPlan]:
+        '''
+        Plan an update of some, or (if none are given) all of the databases.
+
+        Each database we may download is asked for with a HEAD request, so the plan
+        (and the disk space preflight) counts its advertised size. Otherwise, a database
+        we don't have yet (or that is corrupt) would be counted as 0 bytes.
+        '''
+        if len(dbs) == 0:
+            dbs = list(self.state['dbs'])
+        plans = {name: self._plan_db(name) for name in dbs}
+
+        urls = {}
+        for name, plan in plans.items():
+            if plan.action == PlanAction.UPDATE:
+                # The same URL _download_cvd() will download.
+                urls[name] = f"{self.state['dbs'][name]['url']}?version={plan.advertised_version}"
+            elif plan.action == PlanAction.CHECK:
+                urls[name] = self.state['dbs'][name]['url']
+
+        self.planned_heads = {}
+        heads = self._fetch_batch({name: DownloadRequest(url, method='HEAD') for name, url in urls.items()})
+        for name, head in heads.items():
+            self.planned_heads[urls[name]] = head
+            content_length = head.headers.get('Content-Length', '')
+            if head.status == 200 and content_length.isdigit():
+                plans[name] = self._plan_db(name, int(content_length))
+
+        return plans
+
+    def _print_update_plan(self, plans: Dict[str, DbPlan], writer: Optional[output.RecordWriter] = None) -> None:
+        '''
+        Print what an update would download.
+        '''
+        if writer is not None:
+            for plan in plans.values():
+                download = [plan.db] if plan.action == PlanAction.UPDATE else []
+                writer.write({
+                    'name': plan.db,
+                    'action': plan.action.name.lower().replace('_', ' '),
+                    'local version': plan.local_version,
+                    'advertised version': plan.advertised_version,
+                    'download': download + list(plan.cdiffs) + list(plan.signs),
+                    'estimated bytes': plan.estimated_bytes,
+                    'corrupt': plan.corrupt,
+                })
+            return
+
+        total_bytes = 0
+        for plan in plans.values():
+            total_bytes += plan.estimated_bytes
+            if plan.action == PlanAction.UP_TO_DATE:
+                self.logger.info(f"{plan.db}: up-to-date. Version: {plan.local_version}")
+            elif plan.action == PlanAction.COOLDOWN:
+                self.logger.info(f"{plan.db}: skipped, on cool-down.")
+            elif plan.action == PlanAction.INVALID_URL:
+                self.logger.info(f"{plan.db}: skipped, missing or invalid URL: {self.state['dbs'][plan.db]['url']}")
+            elif plan.action == PlanAction.CHECK:
+                self.logger.info(f"{plan.db}: will check the server for a newer version. (~{plan.estimated_bytes} bytes if changed)")
+            else:
+                if plan.corrupt:
+                    self.logger.info(f"{plan.db}: corrupt, will re-download version {plan.advertised_version}. (~{plan.estimated_bytes} bytes)")
+                    self.logger.info(f"  download: {plan.db}")
+                elif plan.action == PlanAction.UPDATE:
+                    self.logger.info(f"{plan.db}: version {plan.local_version} -> {plan.advertised_version}. (~{plan.estimated_bytes} bytes)")
+                    self.logger.info(f"  download: {plan.db}")
+                else:
+                    self.logger.info(f"{plan.db}: up-to-date, but missing sign files. (~{plan.estimated_bytes} bytes)")
+                for cdiff in plan.cdiffs:
+                    self.logger.info(f"  download: {cdiff}")
+                for sign in plan.signs:
+                    self.logger.info(f"  download: {sign} (if available)")
+
+        self.logger.info(f"Estimated download: ~{total_bytes} bytes (sizes estimated from the files we have)")
+
+    def db_update(self, db="", debug_mode=False, dry_run=False, writer: Optional[output.RecordWriter] = None, dbs: Sequence[str] = ()) -> int:
         """
-        Update one or all of the databases.
+        Update one or all of the databases, or just those in `dbs`.
+
+        However many databases are updated, the results are published once:
+        one manifest, one snapshot and one run of the post update hooks.
+
+        The update is planned first, using the DNS TXT record and the files we
+        already have, so only databases that need something are looked at.
+        With `dry_run`, the plan is printed and nothing is downloaded.
+        With a writer, a record is written for each database as soon as it is done.
 
         Returns: Number of errors.
         """
         self.update_errors = 0
         self.dbs_updated = 0
-        self.dns_version_tokens = []
+        # (status, seconds, files changed) for each database updated.
+        self.db_results: Dict[str, Tuple[CvdStatus, float, Set[str]]] = {}
+        self._manifest_loaded = False
+        if time.time() >= self.dns_expires:
+            # Our DNS answer (if any) is stale.
+            self.dns_version_tokens = []
 
         # Make sure we have a database directory to save files to
         if not self.db_dir.exists():
             os.makedirs(self.db_dir)
 
         # Check if there is a newer version of CVD-Update
-        self.pypi_update_check()
+        if not dry_run and self.check_pypi:
+            self.pypi_update_check()
 
         # Query DNS so we can efficiently query CVD version #'s
-        self._query_dns_txt_entry()
+        if self.dns_version_tokens == []:
+            self._query_dns_txt_entry()
         if self.dns_version_tokens == []:
             # Query failed. Bail out.
             self.logger.error(f"Failed to update: DNS query failed.")
             return 1
 
+        if db != "":
+            dbs = [db]
+        for name in dbs:
+            if name not in self.state['dbs']:
+                self.logger.error(f"Update failed. Unknown database: {name}")
+                return 0
+
+        plans = self._plan_update(dbs)
+        if dry_run:
+            self._print_update_plan(plans, writer)
+            return 0
+
         if debug_mode:
             http_client.HTTPConnection.debuglevel = 1
 
@@ -1202,6 +2265,11 @@ class CVDUpdate:
                     # We can use the DNS TXT fields to check if our version is old.
                     advertised_version = self._query_cvd_version_dns(db)
 
+                    if plans[db].action == PlanAction.UP_TO_DATE:
+                        # Nothing to download, not even a sign file.
+                        self.logger.info(f"{db} is up-to-date. Version: {self.state['dbs'][db]['local version']}")
+                        return CvdStatus.NO_UPDATE
+
                 else:
                     # We can't use DNS to see if our version is old.
                     # Use HTTP to pull just the CVD header to check.
@@ -1232,62 +2300,528 @@ class CVDUpdate:
                     self.state['dbs'][db]['url'],
                     self.state['dbs'][db]['last modified'])
 
-        if db == "":
-            # Update every DB.
-            for db in self.state['dbs']:
-                status = update(db)
-                if status == CvdStatus.ERROR:
-                    self.update_errors += 1
-                elif status == CvdStatus.UPDATED:
-                    self.dbs_updated += 1
+        # Save new files to the staging directory, then move them all into
+        # the database directory once every download is done.
+        if not self._begin_staging():
+            return 1
+
+        try:
+            if not self._preflight_disk_space(plans):
+                return 1
+
+            # Update every DB in the plan.
+            for db in plans:
+                changed_before = set(self.files_changed)
+                start = time.monotonic()
 
-        else:
-            # Update a specific DB.
-            if db not in self.state['dbs']:
-                self.logger.error(f"Update failed. Unknown database: {db}")
-            else:
                 status = update(db)
                 if status == CvdStatus.ERROR:
                     self.update_errors += 1
                 elif status == CvdStatus.UPDATED:
                     self.dbs_updated += 1
 
+                self.db_results[db] = (status, time.monotonic() - start, self.files_changed - changed_before)
+                if writer is not None:
+                    writer.write(output.update_record(
+                        db,
+                        status.name.lower().replace('_', ' '),
+                        self.db_results[db][1],
+                        self.state['dbs'][db],
+                        self.db_results[db][2]))
+
+            self.update_errors += self._commit_staging()
+
+        finally:
+            # Anything not committed (eg: after an exception) is thrown away.
+            self._discard_staging()
+
+        self._prune_cdiffs()
+
         self._save_config()
 
-        if self.update_errors == 0 and self.dbs_updated > 0:
-            with (self.db_dir / 'dns.txt').open('w') as dns_file:
-                dns_file.write(':'.join(self.dns_version_tokens))
+        if self.dbs_updated > 0:
+            # Replaced rather than rewritten, because older snapshots may link to it.
+            self._publish_file('dns.txt', ':'.join(self._dns_tokens_to_publish()).encode('utf-8'))
             self.logger.debug(f"Updated {self.db_dir / 'dns.txt'}")
 
+        changed = set(self.files_changed)
+        self._write_manifest()
+
+        if self.update_errors == 0:
+            self._publish_snapshot()
+
+        self._write_state_cache()
+        self._run_post_update_hooks(changed)
+
         return self.update_errors
 
-    def config_add_db(self, db: str, url: str) -> bool:
+    def _retention_policy(self) -> retention.RetentionPolicy:
+        if not self.config['rotate cdiffs']:
+            return retention.RetentionPolicy()
+        return retention.RetentionPolicy(
+            count=self.config['# cdiffs to keep'],
+            max_age=self._config_value('cdiff max age') * 60 * 60 * 24,
+            max_bytes=self._config_value('cdiff max bytes'))
+
+    def _prune_cdiffs(self) -> None:
+        '''
+        Delete old CDIFFs (and their sign files) according to the retention settings,
+        and make the CDIFF list for each database match what is left on disk.
+        '''
+        try:
+            result = retention.plan_retention(self.db_dir, self.state['dbs'], self._retention_policy())
+        except Exception as exc:
+            self.logger.debug(f"EXCEPTION OCCURRED: {exc}")
+            self.logger.warning(f"Failed to check for old CDIFFs to prune in {self.db_dir}")
+            return
+
+        for name in result.pruned:
+            try:
+                os.remove(str(self.db_dir / name))
+                self.files_changed.add(name)
+                self.logger.debug(f"Pruned {name}")
+            except Exception as exc:
+                self.logger.debug(f"EXCEPTION OCCURRED: {exc}")
+                self.logger.debug(f"Tried to prune {name}, but it wasn't found, maybe someone else removed it already.")
+
+        for db, cdiffs in result.kept.items():
+            self.state['dbs'][db]['CDIFFs'] = cdiffs
+
+    def _write_state_cache(self) -> None:
+        '''
+        Write the state cache, so `cvd list`, `cvd show` and `cvd config show` needn't read the state file.
+        See cvdupdate/statecache.py.
+        '''
+        if not self.persist:
+            return
+
+        try:
+            dbs = list(self._iter_local_databases())
+
+            cvd_headers = {}
+            for db, _ in dbs:
+                if not db.endswith('.cvd'):
+                    continue
+                try:
+                    cvd_headers[db] = cvd.read_raw_cvd_header(self.db_dir / db)
+                except (OSError, ValueError):
+                    continue
+
+            statecache.write_cache(self.config_path, Path(self.config['state file']), self.db_dir, dbs, cvd_headers)
+
+        except Exception as exc:
+            self.logger.debug(f"EXCEPTION OCCURRED: {exc}")
+            self.logger.warning(f"Failed to write the state cache. `cvd list` and `cvd show` will be slower.")
+
+    def _write_manifest(self) -> None:
+        '''
+        Refresh the manifest that downstream `cvd sync` clients and `cvd serve` read.
+
+        If we already have a manifest, only the files changed by this run are
+        looked at. Otherwise the whole database directory is indexed.
+        '''
+        manifest_path = self.db_dir / manifest.MANIFEST_FILE
+        try:
+            previous = manifest.load_manifest(manifest_path)
+            if previous is None:
+                new_manifest = manifest.build_manifest(
+                    self.db_dir,
+                    self.state['dbs'],
+                    self._get_dns_tokens_for_manifest())
+            else:
+                new_manifest = manifest.update_manifest(
+                    previous,
+                    self.db_dir,
+                    self.state['dbs'],
+                    self._get_dns_tokens_for_manifest(),
+                    self.files_changed)
+            manifest.save_manifest(manifest_path, new_manifest)
+            self.files_changed = set()
+            self.logger.debug(f"Updated {manifest_path}")
+        except Exception as exc:
+            self.logger.debug(f"EXCEPTION OCCURRED: {exc}")
+            self.logger.warning(f"Failed to update {manifest_path}")
+
+    def _run_post_update_hooks(self, changed: Set[str]) -> None:
+        '''
+        Start the post update hooks in the background, if any files changed.
+        '''
+        configured = self._config_value('post update hooks')
+        changed = sorted(name for name in changed if manifest.is_listed(name))
+        if configured == [] or changed == []:
+            return
+
+        files = []
+        for name in changed:
+            db, version = manifest.describe_file(name, self.state['dbs'])
+            files.append({
+                "name" : name,
+                "db" : db,
+                "version" : version,
+                "deleted" : not (self.db_dir / name).exists(),
+            })
+        payload = {
+            "dns" : ':'.join(self._get_dns_tokens_for_manifest()),
+            "files" : files,
+        }
+
+        if self._hook_runner is None:
+            self._hook_runner = hooks.HookRunner(self.logger, max_workers=self._config_value('hook workers'))
+
+        self.logger.info(f"Running {len(configured)} post update hook(s) for {len(files)} changed file(s).")
+        self._hook_runner.submit(configured, payload)
+
+    def wait_for_hooks(self) -> int:
+        '''
+        Wait for any post update hooks that are still running.
+
+        Returns: Number of hooks that failed.
+        '''
+        if self._hook_runner is None:
+            return 0
+        return self._hook_runner.wait()
+
+    def _dns_tokens_to_publish(self) -> List[str]:
+        '''
+        The DNS TXT tokens to write to dns.txt after an update.
+
+        Upstream's tokens, except that a database that wasn't brought up-to-date
+        by this update (it failed, or wasn't in it) keeps the version we have,
+        so we never advertise a version that isn't in the database directory.
+        '''
+        tokens = list(self.dns_version_tokens)
+        published = self._read_dns_file()
+        for db, details in self.state['dbs'].items():
+            field = details['DNS field']
+            if field <= 0 or field >= len(tokens):
+                continue
+            if db in self.db_results and self.db_results[db][0] != CvdStatus.ERROR:
+                continue
+
+            if details['local version'] > 0:
+                tokens[field] = str(details['local version'])
+            elif field < len(published):
+                tokens[field] = published[field]
+        return tokens
+
+    def _read_dns_file(self) -> List[str]:
+        dns_file = self.db_dir / 'dns.txt'
+        if dns_file.exists():
+            return dns_file.read_text().strip().split(':')
+        return []
+
+    def _get_dns_tokens_for_manifest(self) -> List[str]:
+        '''
+        Use the tokens from the last dns.txt we wrote, which match the files we have,
+        or else the DNS tokens from this run.
+        '''
+        published = self._read_dns_file()
+        if published != []:
+            return published
+        return self.dns_version_tokens
+
+    @property
+    def snapshot_dir(self) -> Path:
+        return Path(self._config_value('snapshot directory'))
+
+    @property
+    def serve_dir(self) -> Path:
+        '''
+        The directory to serve: the `current` snapshot if snapshots are enabled, else the database directory.
+        '''
+        if self._config_value('snapshots'):
+            current = self.snapshot_dir / snapshots.CURRENT
+            if os.path.lexists(str(current)):
+                return current
+        return self.db_dir
+
+    def _snapshot_is_stale(self) -> bool:
+        '''
+        Check if the database directory has changed since the newest snapshot, by comparing manifests.
+        '''
+        names = snapshots.list_snapshots(self.snapshot_dir)
+        if names == []:
+            return True
+
+        latest = manifest.load_manifest(self.db_dir / manifest.MANIFEST_FILE)
+        newest = manifest.load_manifest(self.snapshot_dir / names[-1] / manifest.MANIFEST_FILE)
+        if latest is None or newest is None:
+            return True
+
+        return latest['files'] != newest['files'] or latest['dns'] != newest['dns']
+
+    def _publish_snapshot(self) -> bool:
+        '''
+        Snapshot the database directory and serve the new snapshot, unless we've been rolled back.
+
+        Does nothing if snapshots are disabled or nothing changed.
+        '''
+        if not self._config_value('snapshots') or not self._snapshot_is_stale():
+            return True
+
+        try:
+            name = snapshots.create_snapshot(self.db_dir, self.snapshot_dir)
+        except Exception as exc:
+            self.logger.debug(f"EXCEPTION OCCURRED: {exc}")
+            self.logger.error(f"Failed to create a snapshot in {self.snapshot_dir}")
+            return False
+
+        pinned = self.state.get('snapshot pinned', "")
+        if pinned != "":
+            self.logger.warning(f"Created snapshot {name}, but still serving {pinned} because of a rollback.")
+            self.logger.warning(f"Run `cvd rollback --release` to serve the newest snapshot.")
+        else:
+            snapshots.switch_current(self.snapshot_dir, name)
+            self.logger.info(f"Now serving snapshot {name}")
+
+        if self.config['rotate cdiffs']:
+            for expired in snapshots.prune_snapshots(self.snapshot_dir, self.config['# cdiffs to keep'], protect=[pinned]):
+                self.logger.info(f"Deleted snapshot {expired}")
+
+        return True
+
+    def snapshot_list(self) -> None:
+        '''
+        Print the snapshots, oldest first, marking the one being served.
+        '''
+        current = snapshots.current_snapshot(self.snapshot_dir)
+        pinned = self.state.get('snapshot pinned', "")
+        for name in snapshots.list_snapshots(self.snapshot_dir):
+            marker = ""
+            if name == current:
+                marker = " (current, pinned by rollback)" if name == pinned else " (current)"
+            self.logger.info(f"{name}{marker}")
+
+    def db_rollback(self, steps: int = 1) -> bool:
+        '''
+        Serve an older snapshot.
+
+        The rollback is pinned, so later updates still create snapshots but don't
+        serve them until the rollback is released.
+        '''
+        names = snapshots.list_snapshots(self.snapshot_dir)
+        current = snapshots.current_snapshot(self.snapshot_dir)
+        if current not in names:
+            self.logger.error(f"No snapshot is being served from {self.snapshot_dir}")
+            return False
+
+        index = names.index(current) - steps
+        if steps < 1 or index < 0:
+            self.logger.error(f"Can't roll back {steps} snapshot(s). There are {names.index(current)} older snapshot(s).")
+            return False
+
+        snapshots.switch_current(self.snapshot_dir, names[index])
+        self.state['snapshot pinned'] = names[index]
+        self._save_config()
+        self.logger.info(f"Rolled back from snapshot {current} to {names[index]}")
+        return True
+
+    def db_rollback_release(self) -> bool:
+        '''
+        Undo a rollback, serving the newest snapshot again.
+        '''
+        names = snapshots.list_snapshots(self.snapshot_dir)
+        if names == []:
+            self.logger.error(f"No snapshots in {self.snapshot_dir}")
+            return False
+
+        snapshots.switch_current(self.snapshot_dir, names[-1])
+        self.state.pop('snapshot pinned', None)
+        self._save_config()
+        self.logger.info(f"Now serving snapshot {names[-1]}")
+        return True
+
+    def db_sync(self, peer_url: str) -> int:
         """
-        Add another database + url to check when we update.
+        Update the database directory from another cvdupdate mirror.
+
+        The upstream mirror's manifest is compared with the local files so that
+        only missing CDIFFs and changed databases are downloaded.
+
+        Returns: Number of errors.
         """
-        extension = db.split('.')[-1]
-        if extension not in [
-            'cvd', 'cld', 'cud',
-            'cfg', 'cat', 'crb',
-            'ftm',
-            'ndb', 'ndu',
-            'ldb', 'ldu', 'idb',
-            'ydb', 'yar', 'yara',
-            'cdb',
-            'cbc',
-            'pdb', 'gdb', 'wdb',
-            'hdb', 'hsb', 'hdu', 'hsu',
-            'mdb', 'msb', 'mdu', 'msu',
-            'ign', 'ign2',
-            'info',
-            ]:
-            self.logger.warning(f"{db} does not have valid clamav database file extension.")
+        errors = 0
+        peer_url = peer_url.rstrip('/')
+        self._manifest_loaded = False
 
-        if db in self.state['dbs']:
-            self.logger.info(f"Cannot add {db}, it is already in our list.")
-            self.logger.info(f"Hint: Try `db list -V` or `db show {db}` for more information.")
+        if not self.db_dir.exists():
+            os.makedirs(self.db_dir)
+
+        result = self.downloader.fetch(DownloadRequest(f"{peer_url}/{manifest.MANIFEST_FILE}"))
+        try:
+            if result.status != 200:
+                raise Exception(result.error or f"HTTP {result.status}")
+            upstream = json.loads(result.content)
+        except Exception as exc:
+            self.logger.debug(f"EXCEPTION OCCURRED: {exc}")
+            self.logger.error(f"Failed to download the manifest from {peer_url}")
+            return 1
+
+        if upstream.get('manifest version') != manifest.MANIFEST_VERSION:
+            self.logger.error(f"Unsupported manifest version from {peer_url}: {upstream.get('manifest version')}")
+            return 1
+
+        local = manifest.build_manifest(
+            self.db_dir,
+            self.state['dbs'],
+            [],
+            previous=self._run_manifest())
+
+        # Don't trust the peer with our file names: nothing outside the database
+        # directory, and nothing we wouldn't download from anywhere else.
+        files = {}
+        for name, entry in upstream['files'].items():
+            if self._is_valid_sync_entry(name, entry):
+                files[name] = entry
+            else:
+                self.logger.error(f"Skipping {name} from {peer_url}, it is not a valid database file.")
+                errors += 1
+
+        # Fetch CDIFFs and sign files before the databases they belong to, just like `cvd update`.
+        def fetch_order(name: str) -> int:
+            return 1 if name == files[name]['db'] else 0
+
+        for name in sorted(files, key=fetch_order):
+            entry = files[name]
+            have = local['files'].get(name)
+
+            if have and have['sha256'] == entry['sha256']:
+                self.logger.debug(f"We already have {name}. Skipping...")
+            elif not self._sync_file(peer_url, name, entry):
+                errors += 1
+                continue
+
+            db = entry['db']
+            if db == "":
+                continue
+
+            if db not in self.state['dbs']:
+                self.logger.info(f"Adding {db} from {peer_url} to DB list.")
+                self.state['dbs'][db] = {
+                    "url" : f"{peer_url}/{db}",
+                    "retry after" : 0,
+                    "last modified" : 0,
+                    "last checked" : 0,
+                    "DNS field" : 0,
+                    "local version" : 0,
+                    "CDIFFs" : []
+                }
+
+            self.state['dbs'][db]['last checked'] = time.time()
+            if name == db:
+                if not have or have['sha256'] != entry['sha256']:
+                    self.state['dbs'][db]['last modified'] = time.time()
+                self.state['dbs'][db]['local version'] = entry['version']
+            elif name.endswith('.cdiff') and name not in self.state['dbs'][db]['CDIFFs']:
+                self.state['dbs'][db]['CDIFFs'].append(name)
+
+        # Mirror the upstream CDIFF retention, so we don't keep CDIFFs forever.
+        for name in local['files']:
+            if ((name.endswith('.cdiff') or name.endswith('.cdiff.sign')) and
+                name not in upstream['files']):
+                try:
+                    os.remove(str(self.db_dir / name))
+                    self.files_changed.add(name)
+                    self.logger.info(f"Deleted {name}, it is no longer on {peer_url}")
+                except Exception as exc:
+                    self.logger.debug(f"EXCEPTION OCCURRED: {exc}")
+                    self.logger.debug(f"Tried to prune {name}, but it wasn't found.")
+
+        for db in self.state['dbs']:
+            self.state['dbs'][db]['CDIFFs'] = [
+                cdiff for cdiff in self.state['dbs'][db]['CDIFFs'] if cdiff in upstream['files']
+            ]
+
+        self._save_config()
+
+        if errors == 0 and upstream['dns'] != "":
+            self.dns_version_tokens = upstream['dns'].split(':')
+            self._publish_file('dns.txt', upstream['dns'].encode('utf-8'))
+            self.logger.debug(f"Updated {self.db_dir / 'dns.txt'}")
+
+        changed = set(self.files_changed)
+        self._write_manifest()
+
+        if errors == 0:
+            self._publish_snapshot()
+
+        self._write_state_cache()
+        self._run_post_update_hooks(changed)
+
+        return errors
+
+    def _is_valid_sync_entry(self, name: str, entry: Any) -> bool:
+        '''
+        Check a file listed in a peer's manifest, and the database it says it belongs to.
+        '''
+        if not self._is_valid_file_name(name) or not isinstance(entry, dict):
+            return False
+
+        # Eg: daily.cvd, daily-27000.cdiff, daily-27000.cdiff.sign or daily-27000.cvd.sign
+        base = name[:-len('.sign')] if name.endswith('.sign') else name
+        if base.split('.')[-1] not in self.db_extensions + ['cdiff']:
+            return False
+
+        db = entry.get('db')
+        if not isinstance(db, str):
+            return False
+        return db == "" or (self._is_valid_file_name(db) and db.split('.')[-1] in self.db_extensions)
+
+    def _sync_file(self, peer_url: str, name: str, entry: dict) -> bool:
+        '''
+        Download a single file from an upstream mirror, and check it against the manifest.
+        '''
+        url = f"{peer_url}/{name}"
+
+        result = self.downloader.fetch(DownloadRequest(url))
+        if result.status == 0:
+            self.logger.error(f"Failed to download {name} from {url}")
+            return False
+
+        if result.status != 200:
+            self.logger.error(f"Failed to download {name} from {url} (HTTP {result.status})")
+            return False
+
+        content = result.content
+        if len(content) != entry['size'] or hashlib.sha256(content).hexdigest() != entry['sha256']:
+            self.logger.error(f"Downloaded {name}, but it does not match the upstream manifest.")
             return False
 
+        try:
+            if not self._publish_file(name, content, 0 if name.endswith('.sign') else entry['version']):
+                return False
+        except Exception as exc:
+            self.logger.debug(f"EXCEPTION OCCURRED: {exc}")
+            self.logger.error(f"Failed to save {name} to {self.db_dir}")
+            return False
+
+        if entry['version'] > 0:
+            self.logger.info(f"Downloaded {name}. Version: {entry['version']}")
+        else:
+            self.logger.info(f"Downloaded {name}")
+
+        return True
+
+    db_extensions: List[str] = [
+        'cvd', 'cld', 'cud',
+        'cfg', 'cat', 'crb',
+        'ftm',
+        'ndb', 'ndu',
+        'ldb', 'ldu', 'idb',
+        'ydb', 'yar', 'yara',
+        'cdb',
+        'cbc',
+        'pdb', 'gdb', 'wdb',
+        'hdb', 'hsb', 'hdu', 'hsu',
+        'mdb', 'msb', 'mdu', 'msu',
+        'ign', 'ign2',
+        'info',
+    ]
+
+    def _add_db(self, db: str, url: str) -> None:
+        '''
+        Add a database to the state, without saving it.
+        '''
         self.state['dbs'][db] = {
             "url" : url,
             "retry after" : 0,
@@ -1298,6 +2832,32 @@ class CVDUpdate:
             "CDIFFs" : []
         }
 
+    def _is_valid_file_name(self, name: Any) -> bool:
+        '''
+        Check that a database name (from a user or a peer) is a plain file name,
+        for a file that belongs in the database directory.
+        '''
+        return (
+            isinstance(name, str) and name != "" and
+            '/' not in name and '\\' not in name and
+            not name.startswith('.') and
+            manifest.is_listed(name))
+
+    def config_add_db(self, db: str, url: str) -> bool:
+        """
+        Add another database + url to check when we update.
+        """
+        extension = db.split('.')[-1]
+        if extension not in self.db_extensions:
+            self.logger.warning(f"{db} does not have valid clamav database file extension.")
+
+        if db in self.state['dbs']:
+            self.logger.info(f"Cannot add {db}, it is already in our list.")
+            self.logger.info(f"Hint: Try `db list -V` or `db show {db}` for more information.")
+            return False
+
+        self._add_db(db, url)
+
         self.logger.info(f"Added {db} ({url}) to DB list.")
         self.logger.info(f"{db} will be downloaded next time you run `cvd update` or `cvd update {db}`")
 
@@ -1305,6 +2865,119 @@ class CVDUpdate:
 
         return True
 
+    def _read_feeds_file(self, path: Path) -> List[Tuple[str, str]]:
+        '''
+        Read a JSON feeds file, either:
+            {"<db>": "<url>", ...}
+        or:
+            [{"db": "<db>", "url": "<url>"}, ...]
+
+        Raises ValueError if the file is not in either format.
+        Raises OSError if the file can't be read.
+        '''
+        with path.open('r') as feeds_file:
+            feeds = json.load(feeds_file)
+
+        if isinstance(feeds, dict):
+            feeds = [{"db": db, "url": url} for db, url in feeds.items()]
+
+        if not isinstance(feeds, list):
+            raise ValueError(f"{path} must be a JSON object or list")
+
+        entries = []
+        for feed in feeds:
+            if not isinstance(feed, dict) or not isinstance(feed.get('db'), str) or not isinstance(feed.get('url'), str):
+                raise ValueError(f"Invalid feed in {path}: {feed}")
+            entries.append((feed['db'], feed['url']))
+        return entries
+
+    def config_add_dbs(self, feeds: List[Tuple[str, str]], prefetch: bool = False) -> int:
+        """
+        Add many databases at once, saving the state just once.
+
+        Unlike `config_add_db()`, feeds with an invalid file extension or URL are
+        rejected rather than added with a warning. Feeds already in our list,
+        or listed twice, are skipped.
+
+        With `prefetch`, the new databases are downloaded in parallel. Only the requests
+        are made in parallel. Each download is then saved, and its sign file downloaded,
+        one at a time on this thread.
+
+        Returns: Number of feeds rejected or that failed to download.
+        """
+        errors = 0
+        known_urls = {details['url'] for details in self.state['dbs'].values()}
+        added = []
+
+        for db, url in feeds:
+            if db.split('.')[-1] not in self.db_extensions:
+                self.logger.error(f"Cannot add {db}, it does not have a valid clamav database file extension.")
+                errors += 1
+            elif not self._is_valid_file_name(db):
+                self.logger.error(f"Cannot add {db}, it is not a valid file name.")
+                errors += 1
+            elif not url.startswith('http'):
+                self.logger.error(f"Cannot add {db}, invalid URL: {url}")
+                errors += 1
+            elif db in self.state['dbs']:
+                self.logger.info(f"Skipping {db}, it is already in our list.")
+            elif url in known_urls:
+                self.logger.info(f"Skipping {db}, {url} is already in our list.")
+            else:
+                self._add_db(db, url)
+                known_urls.add(url)
+                added.append(db)
+                self.logger.info(f"Added {db} ({url}) to DB list.")
+
+        if added == []:
+            return errors
+
+        self._save_config()
+        self.logger.info(f"Added {len(added)} databases.")
+
+        if prefetch:
+            if not self.db_dir.exists():
+                os.makedirs(self.db_dir)
+
+            self._manifest_loaded = False
+
+            prefetched = self._fetch_batch({
+                db: DownloadRequest(self.state['dbs'][db]['url'], if_modified_since=0) for db in added
+                if self.shared_downloads is None or self.state['dbs'][db]['url'] not in self.shared_downloads
+            })
+            for db in added:
+                status = self._download_db_from_url(
+                    db,
+                    self.state['dbs'][db]['url'],
+                    last_modified=0,
+                    prefetched=prefetched.get(db))
+                self.state['dbs'][db]['last checked'] = time.time()
+                if status == CvdStatus.ERROR:
+                    self.logger.error(f"Failed to download {db}")
+                    errors += 1
+
+            self._save_config()
+            self._write_manifest()
+        else:
+            self.logger.info(f"They will be downloaded next time you run `cvd update`")
+
+        return errors
+
+    def config_import_dbs(self, feeds_path: Path, prefetch: bool = False) -> int:
+        """
+        Add the databases listed in a JSON feeds file. See `config_add_dbs()`.
+
+        Returns: Number of errors.
+        """
+        try:
+            feeds = self._read_feeds_file(feeds_path)
+        except Exception as exc:
+            self.logger.debug(f"EXCEPTION OCCURRED: {exc}")
+            self.logger.error(f"Failed to read {feeds_path}: {exc}")
+            return 1
+
+        return self.config_add_dbs(feeds, prefetch=prefetch)
+
     def config_remove_db(self, db: str) -> bool:
         """
         Remove a database from our list, and delete copies of the DB from the database directory.
@@ -1317,6 +2990,7 @@ class CVDUpdate:
         try:
             if (self.db_dir / db).exists():
                 os.remove(str(self.db_dir / db))
+                self.files_changed.add(db)
                 self.logger.info(f"Deleted {db} from database directory.")
 
         except Exception as exc:
@@ -1327,6 +3001,7 @@ class CVDUpdate:
             try:
                 if (self.db_dir / cdiff).exists():
                     os.remove(str(self.db_dir / cdiff))
+                    self.files_changed.add(cdiff)
                     self.logger.info(f"Deleted {cdiff} from database directory.")
 
             except Exception as exc:
@@ -1339,4 +3014,7 @@ class CVDUpdate:
 
         self._save_config()
 
+        if self.db_dir.exists():
+            self._write_manifest()
+
         return True
@@ -0,0 +1,287 @@
+"""
+Copyright (C) 2021-2025 Cisco Systems, Inc. and/or its affiliates. All rights reserved.
+
+This module provides `cvd daemon`, a long running alternative to running
+`cvd update` from cron.
+
+One CVDUpdate instance is kept for the life of the process, so the config,
+state, HTTP connections and DNS answer stay warm between updates. Each
+database is scheduled on its own:
+
+- Databases with a DNS field are checked again when the DNS TXT answer expires.
+- Other databases are checked every "update interval" seconds.
+- Databases on cool-down are not checked again until the cool-down expires.
+
+A random delay of up to "update jitter" seconds is added to each, so that
+many mirrors don't all hit the CDN at the same moment.
+
+Send SIGHUP to reload the config and state files.
+
+It also provides `cvd watch`, which only polls the DNS TXT record and updates
+the databases whose DNS field changed. The polling interval adapts to how
+often new versions have been published.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import collections
+import datetime
+import heapq
+import random
+import signal
+import statistics
+import threading
+import time
+from typing import *
+
+from cvdupdate.cvdupdate import CVDUpdate, CvdStatus
+
+# Never check a database more often than this, even if the DNS TTL is shorter.
+MIN_INTERVAL = 60
+
+
+class UpdateDaemon:
+
+    def __init__(self, m: CVDUpdate, interval: int = 0, jitter: int = -1) -> None:
+        """
+        Args:
+            m:          The CVDUpdate instance to keep warm.
+            interval:   Override the "update interval" config setting.
+            jitter:     Override the "update jitter" config setting.
+        """
+        self.m = m
+        self.interval_override = interval
+        self.jitter_override = jitter
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self.reload_requested = False
+        self.schedule: List[Tuple[float, str]] = []
+
+    @property
+    def interval(self) -> int:
+        if self.interval_override > 0:
+            return self.interval_override
+        return self.m._config_value('update interval')
+
+    @property
+    def jitter(self) -> int:
+        if self.jitter_override >= 0:
+            return self.jitter_override
+        return self.m._config_value('update jitter')
+
+    def _next_check(self, db: str, now: float) -> float:
+        """
+        Work out when a database should next be checked.
+        """
+        details = self.m.state['dbs'][db]
+
+        if details['retry after'] > now:
+            when = details['retry after']
+        elif details['DNS field'] > 0 and self.m.dns_expires > now:
+            when = max(self.m.dns_expires, now + MIN_INTERVAL)
+        else:
+            when = now + self.interval
+
+        return when + random.uniform(0, self.jitter)
+
+    def _reschedule_all(self) -> None:
+        """
+        Schedule every database in the state to be checked right away.
+        """
+        now = time.time()
+        self.schedule = [(now, db) for db in self.m.state['dbs']]
+        heapq.heapify(self.schedule)
+
+    def _handle_sighup(self, signum, frame) -> None:
+        self.reload_requested = True
+        self.wakeup.set()
+
+    def _handle_stop(self, signum, frame) -> None:
+        self.stop()
+
+    def stop(self) -> None:
+        self.stopping = True
+        self.wakeup.set()
+
+    def install_signal_handlers(self) -> None:
+        """
+        Must be called from the main thread.
+        """
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self._handle_sighup)
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+
+    def run_once(self) -> int:
+        """
+        Update every database that is due.
+
+        Returns: Number of errors.
+        """
+        now = time.time()
+        due = []
+        while self.schedule and self.schedule[0][0] <= now:
+            db = heapq.heappop(self.schedule)[1]
+            # Skip any removed from the state since they were scheduled.
+            if db in self.m.state['dbs'] and db not in due:
+                due.append(db)
+
+        if due == []:
+            return 0
+
+        # One update for all of them, so they're published together (one snapshot, one run of the hooks).
+        errors = self.m.db_update(dbs=due)
+        for db in due:
+            heapq.heappush(self.schedule, (self._next_check(db, time.time()), db))
+
+        return errors
+
+    def run(self) -> None:
+        """
+        Keep the databases up-to-date until stopped.
+        """
+        self.m.logger.info(f"Starting update daemon for {len(self.m.state['dbs'])} databases.")
+        self._reschedule_all()
+        log_date = datetime.date.today()
+
+        while not self.stopping:
+            if self.reload_requested:
+                self.reload_requested = False
+                self.m.logger.info(f"Reloading {self.m.config_path}")
+                self.m.reload_config()
+                self._reschedule_all()
+
+            if datetime.date.today() != log_date:
+                # Start the next day's log file, and prune old ones.
+                log_date = datetime.date.today()
+                self.m._init_logging()
+
+            errors = self.run_once()
+            if errors > 0:
+                self.m.logger.error(f"Failed to update {errors} database(s), will try again later.")
+
+            if self.schedule:
+                when, db = self.schedule[0]
+                delay = max(0, when - time.time())
+                next_date = datetime.datetime.fromtimestamp(when).strftime('%Y-%m-%d %H:%M:%S')
+                self.m.logger.debug(f"Next check: {db} at {next_date}")
+            else:
+                delay = self.interval
+
+            self.wakeup.wait(delay)
+            self.wakeup.clear()
+
+        self.m.logger.info("Update daemon stopped.")
+
+
+class DnsWatcher(UpdateDaemon):
+    """
+    Poll the DNS TXT record, and update only the databases whose DNS field changes.
+
+    The poll interval adapts to the observed publishing cadence: we poll slowly
+    right after a new version is published, more often as the next one becomes
+    due, and back off again if it is late.
+    """
+
+    def __init__(self, m: CVDUpdate, min_interval: int = MIN_INTERVAL, max_interval: int = 60 * 60) -> None:
+        super().__init__(m)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.tokens: List[str] = []
+        self.changes: Deque[float] = collections.deque(maxlen=10)
+        self.overdue_polls = 0
+
+    def _cadence(self) -> Optional[float]:
+        """
+        The typical time between publications we've seen, if we've seen enough.
+        """
+        if len(self.changes) < 2:
+            return None
+        changes = list(self.changes)
+        return statistics.median(b - a for a, b in zip(changes, changes[1:]))
+
+    def _poll_interval(self, now: float) -> float:
+        cadence = self._cadence()
+        if cadence is None:
+            interval = self.min_interval * 5
+        else:
+            remaining = self.changes[-1] + cadence - now
+            if remaining > 0:
+                # Halve the remaining time, so we poll more often as the next publication gets closer.
+                interval = remaining / 2
+                self.overdue_polls = 0
+            else:
+                # It's late, back off so we don't poll at the minimum interval forever.
+                interval = self.min_interval * 2 ** self.overdue_polls
+                self.overdue_polls += 1
+
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def poll(self) -> int:
+        """
+        Query the DNS TXT record once, and update any databases that changed.
+
+        Returns: Number of errors.
+        """
+        if not self.m._query_dns_txt_entry():
+            return 1
+
+        old_tokens = self.tokens
+        new_tokens = list(self.m.dns_version_tokens)
+        changed = self.m._dns_changed_dbs(old_tokens, new_tokens)
+        if old_tokens != [] and changed != []:
+            self.changes.append(time.time())
+
+        if changed == []:
+            self.tokens = new_tokens
+            return 0
+
+        for db in changed:
+            self.m.logger.info(f"DNS advertises a new version of {db}.")
+        errors = self.m.db_update(dbs=changed)
+
+        for db in changed:
+            status = self.m.db_results[db][0] if db in self.m.db_results else CvdStatus.ERROR
+            if status == CvdStatus.ERROR:
+                # Pretend we haven't seen the new version yet, so we try again at the next poll.
+                field = self.m.state['dbs'][db]['DNS field']
+                new_tokens[field] = old_tokens[field] if field < len(old_tokens) else ""
+
+        self.tokens = new_tokens
+        return errors
+
+    def run(self) -> None:
+        """
+        Watch for new versions until stopped.
+        """
+        self.m.logger.info(f"Watching current.cvd.clamav.net for new database versions.")
+
+        # Start from what we last published, so we catch anything that changed while we weren't watching.
+        self.tokens = self.m._get_dns_tokens_for_manifest()
+
+        while not self.stopping:
+            if self.reload_requested:
+                self.reload_requested = False
+                self.m.logger.info(f"Reloading {self.m.config_path}")
+                self.m.reload_config()
+
+            errors = self.poll()
+            if errors > 0:
+                self.m.logger.error(f"Failed to update {errors} database(s), will try again at the next change.")
+
+            interval = self._poll_interval(time.time())
+            self.m.logger.debug(f"Next DNS poll in {int(interval)} seconds.")
+            self.wakeup.wait(interval)
+            self.wakeup.clear()
+
+        self.m.logger.info("DNS watcher stopped.")
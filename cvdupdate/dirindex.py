@@ -0,0 +1,253 @@
+"""
+Copyright (C) 2021-2025 Cisco Systems, Inc. and/or its affiliates. All rights reserved.
+
+This module provides DirectoryIndex, which keeps the listing of the directory
+served by `cvd serve` in memory.
+
+FreshClam probes for CDIFFs that don't exist yet, so a busy mirror answers
+lots of requests for missing files. With the index, those 404s (and HEAD
+requests) are answered without touching the filesystem, and the most
+requested files are kept open rather than opened for each request.
+
+The index is refreshed when an update run by `cvd serve` completes. Otherwise
+(eg: `cvd update` run from cron), the directory is stat'ed at most once every
+`max_age` seconds, and listed again only if it changed. Files are always
+replaced by renaming them into the directory, which changes its mtime.
+The standard library has no portable way to watch a directory, or we'd do that.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import *
+
+
+def _file_key(st: os.stat_result) -> Tuple[int, int, int]:
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class _Handle:
+    """
+    An open file, shared by the requests reading it. Closed once it is dropped
+    from the index and the last request is done with it.
+    """
+
+    def __init__(self, raw: io.FileIO, key: Tuple[int, int, int]) -> None:
+        self.raw = raw
+        self.key = key
+        self.users = 0
+        self.cached = False
+
+
+class IndexedFile:
+    """
+    A file opened through a DirectoryIndex, for one request.
+
+    Reads with pread(), so requests can share the same file descriptor.
+    """
+
+    def __init__(self, index: "DirectoryIndex", handle: _Handle, stat: os.stat_result) -> None:
+        self.index = index
+        self.handle = handle
+        self.stat = stat
+        self.position = 0
+        self.closed = False
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = max(self.stat.st_size - self.position, 0)
+        if hasattr(os, 'pread'):
+            data = os.pread(self.handle.raw.fileno(), size, self.position)
+        else:
+            # Without pread the handle isn't shared, so seeking is safe.
+            self.handle.raw.seek(self.position)
+            data = self.handle.raw.read(size)
+        self.position += len(data)
+        return data
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.stat.st_size
+        self.position = offset
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+    def close(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self.index._release(self.handle)
+
+    def __enter__(self) -> "IndexedFile":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class DirectoryIndex:
+    """
+    The files in a directory, listed once and kept in memory. Thread-safe.
+    """
+
+    def __init__(self, directory: Union[Path, Callable[[], Path]], max_age: float = 1.0, max_open: int = 32) -> None:
+        """
+        Args:
+            directory:  The directory to index. May be a symlink, eg: the `current` snapshot.
+                        Or a function that finds it, called at each refresh (eg: to follow
+                        the first snapshot being published).
+            max_age:    Seconds to trust the listing before checking if the directory changed.
+            max_open:   How many of the most recently requested files to keep open.
+        """
+        self.locate = directory if callable(directory) else lambda: directory
+        self.directory = self.locate()
+        self.max_age = max_age
+        # Shared handles need pread(), which isn't available on Windows.
+        self.max_open = max_open if hasattr(os, 'pread') else 0
+        self.lock = threading.Lock()
+        self.dir_key: Optional[Tuple[int, int, int]] = None
+        self.checked = 0.0
+        self.files: Dict[str, os.stat_result] = {}
+        self.dirs: Set[str] = set()
+        self.handles: "OrderedDict[str, _Handle]" = OrderedDict()
+
+    def invalidate(self) -> None:
+        """
+        List the directory again before the next lookup, eg: after an update.
+        """
+        with self.lock:
+            self.dir_key = None
+
+    def _refresh(self) -> None:
+        # Call with the lock held.
+        now = time.monotonic()
+        if self.dir_key is not None and now - self.checked < self.max_age:
+            return
+        self.checked = now
+        self.directory = self.locate()
+
+        try:
+            st = os.stat(str(self.directory))
+        except OSError:
+            # Eg: no databases downloaded yet.
+            self._replace_listing(None, {}, set())
+            return
+
+        dir_key = (st.st_dev, st.st_ino, st.st_mtime_ns)
+        if dir_key == self.dir_key:
+            return
+
+        files = {}
+        dirs = set()
+        try:
+            with os.scandir(str(self.directory)) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file():
+                            files[entry.name] = entry.stat()
+                        elif entry.is_dir():
+                            dirs.add(entry.name)
+                    except OSError:
+                        # Removed while we were listing.
+                        continue
+        except OSError:
+            self._replace_listing(None, {}, set())
+            return
+
+        self._replace_listing(dir_key, files, dirs)
+
+    def _replace_listing(self, dir_key: Optional[Tuple[int, int, int]], files: Dict[str, os.stat_result], dirs: Set[str]) -> None:
+        self.dir_key = dir_key
+        self.files = files
+        self.dirs = dirs
+        for name, handle in list(self.handles.items()):
+            if name not in files or _file_key(files[name]) != handle.key:
+                self._drop(name)
+
+    def _drop(self, name: str) -> None:
+        handle = self.handles.pop(name)
+        handle.cached = False
+        if handle.users == 0:
+            handle.raw.close()
+
+    def _release(self, handle: _Handle) -> None:
+        with self.lock:
+            handle.users -= 1
+            if not handle.cached and handle.users == 0:
+                handle.raw.close()
+
+    def stat(self, name: str) -> Optional[os.stat_result]:
+        """
+        Get a file's stat from the listing, or None if there is no such file.
+        """
+        with self.lock:
+            self._refresh()
+            return self.files.get(name)
+
+    def is_dir(self, name: str) -> bool:
+        with self.lock:
+            self._refresh()
+            return name in self.dirs
+
+    def open(self, name: str) -> Optional[IndexedFile]:
+        """
+        Open a file for reading, reusing its handle if it's already open.
+        Returns None if there is no such file.
+        """
+        with self.lock:
+            self._refresh()
+            listed = self.files.get(name)
+            if listed is None:
+                return None
+
+            handle = self.handles.get(name)
+            if handle is not None:
+                self.handles.move_to_end(name)
+                handle.users += 1
+                return IndexedFile(self, handle, listed)
+
+            try:
+                raw = io.FileIO(str(self.directory / name), 'r')
+            except OSError:
+                # Removed since we listed the directory.
+                self.dir_key = None
+                return None
+
+            st = os.fstat(raw.fileno())
+            handle = _Handle(raw, _file_key(st))
+            handle.users = 1
+            if handle.key != _file_key(listed):
+                # Replaced since we listed the directory. Serve the new file, but list it again next time.
+                self.dir_key = None
+            elif self.max_open > 0:
+                handle.cached = True
+                self.handles[name] = handle
+                while len(self.handles) > self.max_open:
+                    self._drop(next(iter(self.handles)))
+            return IndexedFile(self, handle, st)
+
+    def close(self) -> None:
+        """
+        Close the handles that aren't in use, and those that are once their requests are done.
+        """
+        with self.lock:
+            for name in list(self.handles):
+                self._drop(name)
@@ -0,0 +1,240 @@
+"""
+Copyright (C) 2021-2025 Cisco Systems, Inc. and/or its affiliates. All rights reserved.
+
+This module provides a tiny DNS server that answers TXT queries for
+current.cvd.<domain> with the DNS TXT record from the last update.
+
+That lets FreshClam on air-gapped networks check for new versions with a
+single UDP packet, using `DNSDatabaseInfo current.cvd.<domain>`, instead of
+downloading CVD headers over HTTP.
+
+The answer is kept in memory and swapped in one step whenever `cvd update`
+writes a new dns.txt. Nothing else is supported: queries for other names get
+NXDOMAIN (or REFUSED, outside our domain), and other query types get an empty
+answer.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import *
+
+# Same as current.cvd.clamav.net.
+DEFAULT_TTL = 1800
+
+# How often to check if dns.txt changed.
+RELOAD_INTERVAL = 5
+
+QTYPE_TXT = 16
+QTYPE_ANY = 255
+QCLASS_IN = 1
+
+RCODE_NOERROR = 0
+RCODE_FORMERR = 1
+RCODE_NXDOMAIN = 3
+RCODE_NOTIMP = 4
+RCODE_REFUSED = 5
+
+_HEADER = struct.Struct('!HHHHHH')
+
+
+class Question(NamedTuple):
+    name: str
+    qtype: int
+    qclass: int
+    end: int  # Offset of the end of the question in the query.
+
+
+def parse_question(query: bytes) -> Question:
+    """
+    Parse the first question in a DNS query.
+
+    Raises ValueError if the query is malformed.
+    """
+    if len(query) < _HEADER.size:
+        raise ValueError("Query is too short")
+
+    labels = []
+    offset = _HEADER.size
+    while True:
+        if offset >= len(query):
+            raise ValueError("Query name is truncated")
+        length = query[offset]
+        offset += 1
+        if length == 0:
+            break
+        if length > 63:
+            # Compression pointers aren't used in questions.
+            raise ValueError("Invalid label length")
+        labels.append(query[offset:offset + length].decode('ascii', 'replace').lower())
+        offset += length
+
+    if offset + 4 > len(query):
+        raise ValueError("Query is truncated")
+    qtype, qclass = struct.unpack_from('!HH', query, offset)
+
+    return Question('.'.join(labels), qtype, qclass, offset + 4)
+
+
+def _txt_rdata(txt: bytes) -> bytes:
+    # A TXT record is a list of strings of up to 255 bytes each.
+    chunks = [txt[i:i + 255] for i in range(0, len(txt), 255)] or [b'']
+    return b''.join(bytes([len(chunk)]) + chunk for chunk in chunks)
+
+
+def build_response(query: bytes, domain: str, txt: bytes, ttl: int = DEFAULT_TTL) -> Optional[bytes]:
+    """
+    Build the response to a query, or None if it's too malformed to answer.
+    """
+    if len(query) < _HEADER.size:
+        return None
+
+    query_id, flags, qdcount, _, _, _ = _HEADER.unpack_from(query)
+    if flags & 0x8000:
+        # A response, not a query. Don't reply, or we might end up in a loop.
+        return None
+
+    opcode = (flags >> 11) & 0xF
+    # QR, the opcode, AA and RD.
+    response_flags = 0x8000 | (opcode << 11) | 0x0400 | (flags & 0x0100)
+
+    if opcode != 0:
+        return _HEADER.pack(query_id, response_flags | RCODE_NOTIMP, 0, 0, 0, 0)
+
+    try:
+        if qdcount != 1:
+            raise ValueError("Expected one question")
+        question = parse_question(query)
+    except ValueError:
+        return _HEADER.pack(query_id, response_flags | RCODE_FORMERR, 0, 0, 0, 0)
+
+    domain = domain.lower().rstrip('.')
+    record_name = f"current.cvd.{domain}"
+    answers = b''
+
+    if question.name != record_name:
+        in_zone = question.name == domain or question.name.endswith(f".{domain}")
+        rcode = RCODE_NXDOMAIN if in_zone else RCODE_REFUSED
+    elif question.qclass != QCLASS_IN or question.qtype not in (QTYPE_TXT, QTYPE_ANY) or txt == b'':
+        rcode = RCODE_NOERROR
+    else:
+        rcode = RCODE_NOERROR
+        rdata = _txt_rdata(txt)
+        # The name is a pointer to the name in the question, at offset 12.
+        answers = b'\xc0\x0c' + struct.pack('!HHIH', QTYPE_TXT, QCLASS_IN, ttl, len(rdata)) + rdata
+
+    return (
+        _HEADER.pack(query_id, response_flags | rcode, 1, 1 if answers else 0, 0, 0) +
+        query[_HEADER.size:question.end] +
+        answers)
+
+
+class DnsTxtResponder:
+
+    def __init__(self,
+                 domain: str,
+                 dns_file: Union[Path, Callable[[], Path]],
+                 address: str = "",
+                 port: int = 53,
+                 ttl: int = DEFAULT_TTL,
+                 logger: Optional[logging.Logger] = None) -> None:
+        """
+        Args:
+            domain:     Answer for current.cvd.<domain>.
+            dns_file:   The dns.txt written by `cvd update`, or a function that finds it
+                        (eg: in the snapshot being served), called at each reload.
+            address:    Address to listen on. Default: all.
+            port:       UDP port to listen on. 0 picks a free port.
+            ttl:        TTL for the TXT record, in seconds.
+            logger:     Where to log. Default: the "cvdupdate" logger.
+        """
+        self.logger = logger if logger is not None else logging.getLogger("cvdupdate")
+        self.domain = domain
+        self.locate_dns_file = dns_file if callable(dns_file) else lambda: dns_file
+        self.ttl = ttl
+        self.txt = b''
+        self.dns_file_key = None
+        self.stopping = False
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((address, port))
+        self.sock.settimeout(RELOAD_INTERVAL)
+        self.reload()
+
+    @property
+    def port(self) -> int:
+        return self.sock.getsockname()[1]
+
+    def reload(self) -> bool:
+        """
+        Reload the TXT record from dns.txt, if it changed.
+
+        Returns True if it was reloaded.
+        """
+        dns_file = self.locate_dns_file()
+        try:
+            st = os.stat(str(dns_file))
+            # The inode too, because dns.txt is replaced rather than rewritten.
+            key = (st.st_ino, st.st_mtime_ns, st.st_size)
+            if key == self.dns_file_key:
+                return False
+            txt = dns_file.read_bytes().strip()
+        except OSError:
+            return False
+
+        # One assignment, so a reply never has half of the old record and half of the new one.
+        self.txt = txt
+        self.dns_file_key = key
+        self.logger.info(f"Answering current.cvd.{self.domain} with: {txt.decode('ascii', 'replace')}")
+        return True
+
+    def serve_forever(self) -> None:
+        next_reload = time.monotonic() + RELOAD_INTERVAL
+        while not self.stopping:
+            if time.monotonic() >= next_reload:
+                self.reload()
+                next_reload = time.monotonic() + RELOAD_INTERVAL
+
+            try:
+                query, client = self.sock.recvfrom(512)
+            except socket.timeout:
+                continue
+            except OSError:
+                if self.stopping:
+                    break
+                raise
+
+            response = build_response(query, self.domain, self.txt, self.ttl)
+            if response is not None:
+                try:
+                    self.sock.sendto(response, client)
+                except OSError as exc:
+                    self.logger.debug(f"Failed to reply to {client}: {exc}")
+
+    def start(self) -> threading.Thread:
+        """
+        Serve in a background thread.
+        """
+        thread = threading.Thread(target=self.serve_forever, daemon=True, name='cvd-dns')
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        self.stopping = True
+        self.sock.close()
@@ -0,0 +1,314 @@
+"""
+Copyright (C) 2021-2025 Cisco Systems, Inc. and/or its affiliates. All rights reserved.
+
+This module makes the HTTP requests for CVD-Update.
+
+Each request is described by a DownloadRequest, and each outcome by a
+DownloadResult, so the retry and truncation handling lives in one place and
+callers only decide what a status code means for their file.
+
+- Downloader fetches one request at a time.
+- ThreadedDownloader fetches a batch of requests on a thread pool.
+- Either can be awaited from asyncio with `fetch_async()`.
+- `fetch_segmented()` downloads a large file over several connections at once,
+  one byte range each, straight into a preallocated file.
+
+All of them reuse the connections of one HTTP session.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import asyncio
+import datetime
+import errno
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import *
+
+# How long to wait after a 429 response without a Retry-After header.
+DEFAULT_RETRY_AFTER = 60 * 60 * 12
+
+# Bytes written to a segmented download at a time.
+_WRITE_CHUNK = 1024 * 1024
+
+
+def http_date(timestamp: float) -> str:
+    return datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc).strftime('%a, %d %b %Y %H:%M:%S GMT')
+
+
+class DownloadRequest(NamedTuple):
+    url: str
+    method: str = 'GET'
+    if_modified_since: Optional[float] = None  # Unix time.
+    if_none_match: str = ""
+    byte_range: str = ""                       # Eg: "bytes=0-95"
+    read_body: bool = True                     # False to only get the status and headers.
+    headers: Optional[Dict[str, str]] = None   # Any other headers.
+
+
+class DownloadResult(NamedTuple):
+    request: DownloadRequest
+    status: int                   # HTTP status code, or 0 if there was no response.
+    content: bytes
+    headers: Mapping[str, str]
+    truncated: bool               # Still shorter than the Content-Length after every retry.
+    attempts: int
+    elapsed: float                # Seconds, for all attempts.
+    error: str = ""               # Why there was no response.
+    size: int = -1                # Bytes received, if not kept in `content` (eg: saved to a file).
+
+    @property
+    def ok(self) -> bool:
+        return self.status in (200, 206) and not self.truncated
+
+    @property
+    def received(self) -> int:
+        return self.size if self.size >= 0 else len(self.content)
+
+    @property
+    def retry_after(self) -> int:
+        """
+        Seconds to wait after a 429 response.
+        """
+        try:
+            return int(self.headers['Retry-After'])
+        except (KeyError, ValueError):
+            return DEFAULT_RETRY_AFTER
+
+
+class Segment(NamedTuple):
+    start: int
+    end: int    # Inclusive, as in a Range header.
+
+    @property
+    def length(self) -> int:
+        return self.end - self.start + 1
+
+
+def plan_segments(size: int, count: int) -> List[Segment]:
+    """
+    Split a file into `count` byte ranges of about the same size.
+    """
+    count = max(min(count, size), 1)
+    step = -(-size // count)  # Rounded up.
+    return [Segment(start, min(start + step, size) - 1) for start in range(0, size, step)]
+
+
+def preallocate(path: Path, size: int) -> None:
+    """
+    Create a file of the given size, reserving the disk space up-front where the OS supports it.
+
+    Raises OSError if there isn't room (on most filesystems).
+    """
+    with path.open('wb') as new_file:
+        if hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(new_file.fileno(), 0, size)
+                return
+            except OSError as exc:
+                # Not supported by this filesystem. Fall back to a sparse file.
+                if exc.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+                    raise
+        new_file.truncate(size)
+
+
+class Downloader:
+
+    def __init__(self, session: Any, user_agent: str, max_retry: int, logger: Optional[logging.Logger] = None) -> None:
+        """
+        Args:
+            session:    A requests.Session (or anything with the same get/head methods).
+            user_agent: Sent with every request.
+            max_retry:  Attempts per request, if the response is truncated or fails to arrive.
+            logger:     Where to log retries.
+        """
+        self.session = session
+        self.user_agent = user_agent
+        self.max_retry = max(max_retry, 1)
+        self.logger = logger if logger is not None else logging.getLogger("cvdupdate")
+
+    def _headers(self, request: DownloadRequest) -> Dict[str, str]:
+        headers = {'User-Agent': self.user_agent}
+        if request.if_modified_since is not None:
+            headers['If-Modified-Since'] = http_date(request.if_modified_since)
+        if request.if_none_match != "":
+            headers['If-None-Match'] = request.if_none_match
+        if request.byte_range != "":
+            headers['Range'] = request.byte_range
+        if request.headers is not None:
+            headers.update(request.headers)
+        return headers
+
+    def _send(self, request: DownloadRequest) -> Tuple[int, bytes, Mapping[str, str]]:
+        headers = self._headers(request)
+        if request.method == 'HEAD':
+            response = self.session.head(request.url, headers=headers, allow_redirects=True)
+            return response.status_code, b'', response.headers
+
+        if not request.read_body:
+            # Streamed and closed, so the body is never downloaded, eg: if the server ignores a Range.
+            response = self.session.get(request.url, headers=headers, stream=True)
+            response.close()
+            return response.status_code, b'', response.headers
+
+        response = self.session.get(request.url, headers=headers)
+        return response.status_code, response.content, response.headers
+
+    def fetch(self, request: DownloadRequest) -> DownloadResult:
+        """
+        Make a request, retrying if the response is truncated or fails to arrive.
+        """
+        start = time.monotonic()
+        status, content, headers, truncated, error = 0, b'', {}, False, ""
+
+        attempts = 0
+        while attempts < self.max_retry:
+            attempts += 1
+            try:
+                status, content, headers = self._send(request)
+                error = ""
+            except Exception as exc:
+                self.logger.debug(f"EXCEPTION OCCURRED: {exc}")
+                status, content, headers, error = 0, b'', {}, str(exc)
+                continue
+
+            truncated = (
+                request.read_body and request.method == 'GET' and
+                status in (200, 206) and
+                'content-length' in headers and
+                int(headers['content-length']) > len(content))
+            if not truncated:
+                break
+
+            self.logger.warning(f"Response was truncated somehow...")
+            self.logger.warning(f"   Expected {headers['content-length']}")
+            self.logger.warning(f"   Received {len(content)} bytes, let's retry.")
+
+        return DownloadResult(
+            request=request,
+            status=status,
+            content=content,
+            headers=headers,
+            truncated=truncated,
+            attempts=attempts,
+            elapsed=time.monotonic() - start,
+            error=error)
+
+    def fetch_all(self, requests: Iterable[DownloadRequest]) -> List[DownloadResult]:
+        """
+        Make several requests. Results are in the same order as the requests.
+        """
+        return [self.fetch(request) for request in requests]
+
+    def _fetch_segment(self, request: DownloadRequest, segment: Segment, total: int, validator: str, path: Path) -> Tuple[int, int, str]:
+        """
+        Download one segment into its place in the file, retrying until it's right.
+
+        Returns: (HTTP status of the last attempt, attempts, error). The error is "" on success.
+        """
+        headers = dict(request.headers or {})
+        if validator != "":
+            # If the file changes between segments, get a 200 with the whole new file instead.
+            headers['If-Range'] = validator
+        segment_request = request._replace(byte_range=f'bytes={segment.start}-{segment.end}', headers=headers)
+        expected_range = f'bytes {segment.start}-{segment.end}/{total}'
+
+        status, error = 0, ""
+        for attempt in range(1, self.max_retry + 1):
+            try:
+                status, content, response_headers = self._send(segment_request)
+            except Exception as exc:
+                self.logger.debug(f"EXCEPTION OCCURRED: {exc}")
+                status, error = 0, str(exc)
+                continue
+
+            if status != 206:
+                # Eg: 200, the server ignored the Range or the file changed. Retrying won't help.
+                return status, attempt, f"Expected 206 Partial Content, got {status}"
+
+            if response_headers.get('Content-Range', '') != expected_range or len(content) != segment.length:
+                error = f"Expected {expected_range}, got {response_headers.get('Content-Range', '')} with {len(content)} bytes"
+                self.logger.warning(f"Segment {segment.start}-{segment.end} was not what we asked for, let's retry.")
+                continue
+
+            with path.open('r+b') as partial:
+                partial.seek(segment.start)
+                for offset in range(0, len(content), _WRITE_CHUNK):
+                    partial.write(content[offset:offset + _WRITE_CHUNK])
+            return status, attempt, ""
+
+        return status, self.max_retry, error
+
+    def fetch_segmented(self, request: DownloadRequest, path: Path, size: int, segments: int, validator: str = "") -> DownloadResult:
+        """
+        Download a file over several connections at once, one byte range each,
+        into a file preallocated to `size` bytes. Each range is checked and
+        retried on its own.
+
+        Only use this if the server sent `Accept-Ranges: bytes` and the size.
+
+        Args:
+            path:       Where to write. Created (or replaced) at the full size first.
+            size:       The file size, from the Content-Length.
+            segments:   Connections to use.
+            validator:  The ETag (or Last-Modified) of the file, so a file that changes
+                        part-way through isn't stitched together from two versions.
+
+        Returns: A result with the content left empty, which is `ok` if every segment was downloaded.
+        """
+        start = time.monotonic()
+        preallocate(path, size)
+
+        planned = plan_segments(size, segments)
+        with ThreadPoolExecutor(max_workers=len(planned), thread_name_prefix='cvd-segment') as pool:
+            outcomes = list(pool.map(lambda segment: self._fetch_segment(request, segment, size, validator, path), planned))
+
+        failed = [(segment, outcome) for segment, outcome in zip(planned, outcomes) if outcome[2] != ""]
+        status = 200 if len(failed) == 0 else failed[0][1][0]
+        return DownloadResult(
+            request=request,
+            status=status,
+            content=b'',
+            headers={},
+            truncated=len(failed) > 0,
+            attempts=sum(outcome[1] for outcome in outcomes),
+            elapsed=time.monotonic() - start,
+            error=failed[0][1][2] if len(failed) > 0 else "",
+            size=sum(segment.length for segment, outcome in zip(planned, outcomes) if outcome[2] == ""))
+
+    async def fetch_async(self, request: DownloadRequest) -> DownloadResult:
+        """
+        Make a request without blocking the event loop.
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, self.fetch, request)
+
+
+class ThreadedDownloader(Downloader):
+    """
+    Makes a batch of requests in parallel, sharing the session's connection pool.
+    """
+
+    def __init__(self, session: Any, user_agent: str, max_retry: int, logger: Optional[logging.Logger] = None, workers: int = 4) -> None:
+        super().__init__(session, user_agent, max_retry, logger)
+        self.workers = workers
+
+    def fetch_all(self, requests: Iterable[DownloadRequest]) -> List[DownloadResult]:
+        requests = list(requests)
+        if len(requests) <= 1:
+            return super().fetch_all(requests)
+
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(requests))) as pool:
+            return list(pool.map(self.fetch, requests))
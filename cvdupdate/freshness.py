@@ -0,0 +1,123 @@
+"""
+Copyright (C) 2021-2025 Cisco Systems, Inc. and/or its affiliates. All rights reserved.
+
+This module helps check if a database on a third-party server has changed,
+without downloading it.
+
+Some servers ignore If-Modified-Since and send the whole file every time. For
+those, we can instead compare the ETag, Content-Length and Last-Modified
+headers from a HEAD request (or a 1-byte Range request, if HEAD isn't
+supported) with those we saved from the last download.
+
+Which of these works is learned per origin (scheme + host) and kept in the state:
+
+- conditional:  The server honors If-Modified-Since / If-None-Match.
+                A conditional GET is all we need.
+- head:         The server ignores conditional requests, but a HEAD request
+                gives us headers to compare.
+- range:        As above, but HEAD doesn't work and a 1-byte Range request does.
+- none:         Nothing works, we must download the file to find out.
+
+Most third-party servers also have no sign files. Once a server has said so a
+few times (and never sent one), we stop asking it for them.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from enum import Enum
+from typing import *
+from urllib.parse import urlsplit
+
+# Forget what we learned about an origin after this long, in case the server changed.
+RELEARN_AFTER = 60 * 60 * 24 * 7
+
+# Sign files not found on a server, without finding any, before we stop asking it for them.
+SIGN_ORIGIN_MISSES = 3
+
+
+class ProbeStrategy(Enum):
+    UNKNOWN = ""
+    CONDITIONAL = "conditional"
+    HEAD = "head"
+    RANGE = "range"
+    NONE = "none"
+
+
+class Validators(NamedTuple):
+    etag: str = ""
+    content_length: int = -1
+    last_modified: str = ""
+
+    def usable(self) -> bool:
+        return self.etag != "" or self.last_modified != ""
+
+
+def origin_of(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def validators_from_headers(headers: Mapping[str, str]) -> Validators:
+    """
+    Get the validators from response headers.
+
+    For a 206 Partial Content response, the full length is taken from the Content-Range.
+    """
+    content_length = -1
+    content_range = headers.get('Content-Range', '')
+    if '/' in content_range:
+        total = content_range.rsplit('/', 1)[1].strip()
+        if total.isdigit():
+            content_length = int(total)
+    elif headers.get('Content-Length', '').isdigit():
+        content_length = int(headers['Content-Length'])
+
+    # A weak ETag (W/"...") still tells us if the content changed, for our purposes.
+    return Validators(
+        etag=headers.get('ETag', ''),
+        content_length=content_length,
+        last_modified=headers.get('Last-Modified', ''))
+
+
+def validators_from_state(details: dict) -> Validators:
+    saved = details.get('validators', {})
+    return Validators(
+        etag=saved.get('etag', ''),
+        content_length=saved.get('content length', -1),
+        last_modified=saved.get('last modified', ''))
+
+
+def validators_to_state(validators: Validators) -> dict:
+    return {
+        'etag': validators.etag,
+        'content length': validators.content_length,
+        'last modified': validators.last_modified,
+    }
+
+
+def is_unchanged(saved: Validators, probed: Validators) -> Optional[bool]:
+    """
+    Compare validators from the last download with those from a probe.
+
+    Returns None if there is nothing to compare.
+    """
+    if saved.content_length >= 0 and probed.content_length >= 0 and saved.content_length != probed.content_length:
+        return False
+
+    if saved.etag != "" and probed.etag != "":
+        return saved.etag == probed.etag
+
+    if saved.last_modified != "" and probed.last_modified != "":
+        return saved.last_modified == probed.last_modified
+
+    return None
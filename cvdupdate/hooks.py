@@ -0,0 +1,147 @@
+"""
+Copyright (C) 2021-2025 Cisco Systems, Inc. and/or its affiliates. All rights reserved.
+
+This module runs the "post update hooks" after an update changes any files,
+so that downstream ClamAV and FreshClam installs can update right away
+instead of polling the mirror.
+
+Each hook is one of:
+
+    {"command": "/usr/local/bin/notify-fleet"}
+    {"webhook": "http://localhost:9000/cvd-updated"}
+    {"unix socket": "/run/fleet/notify.sock"}
+
+and may have a "timeout" in seconds (default: 30).
+
+Every hook is given the same JSON payload:
+
+    {
+        "dns": "<the DNS TXT record>",
+        "files": [
+            {"name": "daily.cvd", "db": "daily.cvd", "version": 27002, "deleted": false},
+            ...
+        ]
+    }
+
+- A command gets it on stdin, and the changed file names in the
+  CVD_CHANGED_FILES environment variable, separated by spaces.
+- A webhook gets it as the body of a POST request.
+- A unix socket gets it as one line.
+
+Hooks run in the background on a few threads, so a slow hook doesn't hold up
+the next update. A failed hook is logged, but doesn't fail the update.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import logging
+import os
+import socket
+import subprocess
+import urllib.request
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import *
+
+DEFAULT_TIMEOUT = 30
+
+
+def describe_hook(hook: dict) -> str:
+    for kind in ('command', 'webhook', 'unix socket'):
+        if kind in hook:
+            return f"{kind} {hook[kind]}"
+    return str(hook)
+
+
+def _run_command(command: str, body: bytes, names: List[str], timeout: float) -> None:
+    env = dict(os.environ)
+    env['CVD_CHANGED_FILES'] = ' '.join(names)
+    subprocess.run(command, shell=True, input=body, env=env, timeout=timeout, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def _post_webhook(url: str, body: bytes, timeout: float) -> None:
+    request = urllib.request.Request(url, data=body, method='POST', headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        response.read()
+
+
+def _send_unix_socket(path: str, body: bytes, timeout: float) -> None:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(body + b'\n')
+
+
+def run_hook(hook: dict, payload: dict) -> None:
+    """
+    Run one hook, in the calling thread.
+
+    Raises ValueError if the hook is not one we know how to run, and whatever
+    the hook raises if it fails.
+    """
+    body = json.dumps(payload).encode('utf-8')
+    timeout = hook.get('timeout', DEFAULT_TIMEOUT)
+
+    if 'command' in hook:
+        _run_command(hook['command'], body, [changed['name'] for changed in payload['files']], timeout)
+    elif 'webhook' in hook:
+        _post_webhook(hook['webhook'], body, timeout)
+    elif 'unix socket' in hook:
+        _send_unix_socket(hook['unix socket'], body, timeout)
+    else:
+        raise ValueError("Unknown hook type")
+
+
+class HookRunner:
+    """
+    Runs hooks on a bounded pool of background threads.
+    """
+
+    def __init__(self, logger: logging.Logger, max_workers: int = 4) -> None:
+        self.logger = logger
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='cvd-hook')
+        self.pending: List[Future] = []
+
+    def _run(self, hook: dict, payload: dict) -> bool:
+        try:
+            run_hook(hook, payload)
+        except subprocess.CalledProcessError as exc:
+            self.logger.error(f"Post update hook failed: {describe_hook(hook)}")
+            self.logger.debug(f"Exit code {exc.returncode}: {exc.stderr.decode('utf-8', 'ignore').strip()}")
+            return False
+        except Exception as exc:
+            self.logger.debug(f"EXCEPTION OCCURRED: {exc}")
+            self.logger.error(f"Post update hook failed: {describe_hook(hook)}")
+            return False
+
+        self.logger.debug(f"Ran post update hook: {describe_hook(hook)}")
+        return True
+
+    def submit(self, hooks: List[dict], payload: dict) -> List[Future]:
+        """
+        Start running the hooks in the background. Returns immediately.
+        """
+        self.pending = [future for future in self.pending if not future.done()]
+        futures = [self.pool.submit(self._run, hook, payload) for hook in hooks]
+        self.pending.extend(futures)
+        return futures
+
+    def wait(self) -> int:
+        """
+        Wait for every hook that is still running.
+
+        Returns: Number of failed hooks.
+        """
+        pending, self.pending = self.pending, []
+        return sum(1 for future in pending if not future.result())
@@ -0,0 +1,153 @@
+"""
+Copyright (C) 2021-2025 Cisco Systems, Inc. and/or its affiliates. All rights reserved.
+
+This module keeps a record of the last few downloads for each database, so
+that slow or failing servers can be spotted with `cvd show` and
+`cvd list --slow`.
+
+Each download is recorded as the time it took, the bytes received and the
+HTTP status. The last RING_SIZE downloads are packed into a fixed-size ring
+of 10 bytes each, and saved in the state as one base64 string, so that the
+state file doesn't grow with every update.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import base64
+import math
+import struct
+from collections import Counter
+from typing import *
+
+from cvdupdate.freshness import origin_of
+
+# Downloads to remember, per database.
+RING_SIZE = 32
+
+# Seconds (float), bytes, HTTP status (0 if there was no response).
+_RECORD = struct.Struct('!fIH')
+
+
+class Fetch(NamedTuple):
+    elapsed: float
+    size: int
+    status: int
+
+    @property
+    def ok(self) -> bool:
+        return self.status in (200, 206, 304)
+
+
+class FetchRing:
+    """
+    The last RING_SIZE downloads for a database, oldest first.
+    """
+
+    def __init__(self, packed: bytes = b'', next_index: int = 0) -> None:
+        self.records = bytearray(packed[:RING_SIZE * _RECORD.size])
+        self.next_index = next_index % RING_SIZE
+
+    @classmethod
+    def from_state(cls, details: dict) -> "FetchRing":
+        saved = details.get('fetches')
+        if saved is None:
+            return cls()
+        try:
+            return cls(base64.b64decode(saved['ring']), saved['next'])
+        except (KeyError, TypeError, ValueError):
+            # Corrupted somehow. Start over, it's only statistics.
+            return cls()
+
+    def to_state(self) -> dict:
+        return {
+            'ring': base64.b64encode(bytes(self.records)).decode('ascii'),
+            'next': self.next_index,
+        }
+
+    def add(self, fetch: Fetch) -> None:
+        record = _RECORD.pack(fetch.elapsed, min(fetch.size, 0xFFFFFFFF), fetch.status)
+        offset = self.next_index * _RECORD.size
+        if offset == len(self.records):
+            # Not full yet.
+            self.records += record
+        else:
+            self.records[offset:offset + _RECORD.size] = record
+        self.next_index = (self.next_index + 1) % RING_SIZE
+
+    def fetches(self) -> List[Fetch]:
+        count = len(self.records) // _RECORD.size
+        # Once full, the oldest is the one we'll overwrite next.
+        start = self.next_index if count == RING_SIZE else 0
+        return [
+            Fetch(*_RECORD.unpack_from(self.records, ((start + i) % count) * _RECORD.size))
+            for i in range(count)
+        ]
+
+
+def percentile(values: List[float], p: float) -> float:
+    """
+    The nearest-rank percentile, or 0 if there are no values.
+    """
+    if len(values) == 0:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(p / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+class FetchSummary(NamedTuple):
+    count: int
+    failed: int
+    p50: float          # Seconds.
+    p90: float
+    p99: float
+    throughput: float   # Median bytes per second, for downloads with a body.
+    statuses: Dict[int, int]
+
+
+def summarize(fetches: List[Fetch]) -> FetchSummary:
+    latencies = [fetch.elapsed for fetch in fetches]
+    # Tiny responses (eg: a CVD header) say more about latency than throughput.
+    rates = [fetch.size / fetch.elapsed for fetch in fetches if fetch.size >= 64 * 1024 and fetch.elapsed > 0]
+
+    return FetchSummary(
+        count=len(fetches),
+        failed=sum(1 for fetch in fetches if not fetch.ok),
+        p50=percentile(latencies, 50),
+        p90=percentile(latencies, 90),
+        p99=percentile(latencies, 99),
+        throughput=percentile(rates, 50),
+        statuses=dict(Counter(fetch.status for fetch in fetches)))
+
+
+def rank_origins(dbs: Dict[str, dict]) -> List[Tuple[str, FetchSummary]]:
+    """
+    Summarize the recent downloads from each server, slowest first.
+    """
+    by_origin: Dict[str, List[Fetch]] = {}
+    for details in dbs.values():
+        fetches = FetchRing.from_state(details).fetches()
+        if len(fetches) > 0:
+            by_origin.setdefault(origin_of(details['url']), []).extend(fetches)
+
+    summaries = [(origin, summarize(fetches)) for origin, fetches in by_origin.items()]
+    summaries.sort(key=lambda item: (item[1].p90, item[1].failed), reverse=True)
+    return summaries
+
+
+def format_rate(bytes_per_second: float) -> str:
+    for unit in ('B/s', 'KiB/s', 'MiB/s'):
+        if bytes_per_second < 1024:
+            return f"{bytes_per_second:.1f} {unit}"
+        bytes_per_second /= 1024
+    return f"{bytes_per_second:.1f} GiB/s"
@@ -0,0 +1,273 @@
+"""
+Copyright (C) 2021-2025 Cisco Systems, Inc. and/or its affiliates. All rights reserved.
+
+This module builds the mirror manifest: a listing of every file in the
+database directory with the version, size, hash and mtime of each file.
+Downstream cvdupdate instances read the manifest to decide which files they
+need to fetch from an upstream mirror.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import hashlib
+import json
+import os
+import re
+import struct
+import time
+from pathlib import Path
+from typing import *
+
+MANIFEST_FILE = "manifest.json"
+BINARY_MANIFEST_FILE = "manifest.bin"
+MANIFEST_VERSION = 1
+
+# Files that describe the mirror rather than belong to it.
+_NOT_LISTED = ("dns.txt", MANIFEST_FILE, BINARY_MANIFEST_FILE)
+
+# Binary manifest layout (all little-endian):
+#   header: magic, manifest version, generated time, file count, dns length
+#   then the dns string, then one record per file:
+#   record: name length, db length, version, size, mtime, raw sha256
+#   followed by the name and db strings.
+_BINARY_MAGIC = b"CVDM"
+_BINARY_HEADER = struct.Struct("<4sHdIH")
+_BINARY_RECORD = struct.Struct("<HHIQd32s")
+
+# Eg: daily-27000.cdiff, daily-27000.cdiff.sign, daily-27000.cvd.sign
+_VERSIONED_FILE = re.compile(r'^(?P<base>.+)-(?P<version>\d+)\.(?P<ext>cdiff|cvd)(?:\.sign)?$')
+
+
+def file_sha256(path: Path) -> str:
+    """
+    Hash a file without reading it all into memory at once.
+    """
+    sha = hashlib.sha256()
+    with open(str(path), 'rb') as fd:
+        for chunk in iter(lambda: fd.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def describe_file(name: str, dbs: dict) -> Tuple[str, int]:
+    """
+    Work out which database a file belongs to, and which version it is.
+
+    Returns: (database name, version). The version is 0 if unknown.
+    """
+    if name in dbs:
+        if name.endswith('.cvd'):
+            return name, dbs[name]['local version']
+        return name, 0
+
+    match = _VERSIONED_FILE.match(name)
+    if match:
+        return f"{match.group('base')}.cvd", int(match.group('version'))
+
+    if name.endswith('.sign') and name[:-len('.sign')] in dbs:
+        return name[:-len('.sign')], 0
+
+    return "", 0
+
+
+def _describe_path(path: Path, dbs: dict, previous_files: dict, st: Optional[os.stat_result] = None) -> dict:
+    """
+    Create the manifest entry for a file, reusing the old hash if the file is unchanged.
+    """
+    if st is None:
+        st = os.stat(str(path))
+    db, version = describe_file(path.name, dbs)
+
+    old = previous_files.get(path.name)
+    if old and old['size'] == st.st_size and old['mtime'] == st.st_mtime:
+        sha256 = old['sha256']
+    else:
+        sha256 = file_sha256(path)
+
+    return {
+        "db" : db,
+        "version" : version,
+        "size" : st.st_size,
+        "mtime" : st.st_mtime,
+        "sha256" : sha256,
+    }
+
+
+def is_listed(name: str) -> bool:
+    """
+    Files that describe the mirror, and temporary files, are not listed in the manifest.
+    """
+    return not (name in _NOT_LISTED or name.startswith('.'))
+
+
+def build_manifest(db_dir: Path, dbs: dict, dns_tokens: List[str], previous: Optional[dict] = None) -> dict:
+    """
+    Build a manifest for every file in the database directory.
+
+    Hashes from a previous manifest are reused if the size and mtime of a
+    file have not changed, so only new or modified files are read.
+    """
+    previous_files = previous['files'] if previous and 'files' in previous else {}
+    files = {}
+
+    for entry in sorted(os.scandir(str(db_dir)), key=lambda e: e.name):
+        if is_listed(entry.name) and entry.is_file():
+            files[entry.name] = _describe_path(Path(entry.path), dbs, previous_files, st=entry.stat())
+
+    return {
+        "manifest version" : MANIFEST_VERSION,
+        "generated" : time.time(),
+        "dns" : ':'.join(dns_tokens),
+        "files" : files,
+    }
+
+
+def update_manifest(previous: dict, db_dir: Path, dbs: dict, dns_tokens: List[str], changed: Iterable[str]) -> dict:
+    """
+    Update a previous manifest with just the files that changed since it was built.
+
+    Only the changed files are looked at on disk. Files that no longer exist are dropped.
+    """
+    files = dict(previous['files'])
+
+    for name in changed:
+        if not is_listed(name):
+            continue
+        path = db_dir / name
+        if path.is_file():
+            files[name] = _describe_path(path, dbs, previous['files'])
+        else:
+            files.pop(name, None)
+
+    # Database versions live in the state, so they may change without the file list changing.
+    for name, entry in files.items():
+        if name in dbs:
+            entry['version'] = describe_file(name, dbs)[1]
+
+    return {
+        "manifest version" : MANIFEST_VERSION,
+        "generated" : time.time(),
+        "dns" : ':'.join(dns_tokens) if dns_tokens else previous['dns'],
+        "files" : {name: files[name] for name in sorted(files)},
+    }
+
+
+def filter_since(manifest: dict, since: int, db: str = "") -> dict:
+    """
+    Reduce a manifest to the CDIFFs (and their sign files) newer than a given version.
+    If a database name is given, only CDIFFs for that database are kept.
+    """
+    files = {
+        name: entry for name, entry in manifest['files'].items()
+        if (name.endswith('.cdiff') or name.endswith('.cdiff.sign')) and
+            entry['version'] > since and
+            (db == "" or entry['db'] == db)
+    }
+    return dict(manifest, files=files)
+
+
+def encode_binary_manifest(manifest: dict) -> bytes:
+    """
+    Pack a manifest into the compact binary layout.
+    """
+    dns = manifest['dns'].encode('utf-8')
+    parts = [_BINARY_HEADER.pack(
+        _BINARY_MAGIC,
+        manifest['manifest version'],
+        manifest['generated'],
+        len(manifest['files']),
+        len(dns)), dns]
+
+    for name, entry in manifest['files'].items():
+        name_bytes = name.encode('utf-8')
+        db_bytes = entry['db'].encode('utf-8')
+        parts.append(_BINARY_RECORD.pack(
+            len(name_bytes),
+            len(db_bytes),
+            entry['version'],
+            entry['size'],
+            entry['mtime'],
+            bytes.fromhex(entry['sha256'])))
+        parts.append(name_bytes)
+        parts.append(db_bytes)
+
+    return b''.join(parts)
+
+
+def decode_binary_manifest(data: bytes) -> dict:
+    """
+    Unpack a manifest from the compact binary layout.
+    """
+    view = memoryview(data)
+    magic, manifest_version, generated, count, dns_len = _BINARY_HEADER.unpack_from(view, 0)
+    if magic != _BINARY_MAGIC:
+        raise ValueError("Not a binary cvdupdate manifest")
+
+    offset = _BINARY_HEADER.size
+    dns = bytes(view[offset:offset + dns_len]).decode('utf-8')
+    offset += dns_len
+
+    files = {}
+    for _ in range(count):
+        name_len, db_len, file_version, size, mtime, sha256 = _BINARY_RECORD.unpack_from(view, offset)
+        offset += _BINARY_RECORD.size
+        name = bytes(view[offset:offset + name_len]).decode('utf-8')
+        offset += name_len
+        db = bytes(view[offset:offset + db_len]).decode('utf-8')
+        offset += db_len
+        files[name] = {
+            "db" : db,
+            "version" : file_version,
+            "size" : size,
+            "mtime" : mtime,
+            "sha256" : sha256.hex(),
+        }
+
+    return {
+        "manifest version" : manifest_version,
+        "generated" : generated,
+        "dns" : dns,
+        "files" : files,
+    }
+
+
+def load_manifest(path: Path) -> Optional[dict]:
+    """
+    Load a manifest from disk. Returns None if missing or unreadable.
+    """
+    try:
+        with path.open('r') as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest.get('manifest version') != MANIFEST_VERSION:
+            return None
+        return manifest
+    except Exception:
+        return None
+
+
+def save_manifest(path: Path, manifest: dict) -> None:
+    """
+    Write the manifest atomically, so a server never hands out half a file.
+    The binary variant is written alongside the JSON manifest.
+    """
+    tmp_path = path.parent / f".{path.name}.tmp"
+    with tmp_path.open('w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=4)
+
+    bin_path = path.parent / BINARY_MANIFEST_FILE
+    tmp_bin_path = path.parent / f".{BINARY_MANIFEST_FILE}.tmp"
+    with tmp_bin_path.open('wb') as manifest_file:
+        manifest_file.write(encode_binary_manifest(manifest))
+
+    os.replace(str(tmp_bin_path), str(bin_path))
+    os.replace(str(tmp_path), str(path))
@@ -0,0 +1,133 @@
+"""
+Copyright (C) 2021-2025 Cisco Systems, Inc. and/or its affiliates. All rights reserved.
+
+This module writes the machine-readable output of `cvd list`, `cvd show` and
+`cvd update` for `--output json` and `--output ndjson`.
+
+- ndjson:   One JSON record per line, written (and flushed) as soon as each
+            database is listed or updated, so a caller can act on each result
+            without waiting for the whole run.
+- json:     The same records, as one JSON array once the command finishes.
+
+With either, the log messages that would normally go to stdout are written
+only to the log file, so stdout is just the records.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import sys
+from typing import *
+
+from cvdupdate import cvd
+from cvdupdate import latency
+
+FORMATS = ['text', 'json', 'ndjson']
+
+
+class RecordWriter:
+
+    def __init__(self, output_format: str, stream: Optional[TextIO] = None) -> None:
+        """
+        Args:
+            output_format:  "json" or "ndjson".
+            stream:         Where to write. Default: stdout.
+        """
+        if output_format not in ('json', 'ndjson'):
+            raise ValueError(f"Unsupported output format: {output_format}")
+        self.output_format = output_format
+        self.stream = stream if stream is not None else sys.stdout
+        self.records: List[dict] = []
+
+    def write(self, record: dict) -> None:
+        if self.output_format == 'ndjson':
+            self.stream.write(json.dumps(record) + '\n')
+            self.stream.flush()
+        else:
+            self.records.append(record)
+
+    def close(self) -> None:
+        """
+        Finish the output. For json, this is when the records are written.
+        """
+        if self.output_format == 'json':
+            self.stream.write(json.dumps(self.records, indent=4) + '\n')
+            self.stream.flush()
+            self.records = []
+
+
+def db_record(db: str, details: dict, header: Optional[cvd.CvdHeader] = None) -> dict:
+    """
+    Describe a database, from the details in the state (or from `_index_local_databases()`).
+    """
+    record = {
+        'name': db,
+        'url': details['url'],
+        'last modified': details['last modified'],
+        'last checked': details['last checked'],
+        'retry after': details['retry after'],
+        'CDIFFs': list(details['CDIFFs']),
+    }
+    if db.endswith('.cvd'):
+        record['local version'] = details['local version']
+    if header is not None:
+        record['build time'] = header.build_time
+        record['signatures'] = header.signatures
+        record['functionality level'] = header.functionality_level
+        record['MD5'] = header.md5
+
+    fetches = latency.FetchRing.from_state(details).fetches()
+    if len(fetches) > 0:
+        record['downloads'] = summary_record(latency.summarize(fetches))
+    return record
+
+
+def summary_record(summary: latency.FetchSummary) -> dict:
+    return {
+        'count': summary.count,
+        'failed': summary.failed,
+        'p50': summary.p50,
+        'p90': summary.p90,
+        'p99': summary.p99,
+        'throughput': summary.throughput,
+        # JSON object keys must be strings.
+        'statuses': {str(status): count for status, count in summary.statuses.items()},
+    }
+
+
+def origin_record(origin: str, summary: latency.FetchSummary) -> dict:
+    record = {'origin': origin}
+    record.update(summary_record(summary))
+    return record
+
+
+def update_record(db: str, status: str, elapsed: float, details: dict, files: Iterable[str]) -> dict:
+    """
+    Describe the outcome of updating a database.
+
+    Args:
+        status:     "updated", "no update" or "error".
+        elapsed:    Seconds.
+        files:      The files changed in the database directory.
+    """
+    record = {
+        'name': db,
+        'status': status,
+        'elapsed': elapsed,
+        'files': sorted(files),
+    }
+    if db.endswith('.cvd'):
+        record['local version'] = details['local version']
+    if details['retry after'] > 0:
+        record['retry after'] = details['retry after']
+    return record
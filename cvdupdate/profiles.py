@@ -0,0 +1,131 @@
+"""
+Copyright (C) 2021-2025 Cisco Systems, Inc. and/or its affiliates. All rights reserved.
+
+This module lets one process update and serve several mirror "profiles", eg:
+a production mirror, a staging mirror with extra databases, and a legacy
+mirror pinned to the files it has.
+
+Each profile is an ordinary CVD-Update config file, with its own state, logs
+and database directory. The profiles file lists them, in JSON:
+
+    {
+        "prod":    {"config": "/etc/cvdupdate/prod.json"},
+        "staging": {"config": "/etc/cvdupdate/staging.json"},
+        "legacy":  {"config": "/etc/cvdupdate/legacy.json", "update": false}
+    }
+
+Profiles with "update" set to false are served, but never updated.
+
+When the profiles are updated together they share one HTTP session and one
+DNS TXT answer, and a file that was already downloaded for one profile is
+hardlinked into the others (or copied, if they are on different filesystems)
+instead of being downloaded again.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import re
+from pathlib import Path
+from typing import *
+
+from cvdupdate.cvdupdate import CVDUpdate
+
+# Profile names are used as URL path segments by `cvd profiles serve`.
+_PROFILE_NAME = re.compile(r'^[A-Za-z0-9._-]+$')
+
+
+class Profile(NamedTuple):
+    name: str
+    m: CVDUpdate
+    update: bool
+
+
+def load_profiles_file(path: Path) -> Dict[str, dict]:
+    """
+    Read and check the profiles file.
+
+    Raises ValueError if the file is not a valid profiles file.
+    Raises OSError if the file can't be read.
+    """
+    with path.open('r') as profiles_file:
+        profiles = json.load(profiles_file)
+
+    if not isinstance(profiles, dict) or profiles == {}:
+        raise ValueError(f"{path} must be a JSON object with at least one profile")
+
+    for name, settings in profiles.items():
+        if not _PROFILE_NAME.match(name):
+            raise ValueError(f"Invalid profile name: {name}")
+        if not isinstance(settings, dict) or 'config' not in settings:
+            raise ValueError(f"Profile {name} has no config path")
+
+    return profiles
+
+
+class MirrorGroup:
+
+    def __init__(self, profiles_path: Path, verbose: bool = False) -> None:
+        """
+        Args:
+            profiles_path:  The profiles file.
+            verbose:        Enable DEBUG-level logs for every profile.
+
+        Raises ValueError or OSError if the profiles file can't be loaded.
+        """
+        self.profiles: Dict[str, Profile] = {}
+        self.shared_downloads: Dict[str, Path] = {}
+
+        for name, settings in load_profiles_file(profiles_path).items():
+            m = CVDUpdate(config=str(Path(settings['config']).expanduser()), verbose=verbose)
+            m.shared_downloads = self.shared_downloads
+            self.profiles[name] = Profile(name, m, settings.get('update', True))
+
+    def _share_warm_state(self, source: CVDUpdate, destination: CVDUpdate) -> None:
+        """
+        Hand our HTTP session, DNS answer and PyPI check to the next profile, so it doesn't redo them.
+        """
+        if source._session is not None:
+            destination._session = source._session
+        if source.dns_version_tokens != []:
+            destination.dns_version_tokens = list(source.dns_version_tokens)
+            destination.dns_expires = source.dns_expires
+        destination.pypi_checked = max(destination.pypi_checked, source.pypi_checked)
+
+    def update(self, debug_mode: bool = False, dry_run: bool = False) -> int:
+        """
+        Update every profile that isn't pinned.
+
+        Returns: Number of errors.
+        """
+        # Downloads are only shared within a single update run, in case a profile's files are changed later.
+        self.shared_downloads.clear()
+
+        errors = 0
+        previous = None
+        for profile in self.profiles.values():
+            if not profile.update:
+                profile.m.logger.info(f"Profile {profile.name} is pinned, not updating.")
+                continue
+
+            if previous is not None:
+                self._share_warm_state(previous, profile.m)
+
+            # Logging is process-wide, point it at this profile's log directory.
+            profile.m._init_logging()
+            profile.m.logger.info(f"Updating profile {profile.name}")
+            errors += profile.m.db_update(debug_mode=debug_mode, dry_run=dry_run)
+            previous = profile.m
+
+        self.shared_downloads.clear()
+        return errors
@@ -0,0 +1,196 @@
+"""
+Copyright (C) 2021-2025 Cisco Systems, Inc. and/or its affiliates. All rights reserved.
+
+This module prints the databases for `cvd list` and `cvd show`, and provides
+ReadOnlyView, which does so (and `cvd config show`) from the state cache
+written by `cvd update`.
+
+ReadOnlyView doesn't parse the config or state files, write anything, or
+change the logging configuration, so it is cheap enough for health checks.
+See cvdupdate/statecache.py.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import datetime
+import json
+import logging
+import sys
+from pathlib import Path
+from typing import *
+
+from cvdupdate import cvd
+from cvdupdate import latency
+from cvdupdate import output
+from cvdupdate.statecache import StateCache
+
+
+def _timestamp(seconds: float) -> str:
+    return datetime.datetime.fromtimestamp(seconds).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def log_db_summary(logger: logging.Logger, db: str, details: dict) -> None:
+    """
+    Log a database for `cvd list`.
+    """
+    logger.info(f"Database: {db}")
+    if details['last modified'] == 0:
+        logger.info("  last modified: not downloaded")
+    else:
+        logger.info(f"  last modified: {_timestamp(details['last modified'])}")
+    if details['last checked'] == 0:
+        logger.debug(" last checked:  n/a")
+    else:
+        logger.debug(f" last checked:  {_timestamp(details['last checked'])}")
+    logger.debug(f" url:           {details['url']}")
+    if db.endswith(".cvd"):
+        # Only CVD's have versions.
+        logger.debug(f" local version: {details['local version']}")
+    if len(details['CDIFFs']) > 0:
+        logger.debug(f" CDIFFs:")
+        for cdiff in details['CDIFFs']:
+            logger.debug(f"   {cdiff}")
+
+
+def log_db_details(logger: logging.Logger, db: str, details: dict, header: Optional[cvd.CvdHeader]) -> None:
+    """
+    Log a database for `cvd show`.
+    """
+    logger.info(f"Database: {db}")
+    if details['last modified'] == 0:
+        logger.info("  last modified: not downloaded")
+    else:
+        logger.info(f"  last modified: {_timestamp(details['last modified'])}")
+    if details['last checked'] == 0:
+        logger.info("  last checked:  n/a")
+    else:
+        logger.info(f"  last checked:  {_timestamp(details['last checked'])}")
+    logger.info(f"  url:           {details['url']}")
+    if db.endswith(".cvd"):
+        logger.info(f"  local version: {details['local version']}")
+        if header is not None:
+            logger.info(f"  build time:    {header.build_time}")
+            logger.info(f"  signatures:    {header.signatures}")
+            logger.info(f"  func. level:   {header.functionality_level}")
+            logger.debug(f"  MD5:           {header.md5}")
+    if len(details['CDIFFs']) > 0:
+        logger.info(f"  CDIFFs: \n{json.dumps(details['CDIFFs'], indent=4)}")
+    fetches = latency.FetchRing.from_state(details).fetches()
+    if len(fetches) > 0:
+        summary = latency.summarize(fetches)
+        logger.info(f"  downloads:     last {summary.count}, {summary.failed} failed")
+        logger.info(f"  latency:       p50 {summary.p50:.3f}s, p90 {summary.p90:.3f}s, p99 {summary.p99:.3f}s")
+        if summary.throughput > 0:
+            logger.info(f"  throughput:    {latency.format_rate(summary.throughput)}")
+        statuses = ', '.join(f"{status or 'no response'}: {count}" for status, count in sorted(summary.statuses.items()))
+        logger.debug(f"  HTTP statuses: {statuses}")
+
+
+def log_slow_origins(logger: logging.Logger, dbs: Dict[str, dict]) -> None:
+    """
+    Log each server's recent download times for `cvd list --slow`, slowest first.
+    """
+    ranked = latency.rank_origins(dbs)
+    if len(ranked) == 0:
+        logger.info("No downloads recorded yet.")
+        return
+
+    for origin, summary in ranked:
+        logger.info(f"Server: {origin}")
+        logger.info(f"  latency:       p50 {summary.p50:.3f}s, p90 {summary.p90:.3f}s, p99 {summary.p99:.3f}s")
+        if summary.throughput > 0:
+            logger.info(f"  throughput:    {latency.format_rate(summary.throughput)}")
+        if summary.failed > 0:
+            logger.warning(f"  failed:        {summary.failed} of the last {summary.count} downloads")
+        else:
+            logger.debug(f"  downloads:     {summary.count}")
+
+
+def _console_logger(verbose: bool, log_stdout: bool = True) -> logging.Logger:
+    """
+    A logger that prints like CVDUpdate's, but only to the console, and without touching the root logger.
+    """
+    logger = logging.getLogger("cvdupdate-readonly")
+    logger.setLevel(logging.DEBUG if verbose else logging.INFO)
+    logger.propagate = False
+
+    formatter = logging.Formatter("%(asctime)s - %(levelname)s:  %(message)s", datefmt="%Y-%m-%d %I:%M:%S %p")
+
+    stderr_handler = logging.StreamHandler(sys.stderr)
+    stderr_handler.setLevel(logging.WARNING)
+    stderr_handler.setFormatter(formatter)
+    logger.handlers = [stderr_handler]
+
+    if log_stdout:
+        stdout_handler = logging.StreamHandler(sys.stdout)
+        stdout_handler.addFilter(lambda record: record.levelno < logging.WARNING)
+        stdout_handler.setFormatter(formatter)
+        logger.addHandler(stdout_handler)
+
+    return logger
+
+
+class ReadOnlyView:
+    """
+    `cvd list`, `cvd show` and `cvd config show`, from the state cache.
+    """
+
+    def __init__(self, config_path: Path, cache: StateCache, verbose: bool = False, log_stdout: bool = True) -> None:
+        self.config_path = config_path
+        self.cache = cache
+        self.logger = _console_logger(verbose, log_stdout)
+
+    @classmethod
+    def open(cls, config_path: Path, verbose: bool = False, log_stdout: bool = True) -> Optional["ReadOnlyView"]:
+        """
+        Returns None if there is no state cache for this config, or if it is out of date.
+        """
+        cache = StateCache.open(config_path)
+        if cache is None:
+            return None
+        return cls(config_path, cache, verbose, log_stdout)
+
+    def db_list(self, slow: bool = False, writer: Optional[output.RecordWriter] = None) -> None:
+        if slow:
+            if writer is not None:
+                for origin, summary in latency.rank_origins(dict(self.cache)):
+                    writer.write(output.origin_record(origin, summary))
+            else:
+                log_slow_origins(self.logger, dict(self.cache))
+            return
+
+        for db, details in self.cache:
+            if writer is not None:
+                writer.write(output.db_record(db, details))
+            else:
+                log_db_summary(self.logger, db, details)
+
+    def db_show(self, name: str, writer: Optional[output.RecordWriter] = None) -> bool:
+        found = self.cache.find(name)
+        if found is None:
+            self.logger.error(f"No such database: {name}")
+            return False
+
+        details, raw_header = found
+        header = cvd.parse_cvd_header(raw_header) if raw_header != b'' else None
+        if writer is not None:
+            writer.write(output.db_record(name, details, header))
+        else:
+            log_db_details(self.logger, name, details, header)
+        return True
+
+    def config_show(self) -> None:
+        print(f"Config file: {self.config_path}\n")
+        print(f"Config:\n{self.cache.config_text}\n")
+        print(f"State file: {self.cache.state_path}\n")
+        print(f"State:\n{self.cache.state_text}\n")
@@ -0,0 +1,134 @@
+"""
+Copyright (C) 2021-2025 Cisco Systems, Inc. and/or its affiliates. All rights reserved.
+
+This module decides which CDIFFs to keep in the database directory.
+
+The directory is scanned once, and the CDIFFs for each database are queued
+oldest first. The oldest are then popped off the queue until the CDIFFs
+that remain satisfy the retention policy:
+
+- count:     Keep at most this many CDIFFs per database.
+- max age:   Delete CDIFFs older than this many seconds.
+- max bytes: Keep at most this many bytes of CDIFFs (and their sign files) per database.
+
+The age and size limits never delete the newest CDIFF, so clients that are one
+version behind can always catch up without downloading the whole CVD.
+
+A CDIFF's sign file is always deleted with it, as are sign files left behind
+without their CDIFF.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import collections
+import os
+import re
+import time
+from pathlib import Path
+from typing import *
+
+_CDIFF_NAME = re.compile(r'^(?P<db>.+)-(?P<version>\d+)\.cdiff(?P<sign>\.sign)?$')
+
+
+class RetentionPolicy(NamedTuple):
+    count: int = -1     # Negative means no limit.
+    max_age: float = 0  # seconds, 0 means no limit.
+    max_bytes: int = 0  # 0 means no limit.
+
+
+class CdiffFile(NamedTuple):
+    name: str
+    version: int
+    size: int      # Including the sign file, if any.
+    mtime: float
+    sign: bool     # If it has a sign file.
+
+
+class RetentionResult(NamedTuple):
+    kept: Dict[str, List[str]]  # CVD name -> CDIFF names, oldest first.
+    pruned: List[str]           # CDIFF and sign file names to delete.
+
+
+def _scan(db_dir: Path, bases: Set[str]) -> Tuple[Dict[str, List[CdiffFile]], List[str]]:
+    """
+    Find the CDIFFs for each database, and any sign files whose CDIFF is gone.
+    """
+    cdiffs: Dict[str, Dict[str, os.stat_result]] = collections.defaultdict(dict)
+    signs: Dict[str, os.stat_result] = {}
+
+    for entry in os.scandir(str(db_dir)):
+        match = _CDIFF_NAME.match(entry.name)
+        if not match or match.group('db') not in bases or not entry.is_file():
+            continue
+        if match.group('sign'):
+            signs[entry.name[:-len('.sign')]] = entry.stat()
+        else:
+            cdiffs[match.group('db')][entry.name] = entry.stat()
+
+    found: Dict[str, List[CdiffFile]] = {}
+    for base, files in cdiffs.items():
+        found[base] = sorted(
+            (
+                CdiffFile(
+                    name=name,
+                    version=int(_CDIFF_NAME.match(name).group('version')),
+                    size=st.st_size + (signs[name].st_size if name in signs else 0),
+                    mtime=st.st_mtime,
+                    sign=name in signs,
+                )
+                for name, st in files.items()
+            ),
+            key=lambda cdiff: cdiff.version)
+
+    orphans = [
+        name + '.sign' for name in signs
+        if name not in cdiffs[_CDIFF_NAME.match(name).group('db')]
+    ]
+    return found, orphans
+
+
+def plan_retention(db_dir: Path, dbs: Iterable[str], policy: RetentionPolicy, now: float = 0) -> RetentionResult:
+    """
+    Work out which CDIFFs to keep for each CVD in `dbs`, and which files to delete.
+
+    Nothing is deleted. Files for databases not in `dbs` are ignored.
+    """
+    if now == 0:
+        now = time.time()
+
+    cvds = {db[:-len('.cvd')]: db for db in dbs if db.endswith('.cvd')}
+    found, pruned = _scan(db_dir, set(cvds))
+
+    kept: Dict[str, List[str]] = {}
+    for base, db in cvds.items():
+        queue: Deque[CdiffFile] = collections.deque(found.get(base, []))
+        total_bytes = sum(cdiff.size for cdiff in queue)
+
+        while queue:
+            oldest = queue[0]
+            over_count = policy.count >= 0 and len(queue) > policy.count
+            # Age and size never remove the newest CDIFF.
+            over_age = policy.max_age > 0 and len(queue) > 1 and now - oldest.mtime > policy.max_age
+            over_bytes = policy.max_bytes > 0 and len(queue) > 1 and total_bytes > policy.max_bytes
+            if not (over_count or over_age or over_bytes):
+                break
+
+            queue.popleft()
+            total_bytes -= oldest.size
+            pruned.append(oldest.name)
+            if oldest.sign:
+                pruned.append(oldest.name + '.sign')
+
+        kept[db] = [cdiff.name for cdiff in queue]
+
+    return RetentionResult(kept, pruned)
@@ -0,0 +1,303 @@
+"""
+Copyright (C) 2021-2025 Cisco Systems, Inc. and/or its affiliates. All rights reserved.
+
+This module provides the HTTP request handlers for `cvd serve` and `cvd profiles serve`.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import datetime
+import email.utils
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import *
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from RangeHTTPServer import RangeRequestHandler, parse_byte_range
+
+from cvdupdate import manifest
+from cvdupdate.dirindex import DirectoryIndex, IndexedFile
+
+
+class ManifestCache:
+    """
+    Keeps the current manifest in memory, so requests don't touch the database directory.
+
+    The manifest is written by `cvd update` when it finishes. We only reload it
+    when the manifest file's mtime changes.
+    """
+
+    def __init__(self, db_dir: Union[Path, Callable[[], Path]]) -> None:
+        """
+        Args:
+            db_dir:     The directory served, or a function that finds it, called for each request.
+        """
+        self.locate = db_dir if callable(db_dir) else lambda: db_dir
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.manifest = None
+        self.responses = {}
+
+    @property
+    def path(self) -> Path:
+        return self.locate() / manifest.MANIFEST_FILE
+
+    def get(self) -> Optional[dict]:
+        path = self.path
+        try:
+            # The inode too, because the path may be in a snapshot that was just switched.
+            st = os.stat(str(path))
+            mtime = (st.st_ino, st.st_mtime_ns)
+        except OSError:
+            return None
+
+        with self.lock:
+            if mtime != self.mtime:
+                loaded = manifest.load_manifest(path)
+                if loaded is None:
+                    return self.manifest
+                self.manifest = loaded
+                self.mtime = mtime
+                self.responses = {}
+            return self.manifest
+
+    def response(self, binary: bool, since: Optional[int], db: str) -> Optional[Tuple[bytes, str]]:
+        """
+        Get the encoded manifest and its ETag, caching each variant until the manifest changes.
+        """
+        current = self.get()
+        if current is None:
+            return None
+
+        key = (binary, since, db)
+        with self.lock:
+            if key not in self.responses:
+                selected = current if since is None else manifest.filter_since(current, since, db)
+                if binary:
+                    body = manifest.encode_binary_manifest(selected)
+                else:
+                    body = json.dumps(selected, indent=4).encode('utf-8')
+                self.responses[key] = (body, f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+            return self.responses[key]
+
+
+class MirrorRequestHandler(RangeRequestHandler):
+    """
+    Serve the database directory, plus the manifest from memory.
+
+    Supports `?since=<version>` (and optionally `&db=<database>`) on the manifest
+    to list only the CDIFFs newer than a version.
+
+    With a directory index, files are looked up in memory instead of on disk,
+    so requests for missing files and HEAD requests don't touch the filesystem.
+    """
+    manifest_cache: ManifestCache = None
+    directory_index: Optional[DirectoryIndex] = None
+
+    # Downstream mirrors may cache the manifest for a short while.
+    manifest_max_age = 60
+
+    def do_GET(self):
+        if not self._send_manifest(head_only=False):
+            super().do_GET()
+
+    def do_HEAD(self):
+        if not self._send_manifest(head_only=True):
+            super().do_HEAD()
+
+    def _send_manifest(self, head_only: bool) -> bool:
+        url = urlsplit(self.path)
+        name = url.path.lstrip('/')
+        if name not in (manifest.MANIFEST_FILE, manifest.BINARY_MANIFEST_FILE) or self.manifest_cache is None:
+            return False
+
+        query = parse_qs(url.query)
+        since = None
+        if 'since' in query:
+            try:
+                since = int(query['since'][0])
+            except ValueError:
+                self.send_error(400, "Invalid since version")
+                return True
+        db = query['db'][0] if 'db' in query else ""
+
+        response = self.manifest_cache.response(name == manifest.BINARY_MANIFEST_FILE, since, db)
+        if response is None:
+            self.send_error(404, "No manifest yet, run `cvd update` first")
+            return True
+        body, etag = response
+
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return True
+
+        self.send_response(200)
+        if name == manifest.BINARY_MANIFEST_FILE:
+            self.send_header('Content-Type', 'application/octet-stream')
+        else:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', f'max-age={self.manifest_max_age}')
+        self.end_headers()
+
+        if not head_only:
+            self.wfile.write(body)
+        return True
+
+    def send_head(self) -> Optional[IndexedFile]:
+        """
+        Send the headers for a file in the database directory, using the directory index.
+        Returns the file to send, or None if there is no body.
+
+        Directory listings (and anything else not directly in the directory) are left to RangeRequestHandler.
+        """
+        name = unquote(urlsplit(self.path).path).lstrip('/')
+        index = self.directory_index
+        if index is None:
+            return super().send_head()
+
+        is_dir = index.is_dir(name)
+        # The index follows the directory being served (eg: when the first snapshot is published).
+        self.directory = str(index.directory)
+        if name in ('', '.', '..') or '/' in name or is_dir:
+            return super().send_head()
+
+        if self.command == 'HEAD':
+            indexed = None
+            st = index.stat(name)
+        else:
+            indexed = index.open(name)
+            st = indexed.stat if indexed is not None else None
+
+        if st is None:
+            self.send_error(404, "File not found")
+            return None
+
+        try:
+            self.range = None
+            if 'Range' in self.headers:
+                try:
+                    self.range = parse_byte_range(self.headers['Range'])
+                except ValueError:
+                    self.send_error(400, "Invalid byte range")
+                    return self._close(indexed)
+
+            if self.range is None or self.range[0] is None:
+                self.range = None
+                if self._not_modified(st):
+                    self.send_response(304)
+                    self.end_headers()
+                    return self._close(indexed)
+
+                self.send_response(200)
+                self.send_header('Content-Length', str(st.st_size))
+            else:
+                first, last = self.range
+                if first >= st.st_size:
+                    self.send_error(416, "Requested Range Not Satisfiable")
+                    return self._close(indexed)
+                if last is None or last >= st.st_size:
+                    last = st.st_size - 1
+                self.range = (first, last)
+
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {first}-{last}/{st.st_size}')
+                self.send_header('Content-Length', str(last - first + 1))
+
+            self.send_header('Content-Type', self.guess_type(name))
+            self.send_header('Last-Modified', self.date_time_string(st.st_mtime))
+            self.end_headers()
+
+        except Exception:
+            self._close(indexed)
+            raise
+
+        return indexed
+
+    def _not_modified(self, st: os.stat_result) -> bool:
+        """
+        Check If-Modified-Since, the same as SimpleHTTPRequestHandler.
+        """
+        if 'If-Modified-Since' not in self.headers or 'If-None-Match' in self.headers:
+            return False
+        try:
+            ims = email.utils.parsedate_to_datetime(self.headers['If-Modified-Since'])
+        except (TypeError, IndexError, OverflowError, ValueError):
+            return False
+        if ims.tzinfo is None:
+            ims = ims.replace(tzinfo=datetime.timezone.utc)
+        if ims.tzinfo is not datetime.timezone.utc:
+            return False
+        last_modified = datetime.datetime.fromtimestamp(st.st_mtime, datetime.timezone.utc).replace(microsecond=0)
+        return last_modified <= ims
+
+    @staticmethod
+    def _close(indexed: Optional[IndexedFile]) -> None:
+        if indexed is not None:
+            indexed.close()
+        return None
+
+
+class ProfilesRequestHandler(MirrorRequestHandler):
+    """
+    Serve the database directories for several mirror profiles, each under /<profile>/.
+    """
+    profiles: Dict[str, Tuple[ManifestCache, DirectoryIndex]] = {}
+
+    def do_GET(self):
+        if self._select_profile():
+            super().do_GET()
+
+    def do_HEAD(self):
+        if self._select_profile():
+            super().do_HEAD()
+
+    def _select_profile(self) -> bool:
+        """
+        Point this request at the profile's database directory.
+        Returns False if the response was already sent.
+        """
+        url = urlsplit(self.path)
+        parts = url.path.lstrip('/').split('/', 1)
+        profile = parts[0]
+
+        if profile == "":
+            body = "".join(f'<a href="/{name}/">{name}/</a><br>\n' for name in sorted(self.profiles)).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.write(body)
+            return False
+
+        if profile not in self.profiles:
+            self.send_error(404, "No such profile")
+            return False
+
+        if len(parts) == 1:
+            self.send_response(301)
+            self.send_header('Location', f"/{profile}/")
+            self.end_headers()
+            return False
+
+        self.manifest_cache, self.directory_index = self.profiles[profile]
+        self.directory = str(self.directory_index.directory)
+        self.path = f"/{parts[1]}" + (f"?{url.query}" if url.query else "")
+        return True
@@ -0,0 +1,148 @@
+"""
+Copyright (C) 2021-2025 Cisco Systems, Inc. and/or its affiliates. All rights reserved.
+
+This module publishes the database directory as immutable snapshots.
+
+Each snapshot is a directory of hardlinks to the files in the database
+directory, so a snapshot costs a directory entry per file rather than a copy.
+Files in the database directory are only ever replaced by renaming a new file
+over them, never modified in place, so the files in older snapshots don't change.
+
+The snapshot that is served is chosen by the `current` symlink in the snapshot
+directory. It is switched with a rename, so clients never see a mix of two
+snapshots, and rolling back is instant.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import datetime
+import os
+import re
+import shutil
+from pathlib import Path
+from typing import *
+
+CURRENT = "current"
+
+# Eg: 20250102T030405-2
+_SNAPSHOT_NAME = re.compile(r'^\d{8}T\d{6}(-\d+)?$')
+
+
+def list_snapshots(snapshot_dir: Path) -> List[str]:
+    """
+    Get the snapshot names, oldest first.
+    """
+    if not snapshot_dir.exists():
+        return []
+
+    names = [
+        entry.name for entry in os.scandir(str(snapshot_dir))
+        if entry.is_dir(follow_symlinks=False) and _SNAPSHOT_NAME.match(entry.name)
+    ]
+    return sorted(names, key=_sort_key)
+
+
+def _sort_key(name: str) -> Tuple[str, int]:
+    # So that 20250102T030405-10 sorts after 20250102T030405-9.
+    timestamp, _, count = name.partition('-')
+    return (timestamp, int(count) if count else 1)
+
+
+def current_snapshot(snapshot_dir: Path) -> str:
+    """
+    Get the name of the snapshot being served, or "" if none.
+    """
+    try:
+        return os.path.basename(os.readlink(str(snapshot_dir / CURRENT)))
+    except OSError:
+        return ""
+
+
+def _new_snapshot_name(snapshot_dir: Path) -> str:
+    name = datetime.datetime.now().strftime('%Y%m%dT%H%M%S')
+    candidate = name
+    count = 1
+    while (snapshot_dir / candidate).exists() or (snapshot_dir / f".{candidate}.partial").exists():
+        count += 1
+        candidate = f"{name}-{count}"
+    return candidate
+
+
+def create_snapshot(db_dir: Path, snapshot_dir: Path) -> str:
+    """
+    Snapshot the files in the database directory. Hidden files (eg: partial downloads) are skipped.
+
+    Files are hardlinked, or copied if the snapshot directory is on another filesystem.
+
+    Returns the new snapshot's name.
+    Raises OSError if the snapshot could not be created.
+    """
+    if not snapshot_dir.exists():
+        os.makedirs(str(snapshot_dir))
+
+    name = _new_snapshot_name(snapshot_dir)
+    tmp_dir = snapshot_dir / f".{name}.partial"
+    os.makedirs(str(tmp_dir))
+
+    try:
+        for entry in os.scandir(str(db_dir)):
+            if entry.name.startswith('.') or not entry.is_file(follow_symlinks=False):
+                continue
+            try:
+                os.link(entry.path, str(tmp_dir / entry.name))
+            except OSError:
+                shutil.copy2(entry.path, str(tmp_dir / entry.name))
+
+        # Only complete snapshots get a snapshot name.
+        os.rename(str(tmp_dir), str(snapshot_dir / name))
+
+    except OSError:
+        shutil.rmtree(str(tmp_dir), ignore_errors=True)
+        raise
+
+    return name
+
+
+def switch_current(snapshot_dir: Path, name: str) -> None:
+    """
+    Atomically point the `current` symlink at a snapshot.
+
+    Raises ValueError if there is no such snapshot.
+    """
+    if not (snapshot_dir / name).is_dir():
+        raise ValueError(f"No such snapshot: {name}")
+
+    tmp_link = snapshot_dir / f".{CURRENT}.partial"
+    if os.path.lexists(str(tmp_link)):
+        os.remove(str(tmp_link))
+
+    # Relative, so the snapshot directory can be moved or mounted elsewhere.
+    os.symlink(name, str(tmp_link))
+    os.replace(str(tmp_link), str(snapshot_dir / CURRENT))
+
+
+def prune_snapshots(snapshot_dir: Path, keep: int, protect: Iterable[str] = ()) -> List[str]:
+    """
+    Delete the oldest snapshots, keeping the newest `keep` and any in `protect`.
+
+    Returns the names of the deleted snapshots.
+    """
+    protect = set(protect)
+    protect.add(current_snapshot(snapshot_dir))
+
+    snapshots = list_snapshots(snapshot_dir)
+    expired = [name for name in snapshots[:max(len(snapshots) - keep, 0)] if name not in protect]
+    for name in expired:
+        shutil.rmtree(str(snapshot_dir / name))
+
+    return expired
@@ -0,0 +1,244 @@
+"""
+Copyright (C) 2021-2025 Cisco Systems, Inc. and/or its affiliates. All rights reserved.
+
+This module writes and reads the state cache: a compact, read-only copy of the
+state that `cvd update` leaves next to the config file.
+
+`cvd list`, `cvd show` and `cvd config show` read it with mmap instead of
+parsing the config and state files, and without taking the write path
+(saving the config, pruning logs, opening a log file). Health checks that run
+them every few seconds then cost little more than a few stat() calls.
+
+The cache is only used while the config file, the state file and the database
+directory are exactly as they were when it was written. Otherwise the
+commands fall back to reading the config and state files.
+
+Layout, big-endian:
+
+    header:     magic, format version, # databases,
+                config file (inode, mtime, size), state file (inode, mtime, size),
+                database directory mtime,
+                config text, state text, state file path, database directory path
+    records:    one fixed-size record per database, in `cvd list` order
+    strings:    the text referred to by the header and records
+
+Text is referred to by (offset, length) from the start of the file.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import base64
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import *
+
+MAGIC = b'CVDSTATE'
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct('!8sHI QqQ QqQ q II II II II')
+
+# name, url, CDIFFs (one per line), CVD header, fetch ring: (offset, length) each.
+# last modified, last checked, retry after, local version, DNS field, next fetch ring index.
+_RECORD = struct.Struct('!II II II II II ddd qqI')
+
+
+def cache_path_for(config_path: Path) -> Path:
+    return config_path.with_suffix('.cache')
+
+
+def _stat_key(path: Path) -> Tuple[int, int, int]:
+    st = os.stat(str(path))
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class _Strings:
+    def __init__(self, start: int) -> None:
+        self.start = start
+        self.chunks: List[bytes] = []
+        self.length = 0
+
+    def add(self, data: Union[str, bytes]) -> Tuple[int, int]:
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        offset = self.start + self.length
+        self.chunks.append(data)
+        self.length += len(data)
+        return offset, len(data)
+
+
+def write_cache(
+    config_path: Path,
+    state_path: Path,
+    db_dir: Path,
+    dbs: List[Tuple[str, dict]],
+    cvd_headers: Dict[str, bytes],
+) -> Path:
+    """
+    Write the state cache for a config, atomically.
+
+    Args:
+        config_path:    The config file, as saved.
+        state_path:     The state file, as saved.
+        db_dir:         The database directory.
+        dbs:            (name, details) for each database, in the order to list them.
+        cvd_headers:    The raw CVD header of each CVD in the database directory.
+
+    Returns: The path of the cache.
+    """
+    # Stat first. If a file changes while we read it, the cache will just be stale.
+    config_key = _stat_key(config_path)
+    state_key = _stat_key(state_path)
+    db_dir_mtime = os.stat(str(db_dir)).st_mtime_ns
+
+    strings = _Strings(_HEADER.size + _RECORD.size * len(dbs))
+    config_text = strings.add(config_path.read_bytes())
+    state_text = strings.add(state_path.read_bytes())
+    state_path_text = strings.add(str(state_path))
+    db_dir_text = strings.add(str(db_dir))
+
+    records = []
+    for name, details in dbs:
+        fetches = details.get('fetches', {})
+        try:
+            ring = base64.b64decode(fetches.get('ring', ''))
+        except ValueError:
+            ring = b''
+        records.append(_RECORD.pack(
+            *strings.add(name),
+            *strings.add(details['url']),
+            *strings.add('\n'.join(details['CDIFFs'])),
+            *strings.add(cvd_headers.get(name, b'')),
+            *strings.add(ring),
+            float(details['last modified']),
+            float(details['last checked']),
+            float(details['retry after']),
+            int(details['local version']),
+            int(details['DNS field']),
+            int(fetches.get('next', 0))))
+
+    header = _HEADER.pack(
+        MAGIC, FORMAT_VERSION, len(dbs),
+        *config_key, *state_key, db_dir_mtime,
+        *config_text, *state_text, *state_path_text, *db_dir_text)
+
+    path = cache_path_for(config_path)
+    partial = path.parent / f".{path.name}.partial"
+    with partial.open('wb') as cache_file:
+        cache_file.write(header)
+        cache_file.write(b''.join(records))
+        cache_file.write(b''.join(strings.chunks))
+    os.replace(str(partial), str(path))
+    return path
+
+
+class StateCache:
+    """
+    A state cache, mapped read-only. Use `StateCache.open()`.
+    """
+
+    def __init__(self, buf: mmap.mmap) -> None:
+        self.buf = buf
+        fields = _HEADER.unpack_from(buf)
+        self.count = fields[2]
+        self._config_key = tuple(fields[3:6])
+        self._state_key = tuple(fields[6:9])
+        self._db_dir_mtime = fields[9]
+        self._config_text = fields[10:12]
+        self._state_text = fields[12:14]
+        self.state_path = Path(self._text(*fields[14:16]))
+        self.db_dir = Path(self._text(*fields[16:18]))
+
+    @classmethod
+    def open(cls, config_path: Path) -> Optional["StateCache"]:
+        """
+        Open the state cache for a config.
+
+        Returns None if there is no cache, or if it is out of date.
+        """
+        try:
+            with cache_path_for(config_path).open('rb') as cache_file:
+                buf = mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # ValueError: an empty file can't be mapped.
+            return None
+
+        try:
+            if buf[:len(MAGIC)] != MAGIC or struct.unpack_from('!H', buf, len(MAGIC))[0] != FORMAT_VERSION:
+                raise ValueError("Not a state cache")
+
+            cache = cls(buf)
+            if (_stat_key(config_path) != cache._config_key or
+                _stat_key(cache.state_path) != cache._state_key or
+                os.stat(str(cache.db_dir)).st_mtime_ns != cache._db_dir_mtime):
+                raise ValueError("State cache is out of date")
+        except (OSError, ValueError, struct.error):
+            buf.close()
+            return None
+
+        return cache
+
+    def close(self) -> None:
+        self.buf.close()
+
+    def _bytes(self, offset: int, length: int) -> bytes:
+        return self.buf[offset:offset + length]
+
+    def _text(self, offset: int, length: int) -> str:
+        return self._bytes(offset, length).decode('utf-8')
+
+    @property
+    def config_text(self) -> str:
+        return self._text(*self._config_text)
+
+    @property
+    def state_text(self) -> str:
+        return self._text(*self._state_text)
+
+    def _record(self, index: int) -> tuple:
+        return _RECORD.unpack_from(self.buf, _HEADER.size + index * _RECORD.size)
+
+    def _details(self, record: tuple) -> dict:
+        cdiffs = self._text(*record[4:6])
+        details = {
+            "url" : self._text(*record[2:4]),
+            "retry after" : record[12],
+            "last modified" : record[10],
+            "last checked" : record[11],
+            "DNS field" : record[14],
+            "local version" : record[13],
+            "CDIFFs" : cdiffs.split('\n') if cdiffs != "" else [],
+        }
+        if record[9] > 0:
+            details['fetches'] = {
+                'ring': base64.b64encode(self._bytes(*record[8:10])).decode('ascii'),
+                'next': record[15],
+            }
+        return details
+
+    def __iter__(self) -> Iterator[Tuple[str, dict]]:
+        for index in range(self.count):
+            record = self._record(index)
+            yield self._text(*record[0:2]), self._details(record)
+
+    def find(self, name: str) -> Optional[Tuple[dict, bytes]]:
+        """
+        Get the details and raw CVD header (or b'') for a database, decoding only that record.
+        """
+        encoded = name.encode('utf-8')
+        for index in range(self.count):
+            record = self._record(index)
+            if record[1] == len(encoded) and self._bytes(*record[0:2]) == encoded:
+                return self._details(record), self._bytes(*record[6:8])
+        return None
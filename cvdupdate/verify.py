@@ -0,0 +1,165 @@
+"""
+Copyright (C) 2021-2025 Cisco Systems, Inc. and/or its affiliates. All rights reserved.
+
+This module checks the integrity of CVD, CDIFF and sign files.
+
+- CVD:   The MD5 in the header must match the archive that follows the header.
+- CDIFF: The gzip stream must decompress cleanly (which checks its CRC), start
+         with a "ClamAV-Diff" header for the version in the file name, and be
+         followed by the appended digital signature.
+- sign:  Must be a non-empty text file.
+
+This catches truncated and corrupted downloads. It does not check the digital
+signatures themselves, which requires the ClamAV public keys. FreshClam and
+ClamAV still do that when they load the files.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import hashlib
+import mmap
+import os
+import re
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import *
+
+from cvdupdate import cvd
+
+_CDIFF_NAME = re.compile(r'^.+-(?P<version>\d+)\.cdiff$')
+
+
+class VerifyResult(NamedTuple):
+    name: str
+    ok: bool
+    reason: str
+
+
+def _verify_cvd(path: Path, expected_version: int) -> VerifyResult:
+    st = os.stat(str(path))
+    if st.st_size <= cvd.CVD_HEADER_SIZE:
+        return VerifyResult(path.name, False, "too short to be a CVD")
+
+    with open(str(path), 'rb') as cvd_fd:
+        with mmap.mmap(cvd_fd.fileno(), 0, access=mmap.ACCESS_READ) as cvd_map:
+            header = cvd.parse_cvd_header(cvd_map)
+            with memoryview(cvd_map) as view:
+                md5 = hashlib.md5(view[cvd.CVD_HEADER_SIZE:]).hexdigest()
+
+    if expected_version > 0 and header.version != expected_version:
+        return VerifyResult(path.name, False, f"version {header.version} does not match expected version {expected_version}")
+
+    if header.md5 == "":
+        return VerifyResult(path.name, False, "header has no MD5")
+
+    if md5 != header.md5.lower():
+        return VerifyResult(path.name, False, f"MD5 {md5} does not match header MD5 {header.md5}")
+
+    return VerifyResult(path.name, True, f"version {header.version}, MD5 OK")
+
+
+def _verify_cdiff(path: Path, expected_version: int) -> VerifyResult:
+    decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    head = b''
+    trailer = b''
+    with open(str(path), 'rb') as cdiff_fd:
+        for chunk in iter(lambda: cdiff_fd.read(1024 * 1024), b''):
+            if decompressor.eof:
+                # The digital signature appended after the gzip stream.
+                trailer += chunk
+                continue
+            data = decompressor.decompress(chunk)
+            if len(head) < 64:
+                head += data[:64 - len(head)]
+
+    if not decompressor.eof:
+        return VerifyResult(path.name, False, "gzip stream is truncated")
+
+    trailer = decompressor.unused_data + trailer
+    if not trailer.startswith(b':') or len(trailer) < 2:
+        return VerifyResult(path.name, False, "missing digital signature")
+
+    fields = head.split(b':')
+    if fields[0] != b'ClamAV-Diff' or len(fields) < 2:
+        return VerifyResult(path.name, False, "missing ClamAV-Diff header")
+
+    if expected_version > 0 and fields[1] != str(expected_version).encode():
+        return VerifyResult(path.name, False, f"version {fields[1].decode('utf-8', 'ignore')} does not match expected version {expected_version}")
+
+    return VerifyResult(path.name, True, "gzip CRC OK")
+
+
+def _verify_sign(path: Path) -> VerifyResult:
+    content = path.read_bytes()
+    if len(content.strip()) == 0:
+        return VerifyResult(path.name, False, "sign file is empty")
+
+    try:
+        content.decode('ascii')
+    except UnicodeDecodeError:
+        return VerifyResult(path.name, False, "sign file is not text")
+
+    return VerifyResult(path.name, True, "sign file OK")
+
+
+def verify_file(path: Union[str, Path], expected_version: int = 0, name: str = "") -> VerifyResult:
+    """
+    Verify a single file. Files we don't know how to check are reported as OK.
+
+    The file type is taken from `name` if given, else from the path. This lets
+    us verify a download in a temporary file before it gets its real name.
+
+    This is a module-level function so it can run in a process pool.
+    """
+    path = Path(path)
+    if name == "":
+        name = path.name
+    try:
+        if name.endswith('.sign'):
+            result = _verify_sign(path)
+        elif name.endswith('.cvd'):
+            result = _verify_cvd(path, expected_version)
+        elif name.endswith('.cdiff'):
+            if expected_version == 0:
+                match = _CDIFF_NAME.match(name)
+                if match:
+                    expected_version = int(match.group('version'))
+            result = _verify_cdiff(path, expected_version)
+        else:
+            result = VerifyResult(name, True, "no integrity data to check")
+
+    except Exception as exc:
+        result = VerifyResult(name, False, f"{type(exc).__name__}: {exc}")
+
+    return result._replace(name=name)
+
+
+def verify_files(paths: List[Path], expected_versions: Optional[List[int]] = None, workers: int = 0) -> List[VerifyResult]:
+    """
+    Verify many files, spreading the hashing across CPU cores with a process pool.
+
+    Results are in the same order as the paths.
+    """
+    if expected_versions is None:
+        expected_versions = [0] * len(paths)
+
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(paths))
+
+    if workers <= 1:
+        return [verify_file(path, version) for path, version in zip(paths, expected_versions)]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(verify_file, [str(path) for path in paths], expected_versions))
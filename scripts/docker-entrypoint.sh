@@ -14,7 +14,14 @@ else
     cvdupdate config set --dbdir /cvdupdate/database
 fi
 
-if [ $# -eq 0 ]; then
+if [ $# -eq 0 ] && [ "${DAEMON:-0}" -ne "0" ]; then
+    echo "Running the update daemon"
+    if [ "${USER_ID}" -ne "0" ]; then
+        exec gosu cvdupdate cvdupdate daemon
+    else
+        exec cvdupdate daemon
+    fi
+elif [ $# -eq 0 ]; then
     set -e
 
     echo "Adding crontab entry"
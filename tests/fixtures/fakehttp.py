@@ -0,0 +1,28 @@
+class FakeResponse:
+    ''' Stands in for a requests.Response '''
+
+    def __init__(self, status_code, content=b'', headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def close(self):
+        pass
+
+
+class FakeServer:
+    ''' Stands in for a requests.Session. Records each request, and answers with respond() '''
+
+    def __init__(self):
+        self.requests = []
+
+    def get(self, url, headers=None, **kwargs):
+        self.requests.append(('GET', url))
+        return self.respond('GET', url, headers or {})
+
+    def head(self, url, headers=None, **kwargs):
+        self.requests.append(('HEAD', url))
+        return self.respond('HEAD', url, headers or {})
+
+    def respond(self, method, url, headers):
+        raise NotImplementedError
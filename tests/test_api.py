@@ -0,0 +1,73 @@
+import asyncio
+import logging
+import time
+
+from tests.fixtures.fakehttp import FakeResponse, FakeServer
+
+from cvdupdate.api import Updater
+from cvdupdate.cvdupdate import CvdStatus
+
+
+class FeedServer(FakeServer):
+    def respond(self, method, url, headers):
+        if url.endswith('.sign'):
+            return FakeResponse(404)
+        return FakeResponse(200, b'signatures')
+
+
+def _updater(tmp_path, session):
+    state = {'dbs': {
+        'extra.ndb': {
+            "url" : 'https://example.com/extra.ndb',
+            "retry after" : 0,
+            "last modified" : 0,
+            "last checked" : 0,
+            "DNS field" : 0,
+            "local version" : 0,
+            "CDIFFs" : []
+        },
+    }}
+    updater = Updater(
+        {'db directory': str(tmp_path / 'database'), 'log directory': str(tmp_path / 'logs')},
+        state,
+        session=session)
+
+    # Skip the DNS query.
+    updater.m.dns_version_tokens = ['0.105.0', '62', '27000', '1700000000', '1', '90', '0', '334']
+    updater.m.dns_expires = time.time() + 60
+    return updater, state
+
+
+def test_update_result(tmp_path):
+    root_handlers = list(logging.getLogger().handlers)
+    updater, state = _updater(tmp_path, FeedServer())
+
+    result = updater.update()
+    assert result.ok
+    assert result.files_changed == ['extra.ndb']
+
+    extra = result.dbs['extra.ndb']
+    assert extra.status == CvdStatus.UPDATED
+    assert [(file.name, file.status, file.changed) for file in extra.files] == [
+        ('extra.ndb', 200, True),
+        ('extra.ndb.sign', 404, False),
+    ]
+    assert result.bytes == len(b'signatures')
+
+    # The state we gave it was updated, and no config, state or log files were written.
+    assert state['dbs']['extra.ndb']['last modified'] > 0
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['database']
+    assert logging.getLogger().handlers == root_handlers
+
+
+def test_update_async_shares_session(tmp_path):
+    session = FeedServer()
+    first, _ = _updater(tmp_path / 'first', session)
+    second, _ = _updater(tmp_path / 'second', session)
+    assert first.m.session is second.m.session
+
+    async def update_both():
+        return await asyncio.gather(first.update_async(), second.update_async())
+
+    results = asyncio.run(update_both())
+    assert all(result.ok for result in results)
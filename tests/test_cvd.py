@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from cvdupdate import cvd
+
+HEADER = b"ClamAV-VDB:14 Oct 2021 07-15 -0400:26322:3982463:90:0d2d6bb5e8a6bd4b6c4e1a34b0de1a2b:sig:raynman:1634210133"
+
+def make_cvd(path, header=HEADER, payload=b"payload"):
+    path.write_bytes(header.ljust(cvd.CVD_HEADER_SIZE, b" ") + payload)
+    return path
+
+def test_parse_full_header():
+    header = cvd.parse_cvd_header(memoryview(HEADER.ljust(cvd.CVD_HEADER_SIZE, b" ") + b"payload"))
+    assert header.version == 26322
+    assert header.signatures == 3982463
+    assert header.functionality_level == 90
+    assert header.md5 == "0d2d6bb5e8a6bd4b6c4e1a34b0de1a2b"
+    assert header.builder == "raynman"
+    assert header.build_timestamp == 1634210133
+
+def test_parse_partial_header():
+    # Only the first 96 bytes are fetched when checking the version over HTTP.
+    header = cvd.parse_cvd_header(HEADER[:50])
+    assert header.version == 26322
+    assert header.md5 == ""
+
+def test_parse_rejects_garbage():
+    with pytest.raises(ValueError):
+        cvd.parse_cvd_header(b"<html>Not Found</html>")
+
+def test_read_header_is_cached(tmp_path):
+    path = make_cvd(tmp_path / "daily.cvd")
+    first = cvd.read_cvd_header(path)
+    assert first.version == 26322
+
+    # A replaced file gets a new (inode, mtime, size), so it gets reread.
+    make_cvd(tmp_path / "new.cvd", header=HEADER.replace(b":26322:", b":26323:"), payload=b"longer payload")
+    os.replace(str(tmp_path / "new.cvd"), str(path))
+    assert cvd.read_cvd_header(path).version == 26323
+
+def test_read_header_too_short(tmp_path):
+    path = tmp_path / "daily.cvd"
+    path.write_bytes(HEADER[:cvd.CVD_MIN_HEADER_SIZE - 1])
+    with pytest.raises(ValueError):
+        cvd.read_cvd_header(path)
+
+def test_read_partial_header(tmp_path):
+    # Shorter than a full header, but long enough for the version.
+    path = tmp_path / "daily.cvd"
+    path.write_bytes(HEADER)
+    assert cvd.read_cvd_header(path).version == 26322
+    assert cvd.read_raw_cvd_header(path) == HEADER
+
+def test_read_raw_header(tmp_path):
+    path = make_cvd(tmp_path / "daily.cvd")
+    assert cvd.read_raw_cvd_header(path) == HEADER
+    assert cvd.parse_cvd_header(cvd.read_raw_cvd_header(path)) == cvd.read_cvd_header(path)
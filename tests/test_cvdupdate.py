@@ -1,6 +1,7 @@
 import json
 from pathlib import Path
 import shutil
+import time
 
 from tests.fixtures.revert import revert_homedir
 
@@ -102,3 +103,244 @@ def test_existing_state_migrates_successfully(revert_homedir):
     with open(default_cvdupdate_dir / 'state.json') as state:
         from pprint import pprint
         assert new_state_json == json.loads(state.read())
+
+
+def test_index_local_databases(revert_homedir, tmp_path):
+    ''' state dbs come first, then unknown files; CDIFFs and sign files are skipped '''
+    c = CVDUpdate(config=tmp_path / 'config.json', db_dir=str(tmp_path / 'database'))
+    c.db_dir.mkdir()
+    for name in ('daily-1.cdiff', 'daily-1.cdiff.sign', 'b.ndb', 'a.ndb', '.a.ndb.partial'):
+        (c.db_dir / name).write_bytes(b'data')
+
+    names = [name for name, _ in c._iter_local_databases()]
+    assert names == list(c.state['dbs']) + ['a.ndb', 'b.ndb']
+
+    # Same result when the unknown files are indexed in parallel.
+    c._parallel_index_threshold = 0
+    assert list(c._index_local_databases()) == names
+    assert c._index_local_databases()['a.ndb']['url'] == 'n/a'
+
+
+def test_plan_update(revert_homedir, tmp_path):
+    ''' the plan only includes what is missing, using the DNS answer and local files '''
+    from cvdupdate.cvdupdate import PlanAction
+
+    from tests.fixtures.fakehttp import FakeResponse, FakeServer
+
+    class SizeServer(FakeServer):
+        def respond(self, method, url, headers):
+            if url.endswith('extra.ndb'):
+                return FakeResponse(405)
+            return FakeResponse(200, headers={'Content-Length': '5000'})
+
+    c = CVDUpdate(config=tmp_path / 'config.json', db_dir=str(tmp_path / 'database'))
+    c.db_dir.mkdir()
+    c._session = server = SizeServer()
+    c.dns_version_tokens = ['0.105.1', '62', '27002', '0', '1', '90', '0', '334']
+    c.config_add_db('extra.ndb', 'https://example.com/extra.ndb')
+    (c.db_dir / 'extra.ndb').write_bytes(b'x' * 10)
+
+    (c.db_dir / 'main.cvd').write_bytes(b'x' * 1000)
+    (c.db_dir / 'main-62.cvd.sign').write_bytes(b'sign')
+    c.state['dbs']['main.cvd']['local version'] = 62
+
+    (c.db_dir / 'daily.cvd').write_bytes(b'x' * 2000)
+    (c.db_dir / 'daily-27001.cdiff').write_bytes(b'x' * 100)
+    c.state['dbs']['daily.cvd']['local version'] = 27000
+
+    c.state['dbs']['bytecode.cvd']['retry after'] = time.time() + 3600
+
+    plans = c._plan_update()
+    assert plans['main.cvd'].action == PlanAction.UP_TO_DATE
+    assert plans['bytecode.cvd'].action == PlanAction.COOLDOWN
+    assert plans['extra.ndb'].action == PlanAction.CHECK
+    # The server didn't say, so it's guessed from the one we have.
+    assert plans['extra.ndb'].estimated_bytes == 10
+
+    daily = plans['daily.cvd']
+    assert daily.action == PlanAction.UPDATE
+    assert (daily.local_version, daily.advertised_version) == (27000, 27002)
+    assert daily.cdiffs == ['daily-27002.cdiff']
+    assert daily.signs == ['daily-27002.cdiff.sign', 'daily-27002.cvd.sign']
+    # The size of the new CVD, from a HEAD request, and of the CDIFF we already have.
+    assert daily.estimated_bytes == 5000 + 100
+    assert sorted(server.requests) == [
+        ('HEAD', 'https://database.clamav.net/daily.cvd?version=27002'),
+        ('HEAD', 'https://example.com/extra.ndb'),
+    ]
+
+    # A CVD we don't have yet is counted at its advertised size too.
+    (c.db_dir / 'daily.cvd').unlink()
+    assert c._plan_update(['daily.cvd'])['daily.cvd'].estimated_bytes == 5000 + 100
+    # And that HEAD is used by the download, instead of asking again.
+    assert c._head('https://database.clamav.net/daily.cvd?version=27002').status == 200
+    assert server.requests.count(('HEAD', 'https://database.clamav.net/daily.cvd?version=27002')) == 2
+
+
+def test_dry_run_leaves_corrupt_cvd_alone(revert_homedir, tmp_path):
+    ''' a dry run reports a corrupt CVD, but only the update deletes it '''
+    from tests.fixtures.fakehttp import FakeResponse, FakeServer
+
+    class SizeServer(FakeServer):
+        def respond(self, method, url, headers):
+            return FakeResponse(200, headers={'Content-Length': '5000'})
+
+    c = CVDUpdate(config=tmp_path / 'config.json', db_dir=str(tmp_path / 'database'))
+    c.db_dir.mkdir()
+    c._session = SizeServer()
+    c.dns_version_tokens = ['0.105.1', '62', '27002', '0', '1', '90', '0', '334']
+    c.dns_expires = time.time() + 3600
+    (c.db_dir / 'daily.cvd').write_bytes(b'x' * 100)
+
+    assert c.db_update('daily.cvd', dry_run=True) == 0
+    assert (c.db_dir / 'daily.cvd').read_bytes() == b'x' * 100
+    assert c.files_changed == set()
+    assert c._plan_update(['daily.cvd'])['daily.cvd'].corrupt
+
+
+def test_config_import_dbs(revert_homedir, tmp_path):
+    ''' bulk add saves once, skips duplicates and rejects invalid feeds '''
+    c = CVDUpdate(config=tmp_path / 'config.json', db_dir=str(tmp_path / 'database'))
+    feeds_path = tmp_path / 'feeds.json'
+    feeds_path.write_text(json.dumps([
+        {'db': 'a.ndb', 'url': 'https://example.com/a.ndb'},
+        {'db': 'b.ndb', 'url': 'https://example.com/a.ndb'},
+        {'db': 'c.txt', 'url': 'https://example.com/c.txt'},
+        {'db': 'd.ndb', 'url': 'ftp://example.com/d.ndb'},
+        {'db': 'daily.cvd', 'url': 'https://example.com/daily.cvd'},
+        {'db': 'e.yara', 'url': 'https://example.com/e.yara'},
+    ]))
+
+    saves = []
+    save_config = c._save_config
+    c._save_config = lambda: saves.append(1) or save_config()
+
+    assert c.config_import_dbs(feeds_path) == 2
+    assert len(saves) == 1
+
+    state = json.loads((tmp_path / 'state.json').read_text())
+    assert list(state['dbs']) == ['main.cvd', 'daily.cvd', 'bytecode.cvd', 'a.ndb', 'e.yara']
+    assert state['dbs']['daily.cvd']['url'] == 'https://database.clamav.net/daily.cvd'
+
+
+def test_sync_rejects_unsafe_file_names(revert_homedir, tmp_path):
+    ''' names from a peer's manifest must be plain database files in the database directory '''
+    import hashlib
+
+    from tests.fixtures.fakehttp import FakeResponse, FakeServer
+    from cvdupdate import manifest
+
+    def entry(db, content):
+        return {'db': db, 'version': 0, 'size': len(content), 'sha256': hashlib.sha256(content).hexdigest()}
+
+    class PeerServer(FakeServer):
+        def respond(self, method, url, headers):
+            if url.endswith(manifest.MANIFEST_FILE):
+                return FakeResponse(200, json.dumps({
+                    'manifest version': manifest.MANIFEST_VERSION,
+                    'dns': '',
+                    'files': {
+                        'good.ndb': entry('good.ndb', b'good'),
+                        '../evil.ndb': entry('../evil.ndb', b'evil'),
+                        'sub\\evil.ndb': entry('', b'evil'),
+                        '.hidden.ndb': entry('.hidden.ndb', b'evil'),
+                        'evil.sh': entry('', b'evil'),
+                        'good.hdb': entry('../evil.hdb', b'evil'),
+                    },
+                }).encode())
+            return FakeResponse(200, url.rsplit('/', 1)[-1].split('.')[0].encode())
+
+    c = CVDUpdate(config=tmp_path / 'config.json', db_dir=str(tmp_path / 'database'))
+    c._session = server = PeerServer()
+
+    assert c.db_sync('https://peer.example.com') == 5
+    assert server.requests == [
+        ('GET', f'https://peer.example.com/{manifest.MANIFEST_FILE}'),
+        ('GET', 'https://peer.example.com/good.ndb'),
+    ]
+    assert sorted(name for name in c.state['dbs'] if name.endswith(('.ndb', '.hdb'))) == ['good.ndb']
+    assert not (tmp_path / 'evil.ndb').exists()
+    assert (c.db_dir / 'good.ndb').read_bytes() == b'good'
+
+
+def test_only_truncated_cvds_are_deleted(revert_homedir, tmp_path):
+    ''' a CVD is deleted as corrupt only if it's too short to hold the version '''
+    c = CVDUpdate(config=tmp_path / 'config.json', db_dir=str(tmp_path / 'database'))
+    c.db_dir.mkdir()
+    header = b'ClamAV-VDB:14 Oct 2021 07-15 -0400:26322:3982463:90:0d2d6bb5e8a6bd4b6c4e1a34b0de1a2b:sig:raynman:1634210133'
+
+    (c.db_dir / 'daily.cvd').write_bytes(header[:100])
+    assert c._get_cvd_version_from_file(c.db_dir / 'daily.cvd') == 26322
+    assert (c.db_dir / 'daily.cvd').exists()
+
+    (c.db_dir / 'daily.cvd').write_bytes(header[:95])
+    assert c._get_cvd_version_from_file(c.db_dir / 'daily.cvd') == 0
+    assert not (c.db_dir / 'daily.cvd').exists()
+
+
+def test_cdiffs_and_sign_files_are_fetched_in_batches(revert_homedir, tmp_path):
+    ''' the CDIFFs for a database are requested together, then their sign files '''
+    from tests.fixtures.fakehttp import FakeResponse, FakeServer
+    from cvdupdate.cvdupdate import CvdStatus
+
+    header = b'ClamAV-VDB:14 Oct 2021 07-15 -0400:103:3982463:90:0d2d6bb5e8a6bd4b6c4e1a34b0de1a2b:sig:raynman:1634210133'
+
+    class CdnServer(FakeServer):
+        def respond(self, method, url, headers):
+            name = url.rsplit('/', 1)[-1]
+            if method == 'HEAD' or name == 'daily-102.cdiff.sign':
+                return FakeResponse(404)
+            if name.startswith('daily.cvd'):
+                return FakeResponse(200, header.ljust(512, b' ') + b'payload')
+            return FakeResponse(200, name.encode())
+
+    c = CVDUpdate(config=tmp_path / 'config.json', db_dir=str(tmp_path / 'database'))
+    c.db_dir.mkdir()
+    c._session = CdnServer()
+    c.state['dbs']['daily.cvd']['local version'] = 100
+
+    batches = []
+    fetch_all = c.downloader.fetch_all
+    c.downloader.fetch_all = lambda requests: batches.append([request.url.rsplit('/', 1)[-1] for request in requests]) or fetch_all(requests)
+
+    assert c._download_cvd('daily.cvd', 103) == CvdStatus.UPDATED
+    assert batches == [
+        ['daily-101.cdiff', 'daily-102.cdiff', 'daily-103.cdiff'],
+        ['daily-101.cdiff.sign', 'daily-102.cdiff.sign', 'daily-103.cdiff.sign'],
+    ]
+    assert c.state['dbs']['daily.cvd']['CDIFFs'] == ['daily-101.cdiff', 'daily-102.cdiff', 'daily-103.cdiff']
+    assert c.state['dbs']['daily.cvd']['local version'] == 103
+    assert (c.db_dir / 'daily-103.cdiff.sign').read_bytes() == b'daily-103.cdiff.sign'
+    assert not (c.db_dir / 'daily-102.cdiff.sign').exists()
+
+
+def test_config_add_dbs_prefetch(revert_homedir, tmp_path):
+    ''' only the downloads are made in parallel; the files are saved on the calling thread '''
+    import threading
+
+    from tests.fixtures.fakehttp import FakeResponse, FakeServer
+
+    class FeedServer(FakeServer):
+        def respond(self, method, url, headers):
+            if url.endswith('.sign') or url.endswith('c.ndb'):
+                return FakeResponse(404)
+            return FakeResponse(200, url.rsplit('/', 1)[-1].encode())
+
+    c = CVDUpdate(config=tmp_path / 'config.json', db_dir=str(tmp_path / 'database'))
+    c._session = FeedServer()
+
+    batches = []
+    fetch_all = c.downloader.fetch_all
+    c.downloader.fetch_all = lambda requests: batches.append(len(requests)) or fetch_all(requests)
+    publishers = set()
+    publish_file = c._publish_file
+    c._publish_file = lambda *args, **kwargs: publishers.add(threading.current_thread()) or publish_file(*args, **kwargs)
+
+    feeds = [(name, f'https://example.com/{name}') for name in ('a.ndb', 'b.ndb', 'c.ndb')]
+    assert c.config_add_dbs(feeds, prefetch=True) == 1
+    assert batches == [3]
+    assert publishers == {threading.current_thread()}
+    assert (c.db_dir / 'a.ndb').read_bytes() == b'a.ndb'
+    assert (c.db_dir / 'b.ndb').read_bytes() == b'b.ndb'
+    assert not (c.db_dir / 'c.ndb').exists()
+    assert all(c.state['dbs'][name]['last checked'] > 0 for name in ('a.ndb', 'b.ndb', 'c.ndb'))
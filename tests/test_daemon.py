@@ -0,0 +1,109 @@
+import time
+
+from tests.fixtures.revert import revert_homedir
+
+from cvdupdate.cvdupdate import CVDUpdate, CvdStatus
+from cvdupdate.daemon import MIN_INTERVAL, DnsWatcher, UpdateDaemon
+
+def test_next_check(revert_homedir, tmp_path):
+    m = CVDUpdate(config=tmp_path / 'config.json')
+    d = UpdateDaemon(m, interval=1000, jitter=0)
+    now = time.time()
+
+    # No DNS answer yet, so fall back to the interval.
+    assert d._next_check('daily.cvd', now) == now + 1000
+
+    # Checked again when the DNS answer expires, but not too often.
+    m.dns_expires = now + 1800
+    assert d._next_check('daily.cvd', now) == now + 1800
+    m.dns_expires = now + 1
+    assert d._next_check('daily.cvd', now) == now + MIN_INTERVAL
+
+    # Cool-downs win.
+    m.state['dbs']['daily.cvd']['retry after'] = now + 5000
+    assert d._next_check('daily.cvd', now) == now + 5000
+
+def test_run_once_updates_due_dbs(revert_homedir, tmp_path):
+    m = CVDUpdate(config=tmp_path / 'config.json')
+    updated = []
+    m.db_update = lambda dbs: updated.append(sorted(dbs)) or 0
+
+    d = UpdateDaemon(m, interval=1000, jitter=0)
+    d._reschedule_all()
+    assert d.run_once() == 0
+    # All at once, in one update.
+    assert updated == [sorted(m.state['dbs'])]
+
+    # Nothing is due until the interval passes.
+    updated.clear()
+    d.run_once()
+    assert updated == []
+
+def test_dns_watcher_updates_changed_dbs(revert_homedir, tmp_path):
+    m = CVDUpdate(config=tmp_path / 'config.json')
+    answers = [
+        ['0.105.1', '62', '27000', '0', '1', '90', '0', '334'],
+        ['0.105.1', '62', '27001', '0', '1', '90', '0', '334'],
+    ]
+    def query():
+        m.dns_version_tokens = answers.pop(0)
+        return True
+    m._query_dns_txt_entry = query
+    updated = []
+    def db_update(dbs):
+        updated.append(sorted(dbs))
+        m.db_results = {db: (CvdStatus.UPDATED, 0.0, set()) for db in dbs}
+        return 0
+    m.db_update = db_update
+
+    w = DnsWatcher(m)
+    w.poll()
+    # Nothing seen before, so everything with a DNS field is checked, in one update.
+    assert updated == [['bytecode.cvd', 'daily.cvd', 'main.cvd']]
+
+    updated.clear()
+    w.poll()
+    assert updated == [['daily.cvd']]
+    assert len(w.changes) == 1
+
+def test_dns_watcher_retries_failed_dbs(revert_homedir, tmp_path):
+    m = CVDUpdate(config=tmp_path / 'config.json')
+    m.dns_version_tokens = ['0.105.1', '62', '27001', '0', '1', '90', '0', '335']
+    m._query_dns_txt_entry = lambda: True
+    def db_update(dbs):
+        m.db_results = {
+            'daily.cvd': (CvdStatus.ERROR, 0.0, set()),
+            'bytecode.cvd': (CvdStatus.UPDATED, 0.0, set()),
+        }
+        return 1
+    m.db_update = db_update
+
+    w = DnsWatcher(m)
+    w.tokens = ['0.105.1', '62', '27000', '0', '1', '90', '0', '334']
+    assert w.poll() == 1
+    # daily.cvd will be tried again at the next poll.
+    assert w.tokens == ['0.105.1', '62', '27000', '0', '1', '90', '0', '335']
+
+def test_dns_txt_only_advertises_what_we_have(revert_homedir, tmp_path):
+    m = CVDUpdate(config=tmp_path / 'config.json', db_dir=str(tmp_path / 'database'))
+    m.dns_version_tokens = ['0.105.1', '62', '27001', '0', '1', '90', '0', '335']
+    m.state['dbs']['main.cvd']['local version'] = 62
+    m.state['dbs']['daily.cvd']['local version'] = 27000
+    m.state['dbs']['bytecode.cvd']['local version'] = 335
+    m.db_results = {
+        'daily.cvd': (CvdStatus.ERROR, 0.0, set()),
+        'bytecode.cvd': (CvdStatus.UPDATED, 0.0, set()),
+    }
+    assert m._dns_tokens_to_publish() == ['0.105.1', '62', '27000', '0', '1', '90', '0', '335']
+
+def test_dns_watcher_poll_interval(revert_homedir, tmp_path):
+    m = CVDUpdate(config=tmp_path / 'config.json')
+    w = DnsWatcher(m, min_interval=60, max_interval=3600)
+    w.changes.extend([0, 4000, 8000])
+
+    # Next publication expected at 12000.
+    assert w._poll_interval(8000) == 2000
+    assert w._poll_interval(11800) == 100
+    # Late, so back off from the minimum.
+    assert w._poll_interval(12500) == 60
+    assert w._poll_interval(12560) == 120
@@ -0,0 +1,88 @@
+import os
+
+from cvdupdate.dirindex import DirectoryIndex
+
+
+def test_lookups_are_answered_from_the_listing(tmp_path):
+    (tmp_path / 'daily.cvd').write_bytes(b'daily')
+    (tmp_path / 'snapshots').mkdir()
+    index = DirectoryIndex(tmp_path, max_age=3600)
+
+    assert index.stat('daily.cvd').st_size == 5
+    assert index.stat('daily-2.cdiff') is None
+    assert index.is_dir('snapshots')
+
+    # Not listed again until the index is invalidated (eg: after an update).
+    (tmp_path / 'daily-2.cdiff').write_bytes(b'cdiff')
+    assert index.stat('daily-2.cdiff') is None
+    index.invalidate()
+    assert index.stat('daily-2.cdiff').st_size == 5
+
+
+def test_missing_directory(tmp_path):
+    index = DirectoryIndex(tmp_path / 'database')
+    assert index.stat('daily.cvd') is None
+    assert index.open('daily.cvd') is None
+
+
+def test_handles_are_shared_and_closed_when_replaced(tmp_path):
+    (tmp_path / 'main.cvd').write_bytes(b'0123456789')
+    index = DirectoryIndex(tmp_path, max_age=0)
+
+    first = index.open('main.cvd')
+    second = index.open('main.cvd')
+    assert first.handle is second.handle
+    first.seek(2)
+    assert first.read(3) == b'234'
+    assert second.read() == b'0123456789'
+    assert first.tell() == 5
+    first.close()
+
+    # Replaced the way updates do, by renaming a new file into place.
+    partial = tmp_path / '.main.cvd.partial'
+    partial.write_bytes(b'new main.cvd')
+    os.replace(str(partial), str(tmp_path / 'main.cvd'))
+    index.invalidate()
+
+    third = index.open('main.cvd')
+    assert third.read() == b'new main.cvd'
+    # The old handle stays open until its last request is done with it.
+    assert not second.handle.raw.closed
+    second.close()
+    assert second.handle.raw.closed
+    third.close()
+
+    index.close()
+    assert third.handle.raw.closed
+
+
+def test_least_recently_used_handles_are_closed(tmp_path):
+    for name in ('a.ndb', 'b.ndb', 'c.ndb'):
+        (tmp_path / name).write_bytes(name.encode())
+    index = DirectoryIndex(tmp_path, max_age=3600, max_open=2)
+
+    handles = {}
+    for name in ('a.ndb', 'b.ndb', 'c.ndb'):
+        with index.open(name) as indexed:
+            handles[name] = indexed.handle
+
+    assert list(index.handles) == ['b.ndb', 'c.ndb']
+    assert handles['a.ndb'].raw.closed
+    assert not handles['c.ndb'].raw.closed
+
+
+def test_follows_the_directory_it_is_given(tmp_path):
+    ''' eg: the `current` snapshot, once the first one is published '''
+    db_dir = tmp_path / 'database'
+    db_dir.mkdir()
+    (db_dir / 'daily.cvd').write_bytes(b'daily')
+    current = tmp_path / 'snapshots' / 'current'
+    index = DirectoryIndex(lambda: current if current.exists() else db_dir, max_age=3600)
+    assert index.directory == db_dir
+    assert index.stat('daily.cvd').st_size == 5
+
+    current.mkdir(parents=True)
+    (current / 'daily.cvd').write_bytes(b'new daily')
+    index.invalidate()
+    assert index.stat('daily.cvd').st_size == 9
+    assert index.directory == current
@@ -0,0 +1,53 @@
+import socket
+import struct
+
+from cvdupdate.dns_responder import DnsTxtResponder, build_response, parse_question
+
+
+def _query(name, qtype=16, query_id=0x1234):
+    qname = b''.join(bytes([len(label)]) + label.encode() for label in name.split('.')) + b'\0'
+    return struct.pack('!HHHHHH', query_id, 0x0100, 1, 0, 0, 0) + qname + struct.pack('!HH', qtype, 1)
+
+
+def _answer(response):
+    query_id, flags, qdcount, ancount, _, _ = struct.unpack_from('!HHHHHH', response)
+    end = parse_question(response).end
+    txt = b''
+    if ancount:
+        rdlength = struct.unpack_from('!H', response, end + 10)[0]
+        rdata = response[end + 12:end + 12 + rdlength]
+        txt = rdata[1:1 + rdata[0]]
+    return query_id, flags & 0xF, txt
+
+
+def test_build_response():
+    txt = b'0.105.1:62:27002:1700000000:1:90:49192:334'
+    assert _answer(build_response(_query('current.cvd.example.com'), 'example.com', txt)) == (0x1234, 0, txt)
+    assert _answer(build_response(_query('CURRENT.cvd.Example.com'), 'example.com.', txt)) == (0x1234, 0, txt)
+    assert _answer(build_response(_query('current.cvd.example.com', qtype=1), 'example.com', txt)) == (0x1234, 0, b'')
+    assert _answer(build_response(_query('other.example.com'), 'example.com', txt)) == (0x1234, 3, b'')
+    assert _answer(build_response(_query('current.cvd.clamav.net'), 'example.com', txt)) == (0x1234, 5, b'')
+
+    # Truncated question.
+    assert struct.unpack_from('!HH', build_response(_query('current.cvd.example.com')[:20], 'example.com', txt))[1] & 0xF == 1
+    assert build_response(b'\0', 'example.com', txt) is None
+
+
+def test_responder_reloads_dns_txt(tmp_path):
+    dns_file = tmp_path / 'dns.txt'
+    dns_file.write_text('0.105.1:62:27001')
+    responder = DnsTxtResponder('example.com', dns_file, address='127.0.0.1', port=0)
+    responder.start()
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client:
+            client.settimeout(5)
+            client.sendto(_query('current.cvd.example.com'), ('127.0.0.1', responder.port))
+            assert _answer(client.recv(512))[2] == b'0.105.1:62:27001'
+
+        (tmp_path / 'dns.txt.new').write_text('0.105.1:62:27002')
+        (tmp_path / 'dns.txt.new').replace(dns_file)
+        assert responder.reload()
+        assert not responder.reload()
+        assert responder.txt == b'0.105.1:62:27002'
+    finally:
+        responder.stop()
@@ -0,0 +1,138 @@
+import asyncio
+import threading
+
+from tests.fixtures.fakehttp import FakeResponse
+from tests.fixtures.revert import revert_homedir
+
+from cvdupdate.cvdupdate import CVDUpdate, CvdStatus
+from cvdupdate.downloader import DownloadRequest, Downloader, ThreadedDownloader, http_date
+
+
+class FlakyServer:
+    ''' Fails, then truncates, then sends the whole thing '''
+
+    def __init__(self):
+        self.requests = []
+
+    def get(self, url, headers=None, **kwargs):
+        self.requests.append(headers)
+        if len(self.requests) == 1:
+            raise ConnectionError("Connection reset by peer")
+        if len(self.requests) == 2:
+            return FakeResponse(200, b'sig', {'content-length': '10'})
+        return FakeResponse(200, b'signatures', {'content-length': '10'})
+
+
+class EchoServer:
+    def __init__(self):
+        self.threads = set()
+
+    def get(self, url, headers=None, **kwargs):
+        self.threads.add(threading.get_ident())
+        return FakeResponse(200, url.encode())
+
+
+def test_fetch_retries():
+    server = FlakyServer()
+    downloader = Downloader(server, 'test', max_retry=3)
+
+    result = downloader.fetch(DownloadRequest('https://example.com/extra.ndb', if_modified_since=0, byte_range='bytes=0-95'))
+    assert result.ok
+    assert result.content == b'signatures'
+    assert result.attempts == 3
+    assert server.requests[0] == {
+        'User-Agent': 'test',
+        'If-Modified-Since': http_date(0),
+        'Range': 'bytes=0-95',
+    }
+
+    # Out of retries, still truncated.
+    server.requests = []
+    result = Downloader(server, 'test', max_retry=2).fetch(DownloadRequest('https://example.com/extra.ndb'))
+    assert result.status == 200
+    assert result.truncated
+    assert not result.ok
+
+
+def test_fetch_all_keeps_order():
+    requests = [DownloadRequest(f'https://example.com/{i}.ndb') for i in range(8)]
+
+    for downloader in (Downloader(EchoServer(), 'test', 1), ThreadedDownloader(EchoServer(), 'test', 1, workers=4)):
+        results = downloader.fetch_all(requests)
+        assert [result.content for result in results] == [request.url.encode() for request in requests]
+
+    result = asyncio.run(Downloader(EchoServer(), 'test', 1).fetch_async(requests[0]))
+    assert result.content == requests[0].url.encode()
+
+
+def test_no_response(revert_homedir, tmp_path):
+    ''' a request that never gets a response is an error, not an exception '''
+    c = CVDUpdate(config=tmp_path / 'config.json', db_dir=str(tmp_path / 'database'))
+    c.db_dir.mkdir()
+    c._add_db('extra.ndb', 'https://example.com/extra.ndb')
+
+    class DownServer:
+        def get(self, url, headers=None, **kwargs):
+            raise ConnectionError("Connection refused")
+
+    c._session = DownServer()
+    assert c._download_db_from_url('extra.ndb', 'https://example.com/extra.ndb', 0) == CvdStatus.ERROR
+
+
+class RangeServer:
+    ''' Serves one file, with Range support. The first request for each range is cut short. '''
+
+    def __init__(self, content, etag='"v1"'):
+        self.content = content
+        self.etag = etag
+        self.ranges = []
+
+    def head(self, url, headers=None, **kwargs):
+        return FakeResponse(200, headers={'Content-Length': str(len(self.content)), 'Accept-Ranges': 'bytes', 'ETag': self.etag})
+
+    def get(self, url, headers=None, **kwargs):
+        if url.endswith('.sign'):
+            return FakeResponse(404)
+        if 'Range' not in headers or headers.get('If-Range', self.etag) != self.etag:
+            return FakeResponse(200, self.content, {'Content-Length': str(len(self.content))})
+
+        start, end = (int(n) for n in headers['Range'][len('bytes='):].split('-'))
+        first_try = headers['Range'] not in self.ranges
+        self.ranges.append(headers['Range'])
+        body = self.content[start:end + 1]
+        if first_try:
+            body = body[:-1]
+        return FakeResponse(206, body, {'Content-Range': f'bytes {start}-{end}/{len(self.content)}'})
+
+
+def test_fetch_segmented(tmp_path):
+    content = bytes(range(256)) * 40
+    server = RangeServer(content)
+    downloader = Downloader(server, 'test', max_retry=3)
+
+    result = downloader.fetch_segmented(DownloadRequest('https://example.com/main.cvd'), tmp_path / 'main.cvd', len(content), 4, '"v1"')
+    assert result.ok
+    assert result.received == len(content)
+    assert (tmp_path / 'main.cvd').read_bytes() == content
+    # Every segment was retried once.
+    assert len(server.ranges) == 8
+
+    # The file changed, so the server sends all of it instead.
+    result = downloader.fetch_segmented(DownloadRequest('https://example.com/main.cvd'), tmp_path / 'main.cvd', len(content), 4, '"v0"')
+    assert not result.ok
+    assert result.status == 200
+
+
+def test_segmented_cvd_download(revert_homedir, tmp_path):
+    c = CVDUpdate(config=tmp_path / 'config.json', db_dir=str(tmp_path / 'database'))
+    c.db_dir.mkdir()
+    c.config['download segments'] = 4
+    c.config['segment min size'] = 1024
+
+    content = b'ClamAV-VDB:01 Jan 2026 00-00 +0000:62:100:90:abcd:dsig:builder:1'.ljust(512) + bytes(range(256)) * 40
+    c._session = RangeServer(content)
+
+    assert c._download_db_from_url('main.cvd', 'https://database.clamav.net/main.cvd', 0, version=62) == CvdStatus.UPDATED
+    assert (c.db_dir / 'main.cvd').read_bytes() == content
+    assert c.state['dbs']['main.cvd']['local version'] == 62
+    assert not (c.db_dir / '.main.cvd.partial').exists()
@@ -0,0 +1,158 @@
+import os
+
+from tests.fixtures.fakehttp import FakeResponse, FakeServer
+from tests.fixtures.revert import revert_homedir
+
+from cvdupdate import freshness, manifest
+from cvdupdate.cvdupdate import CVDUpdate, CvdStatus
+
+
+class IgnoresConditionalServer(FakeServer):
+    ''' Always sends the whole file, but answers HEAD requests '''
+
+    def respond(self, method, url, headers):
+        if method == 'HEAD':
+            return FakeResponse(200, headers={'ETag': '"a"', 'Content-Length': '10'})
+        if url.endswith('.sign'):
+            return FakeResponse(404)
+        return FakeResponse(200, b'signatures', {'ETag': '"a"', 'Content-Length': '10'})
+
+
+class TruncatingServer(FakeServer):
+    ''' Sends a new version, truncated until `healthy`, and honors If-None-Match '''
+
+    def __init__(self):
+        super().__init__()
+        self.healthy = False
+
+    def respond(self, method, url, headers):
+        if url.endswith('.sign'):
+            return FakeResponse(404)
+        if headers.get('If-None-Match') == '"v2"':
+            return FakeResponse(304)
+        if not self.healthy:
+            return FakeResponse(200, b'new', {'ETag': '"v2"', 'content-length': '14'})
+        return FakeResponse(200, b'new signatures', {'ETag': '"v2"', 'content-length': '14'})
+
+
+def test_validators_from_headers():
+    validators = freshness.validators_from_headers({'Content-Range': 'bytes 0-0/1234', 'Content-Length': '1', 'ETag': '"x"'})
+    assert validators == freshness.Validators(etag='"x"', content_length=1234)
+
+    saved = freshness.Validators(etag='"x"', content_length=1234)
+    assert freshness.is_unchanged(saved, validators) is True
+    assert freshness.is_unchanged(saved, validators._replace(content_length=1)) is False
+    assert freshness.is_unchanged(freshness.Validators(), validators) is None
+
+
+def test_learns_to_probe_with_head(revert_homedir, tmp_path):
+    ''' once we see a server ignore If-Modified-Since, we check it with HEAD instead '''
+    c = CVDUpdate(config=tmp_path / 'config.json', db_dir=str(tmp_path / 'database'))
+    c.db_dir.mkdir()
+    c._add_db('extra.ndb', 'https://example.com/extra.ndb')
+    c._session = server = IgnoresConditionalServer()
+
+    assert c._download_db_from_url('extra.ndb', 'https://example.com/extra.ndb', 0) == CvdStatus.UPDATED
+    assert c._origin_strategy('https://example.com/extra.ndb') == freshness.ProbeStrategy.UNKNOWN
+
+    # Sent the same file again, though we asked if it was modified.
+    # The file is left alone, and we learn to use HEAD instead.
+    mtime = (c.db_dir / 'extra.ndb').stat().st_mtime_ns
+    assert c._download_db_from_url('extra.ndb', 'https://example.com/extra.ndb', 1000) == CvdStatus.NO_UPDATE
+    assert (c.db_dir / 'extra.ndb').stat().st_mtime_ns == mtime
+    assert c._origin_strategy('https://example.com/extra.ndb') == freshness.ProbeStrategy.HEAD
+
+    server.requests = []
+    assert c._download_db_from_url('extra.ndb', 'https://example.com/extra.ndb', 1000) == CvdStatus.NO_UPDATE
+    assert ('GET', 'https://example.com/extra.ndb') not in server.requests
+    assert ('HEAD', 'https://example.com/extra.ndb') in server.requests
+
+
+def test_validators_saved_only_after_download_is_kept(revert_homedir, tmp_path):
+    ''' a truncated download mustn't make the next update think it already has that version '''
+    c = CVDUpdate(config=tmp_path / 'config.json', db_dir=str(tmp_path / 'database'))
+    c.db_dir.mkdir()
+    c._add_db('extra.ndb', 'https://example.com/extra.ndb')
+    (c.db_dir / 'extra.ndb').write_bytes(b'old signatures')
+    c._session = server = TruncatingServer()
+
+    assert c._download_db_from_url('extra.ndb', 'https://example.com/extra.ndb', 1000) == CvdStatus.ERROR
+    assert freshness.validators_from_state(c.state['dbs']['extra.ndb']).etag != '"v2"'
+
+    server.healthy = True
+    assert c._download_db_from_url('extra.ndb', 'https://example.com/extra.ndb', 1000) == CvdStatus.UPDATED
+    assert (c.db_dir / 'extra.ndb').read_bytes() == b'new signatures'
+    assert freshness.validators_from_state(c.state['dbs']['extra.ndb']).etag == '"v2"'
+
+
+def test_changed_content_is_replaced(revert_homedir, tmp_path):
+    c = CVDUpdate(config=tmp_path / 'config.json', db_dir=str(tmp_path / 'database'))
+    c.db_dir.mkdir()
+    (c.db_dir / 'extra.ndb').write_bytes(b'signaturez')
+
+    assert not c._matches_local_file('extra.ndb', b'signatures')
+    assert not c._matches_local_file('extra.ndb', b'more signatures')
+    assert c._matches_local_file('extra.ndb', b'signaturez')
+
+
+def test_manifest_is_read_once_per_update(revert_homedir, tmp_path, monkeypatch):
+    c = CVDUpdate(config=tmp_path / 'config.json', db_dir=str(tmp_path / 'database'))
+    c.db_dir.mkdir()
+    (c.db_dir / 'a.ndb').write_bytes(b'signatures')
+    (c.db_dir / 'b.ndb').write_bytes(b'signatures')
+    c._write_manifest()
+
+    loads = []
+    load_manifest = manifest.load_manifest
+    monkeypatch.setattr(manifest, 'load_manifest', lambda path: loads.append(path) or load_manifest(path))
+
+    assert c._matches_local_file('a.ndb', b'signatures')
+    assert c._matches_local_file('b.ndb', b'signatures')
+    # Replaced since the manifest was read, so its old hash isn't trusted.
+    (c.db_dir / 'a.ndb').write_bytes(b'signaturez')
+    os.utime(str(c.db_dir / 'a.ndb'), (1, 1))
+    assert c._matches_local_file('a.ndb', b'signaturez')
+    assert len(loads) == 1
+
+
+def test_missing_sign_files_are_remembered(revert_homedir, tmp_path):
+    ''' a sign file that wasn't found isn't asked for again, nor are any from a server that never has them '''
+    c = CVDUpdate(config=tmp_path / 'config.json', db_dir=str(tmp_path / 'database'))
+    c.db_dir.mkdir()
+    c._session = server = IgnoresConditionalServer()
+
+    c._download_sign_file_for('extra.ndb', 'https://example.com/extra.ndb', 0)
+    assert server.requests == [('GET', 'https://example.com/extra.ndb.sign')]
+
+    server.requests = []
+    c._download_sign_file_for('extra.ndb', 'https://example.com/extra.ndb', 0)
+    assert server.requests == []
+
+    # After a few misses, we stop asking the server for any sign files.
+    c._download_sign_file_for('more.ndb', 'https://example.com/more.ndb', 0)
+    c._download_sign_file_for('most.ndb', 'https://example.com/most.ndb', 0)
+    assert len(server.requests) == 2
+
+    server.requests = []
+    c._download_sign_file_for('other.ndb', 'https://example.com/other.ndb', 0)
+    assert server.requests == []
+
+    c._download_sign_file_for('other.ndb', 'https://example.org/other.ndb', 0)
+    assert server.requests == [('GET', 'https://example.org/other.ndb.sign')]
+
+
+def test_official_sign_files_are_always_asked_for(revert_homedir, tmp_path):
+    ''' missing sign files for the official CVDs are remembered one by one, never for the whole server '''
+    c = CVDUpdate(config=tmp_path / 'config.json', db_dir=str(tmp_path / 'database'))
+    c.db_dir.mkdir()
+    c._session = server = IgnoresConditionalServer()
+
+    url = 'https://database.clamav.net/daily.cvd'
+    for version in range(100, 105):
+        c._download_sign_file_for(f'daily-{version}.cdiff', url, 0, version=version)
+    assert len(server.requests) == 5
+    assert 'database.clamav.net' not in str(c.state.get('sign origins', {}))
+
+    server.requests = []
+    c._download_sign_file_for('daily.cvd', url, 0, version=105)
+    assert server.requests == [('GET', 'https://database.clamav.net/daily-105.cvd.sign')]
@@ -0,0 +1,61 @@
+import json
+import socket
+import sys
+import threading
+
+from tests.fixtures.revert import revert_homedir
+
+from cvdupdate.cvdupdate import CVDUpdate
+
+
+def test_command_hook_gets_changed_files(revert_homedir, tmp_path):
+    ''' a command hook gets the payload on stdin and the file names in the environment '''
+    c = CVDUpdate(config=tmp_path / 'config.json', db_dir=str(tmp_path / 'database'))
+    c.db_dir.mkdir()
+    (c.db_dir / 'daily.cvd').write_bytes(b'cvd')
+    c.dns_version_tokens = ['0.105.1', '62', '27002']
+
+    out = tmp_path / 'out.json'
+    script = f"import json, os, sys; json.dump({{'env': os.environ['CVD_CHANGED_FILES'], 'payload': json.load(sys.stdin)}}, open({str(out)!r}, 'w'))"
+    c.config['post update hooks'] = [
+        {'command': f'{sys.executable} -c "{script}"'},
+        {'command': 'exit 3'},
+    ]
+
+    c._run_post_update_hooks({'daily.cvd', 'daily-27001.cdiff', 'dns.txt'})
+    assert c.wait_for_hooks() == 1
+
+    result = json.loads(out.read_text())
+    assert result['env'] == 'daily-27001.cdiff daily.cvd'
+    assert result['payload']['dns'] == '0.105.1:62:27002'
+    assert result['payload']['files'] == [
+        {'name': 'daily-27001.cdiff', 'db': 'daily.cvd', 'version': 27001, 'deleted': True},
+        {'name': 'daily.cvd', 'db': 'daily.cvd', 'version': 0, 'deleted': False},
+    ]
+
+
+def test_unix_socket_hook(revert_homedir, tmp_path):
+    c = CVDUpdate(config=tmp_path / 'config.json', db_dir=str(tmp_path / 'database'))
+    c.db_dir.mkdir()
+
+    path = str(tmp_path / 'notify.sock')
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(1)
+    received = []
+
+    def accept():
+        conn, _ = listener.accept()
+        with conn:
+            received.append(conn.makefile('rb').readline())
+
+    thread = threading.Thread(target=accept)
+    thread.start()
+
+    c.config['post update hooks'] = [{'unix socket': path, 'timeout': 5}]
+    c._run_post_update_hooks({'extra.ndb'})
+    assert c.wait_for_hooks() == 0
+    thread.join(5)
+    listener.close()
+
+    assert json.loads(received[0])['files'][0]['name'] == 'extra.ndb'
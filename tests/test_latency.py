@@ -0,0 +1,43 @@
+from tests.fixtures.revert import revert_homedir
+
+from cvdupdate import latency
+from cvdupdate.cvdupdate import CVDUpdate
+from cvdupdate.downloader import DownloadRequest, DownloadResult
+
+
+def test_ring_keeps_the_last_downloads():
+    ring = latency.FetchRing()
+    for i in range(latency.RING_SIZE + 5):
+        ring.add(latency.Fetch(float(i), i, 200))
+
+    # Survives the trip through the state.
+    ring = latency.FetchRing.from_state({'fetches': ring.to_state()})
+    fetches = ring.fetches()
+    assert len(fetches) == latency.RING_SIZE
+    assert [fetch.size for fetch in fetches] == list(range(5, latency.RING_SIZE + 5))
+
+    assert latency.FetchRing.from_state({'fetches': {'ring': '!!', 'next': 0}}).fetches() == []
+
+
+def test_summarize():
+    fetches = [latency.Fetch(float(i), 1024 * 1024, 200) for i in range(1, 11)] + [latency.Fetch(30.0, 0, 0)]
+    summary = latency.summarize(fetches)
+    assert summary.count == 11
+    assert summary.failed == 1
+    assert summary.p50 == 6.0
+    assert summary.p99 == 30.0
+    assert summary.statuses == {200: 10, 0: 1}
+    assert latency.percentile([], 50) == 0.0
+
+
+def test_rank_origins(revert_homedir, tmp_path):
+    c = CVDUpdate(config=tmp_path / 'config.json', db_dir=str(tmp_path / 'database'))
+    c._add_db('fast.ndb', 'https://fast.example.com/fast.ndb')
+    c._add_db('slow.ndb', 'https://slow.example.com/slow.ndb')
+
+    for db, elapsed in (('fast.ndb', 0.1), ('slow.ndb', 5.0)):
+        request = DownloadRequest(c.state['dbs'][db]['url'])
+        c._record_fetch(db, DownloadResult(request, 200, b'x' * 100, {}, False, 1, elapsed))
+
+    ranked = latency.rank_origins(c.state['dbs'])
+    assert [origin for origin, _ in ranked][:2] == ['https://slow.example.com', 'https://fast.example.com']
@@ -0,0 +1,64 @@
+import os
+
+from cvdupdate import manifest
+
+def test_describe_file():
+    dbs = {
+        "daily.cvd" : {"local version" : 27000},
+        "extra.ndb" : {"local version" : 0},
+    }
+    assert manifest.describe_file("daily.cvd", dbs) == ("daily.cvd", 27000)
+    assert manifest.describe_file("daily-26999.cdiff", dbs) == ("daily.cvd", 26999)
+    assert manifest.describe_file("daily-26999.cdiff.sign", dbs) == ("daily.cvd", 26999)
+    assert manifest.describe_file("daily-27000.cvd.sign", dbs) == ("daily.cvd", 27000)
+    assert manifest.describe_file("extra.ndb", dbs) == ("extra.ndb", 0)
+    assert manifest.describe_file("unknown.txt", dbs) == ("", 0)
+
+def test_build_manifest_reuses_hashes(tmp_path):
+    (tmp_path / "daily-1.cdiff").write_bytes(b"cdiff")
+    (tmp_path / "dns.txt").write_text("0.105.1:62:1")
+    dbs = {"daily.cvd" : {"local version" : 1}}
+
+    first = manifest.build_manifest(tmp_path, dbs, ["0.105.1", "62", "1"])
+    assert list(first['files']) == ["daily-1.cdiff"]
+    assert first['dns'] == "0.105.1:62:1"
+    assert first['files']["daily-1.cdiff"]['sha256'] == manifest.file_sha256(tmp_path / "daily-1.cdiff")
+
+    # An unchanged size and mtime means the old hash is trusted.
+    first['files']["daily-1.cdiff"]['sha256'] = "ab" * 32
+    second = manifest.build_manifest(tmp_path, dbs, [], previous=first)
+    assert second['files']["daily-1.cdiff"]['sha256'] == "ab" * 32
+
+    manifest.save_manifest(tmp_path / manifest.MANIFEST_FILE, second)
+    assert manifest.load_manifest(tmp_path / manifest.MANIFEST_FILE) == second
+    assert not any(name.endswith('.tmp') for name in os.listdir(str(tmp_path)))
+
+def test_update_manifest_only_touches_changed_files(tmp_path):
+    (tmp_path / "daily-1.cdiff").write_bytes(b"one")
+    (tmp_path / "daily-2.cdiff").write_bytes(b"two")
+    dbs = {"daily.cvd" : {"local version" : 2}}
+    previous = manifest.build_manifest(tmp_path, dbs, ["0.105.1", "62", "2"])
+
+    (tmp_path / "daily-1.cdiff").unlink()
+    (tmp_path / "daily-3.cdiff").write_bytes(b"three")
+    # Not reported as changed, so it should not be picked up.
+    (tmp_path / "stray.ndb").write_bytes(b"stray")
+
+    updated = manifest.update_manifest(previous, tmp_path, dbs, [], ["daily-1.cdiff", "daily-3.cdiff"])
+    assert list(updated['files']) == ["daily-2.cdiff", "daily-3.cdiff"]
+    assert updated['dns'] == previous['dns']
+
+def test_binary_manifest_round_trip_and_since(tmp_path):
+    for version in (1, 2, 3):
+        (tmp_path / f"daily-{version}.cdiff").write_bytes(b"x" * version)
+        (tmp_path / f"daily-{version}.cdiff.sign").write_bytes(b"sig")
+    (tmp_path / "main-5.cdiff").write_bytes(b"main")
+    dbs = {"daily.cvd" : {"local version" : 3}, "main.cvd" : {"local version" : 5}}
+    full = manifest.build_manifest(tmp_path, dbs, ["0.105.1", "5", "3"])
+
+    assert manifest.decode_binary_manifest(manifest.encode_binary_manifest(full)) == full
+
+    newer = manifest.filter_since(full, 1, "daily.cvd")
+    assert sorted(newer['files']) == [
+        "daily-2.cdiff", "daily-2.cdiff.sign", "daily-3.cdiff", "daily-3.cdiff.sign"
+    ]
@@ -0,0 +1,57 @@
+import io
+import json
+
+from tests.fixtures.revert import revert_homedir
+
+from cvdupdate.cvdupdate import CVDUpdate
+from cvdupdate.output import RecordWriter, update_record
+
+
+def test_ndjson_streams_records():
+    stream = io.StringIO()
+    writer = RecordWriter('ndjson', stream)
+    writer.write({'name': 'daily.cvd'})
+    assert stream.getvalue() == '{"name": "daily.cvd"}\n'
+    writer.write({'name': 'main.cvd'})
+    writer.close()
+    assert [json.loads(line)['name'] for line in stream.getvalue().splitlines()] == ['daily.cvd', 'main.cvd']
+
+
+def test_json_is_written_at_the_end():
+    stream = io.StringIO()
+    writer = RecordWriter('json', stream)
+    writer.write({'name': 'daily.cvd'})
+    assert stream.getvalue() == ''
+    writer.close()
+    assert json.loads(stream.getvalue()) == [{'name': 'daily.cvd'}]
+
+
+def test_list_records(revert_homedir, tmp_path, capsys):
+    c = CVDUpdate(config=tmp_path / 'config.json', db_dir=str(tmp_path / 'database'), log_stdout=False)
+    c.db_dir.mkdir()
+    capsys.readouterr()
+
+    stream = io.StringIO()
+    writer = RecordWriter('ndjson', stream)
+    c.db_list(writer=writer)
+    assert c.db_show('daily.cvd', writer=writer)
+    writer.close()
+
+    records = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [record['name'] for record in records[:-1]] == list(c.state['dbs'])
+    assert records[-1]['name'] == 'daily.cvd'
+    assert records[-1]['local version'] == 0
+
+    # Nothing else on stdout.
+    assert capsys.readouterr().out == ''
+
+
+def test_update_record():
+    details = {'local version': 27000, 'retry after': 0}
+    assert update_record('daily.cvd', 'updated', 1.5, details, {'daily.cvd', 'daily-27000.cdiff'}) == {
+        'name': 'daily.cvd',
+        'status': 'updated',
+        'elapsed': 1.5,
+        'files': ['daily-27000.cdiff', 'daily.cvd'],
+        'local version': 27000,
+    }
@@ -0,0 +1,64 @@
+import json
+import os
+
+import pytest
+
+from tests.fixtures.revert import revert_homedir
+
+from cvdupdate.cvdupdate import CVDUpdate, CvdStatus
+from cvdupdate.profiles import MirrorGroup, load_profiles_file
+
+
+def _make_profiles(tmp_path, pinned=()):
+    profiles = {}
+    for name in ('prod', 'legacy'):
+        config = tmp_path / name / 'config.json'
+        config.parent.mkdir()
+        CVDUpdate(config=config, db_dir=str(tmp_path / name / 'database'))
+        profiles[name] = {'config': str(config)}
+        if name in pinned:
+            profiles[name]['update'] = False
+
+    profiles_file = tmp_path / 'profiles.json'
+    profiles_file.write_text(json.dumps(profiles))
+    return profiles_file
+
+
+def test_load_profiles_file(tmp_path):
+    ''' profile names must be usable in a URL, and each profile needs a config '''
+    profiles_file = tmp_path / 'profiles.json'
+
+    profiles_file.write_text(json.dumps({'a/b': {'config': 'x.json'}}))
+    with pytest.raises(ValueError):
+        load_profiles_file(profiles_file)
+
+    profiles_file.write_text(json.dumps({'prod': {}}))
+    with pytest.raises(ValueError):
+        load_profiles_file(profiles_file)
+
+
+def test_shared_downloads_are_linked(revert_homedir, tmp_path):
+    ''' a file downloaded for one profile is hardlinked into the others '''
+    group = MirrorGroup(_make_profiles(tmp_path))
+    prod, legacy = group.profiles['prod'].m, group.profiles['legacy'].m
+
+    url = 'https://database.clamav.net/daily-27002.cdiff'
+    prod.db_dir.mkdir()
+    legacy.db_dir.mkdir()
+    assert legacy._link_shared_download(url, 'daily-27002.cdiff') is None
+
+    (prod.db_dir / 'daily-27002.cdiff').write_bytes(b'cdiff')
+    prod._remember_shared_download(url, 'daily-27002.cdiff')
+
+    assert legacy._link_shared_download(url, 'daily-27002.cdiff') == CvdStatus.UPDATED
+    assert os.path.samefile(str(prod.db_dir / 'daily-27002.cdiff'), str(legacy.db_dir / 'daily-27002.cdiff'))
+    assert 'daily-27002.cdiff' in legacy.files_changed
+
+    # Linking again is a no-op.
+    assert legacy._link_shared_download(url, 'daily-27002.cdiff') == CvdStatus.NO_UPDATE
+
+
+def test_pinned_profiles_are_not_updated(revert_homedir, tmp_path):
+    group = MirrorGroup(_make_profiles(tmp_path, pinned=('prod', 'legacy')))
+    assert group.update() == 0
+    assert not group.profiles['prod'].m.db_dir.exists()
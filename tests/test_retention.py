@@ -0,0 +1,43 @@
+import os
+
+from cvdupdate.retention import RetentionPolicy, plan_retention
+
+
+def _write(db_dir, name, size, mtime):
+    path = db_dir / name
+    path.write_bytes(b'x' * size)
+    os.utime(str(path), (mtime, mtime))
+
+
+def test_prune_by_count_with_sign_files(tmp_path):
+    ''' the oldest CDIFFs go first, with their sign files, and orphaned sign files go too '''
+    for version in (9, 10, 11, 12):
+        _write(tmp_path, f'daily-{version}.cdiff', 10, 1000)
+        _write(tmp_path, f'daily-{version}.cdiff.sign', 1, 1000)
+    _write(tmp_path, 'daily-5.cdiff.sign', 1, 1000)
+    _write(tmp_path, 'other-1.cdiff', 10, 1000)
+
+    result = plan_retention(tmp_path, ['daily.cvd', 'main.cvd'], RetentionPolicy(count=2), now=2000)
+    assert result.kept == {'daily.cvd': ['daily-11.cdiff', 'daily-12.cdiff'], 'main.cvd': []}
+    assert sorted(result.pruned) == sorted([
+        'daily-5.cdiff.sign',
+        'daily-9.cdiff', 'daily-9.cdiff.sign',
+        'daily-10.cdiff', 'daily-10.cdiff.sign',
+    ])
+
+
+def test_prune_by_age_and_bytes_keeps_newest(tmp_path):
+    for version, mtime in ((1, 100), (2, 200), (3, 300)):
+        _write(tmp_path, f'daily-{version}.cdiff', 100, mtime)
+
+    result = plan_retention(tmp_path, ['daily.cvd'], RetentionPolicy(max_age=150), now=320)
+    assert result.kept['daily.cvd'] == ['daily-2.cdiff', 'daily-3.cdiff']
+
+    result = plan_retention(tmp_path, ['daily.cvd'], RetentionPolicy(max_age=1), now=1000)
+    assert result.kept['daily.cvd'] == ['daily-3.cdiff']
+
+    result = plan_retention(tmp_path, ['daily.cvd'], RetentionPolicy(max_bytes=250), now=320)
+    assert result.kept['daily.cvd'] == ['daily-2.cdiff', 'daily-3.cdiff']
+
+    result = plan_retention(tmp_path, ['daily.cvd'], RetentionPolicy(), now=1000)
+    assert result.pruned == []
@@ -0,0 +1,66 @@
+import os
+
+from tests.fixtures.revert import revert_homedir
+
+from cvdupdate import snapshots
+from cvdupdate.cvdupdate import CVDUpdate
+
+
+def test_snapshots_are_hardlinked_and_immutable(tmp_path):
+    ''' a snapshot links the current files, and later replacements don't change it '''
+    db_dir = tmp_path / 'database'
+    snapshot_dir = tmp_path / 'snapshots'
+    db_dir.mkdir()
+    (db_dir / 'daily.cvd').write_bytes(b'v1')
+    (db_dir / '.daily.cvd.partial').write_bytes(b'partial')
+
+    first = snapshots.create_snapshot(db_dir, snapshot_dir)
+    snapshots.switch_current(snapshot_dir, first)
+    assert os.path.samefile(str(db_dir / 'daily.cvd'), str(snapshot_dir / first / 'daily.cvd'))
+    assert not (snapshot_dir / first / '.daily.cvd.partial').exists()
+
+    (db_dir / '.daily.cvd.partial').write_bytes(b'v2')
+    os.replace(str(db_dir / '.daily.cvd.partial'), str(db_dir / 'daily.cvd'))
+    second = snapshots.create_snapshot(db_dir, snapshot_dir)
+    snapshots.switch_current(snapshot_dir, second)
+
+    assert snapshots.list_snapshots(snapshot_dir) == [first, second]
+    assert (snapshot_dir / first / 'daily.cvd').read_bytes() == b'v1'
+    assert (snapshot_dir / snapshots.CURRENT / 'daily.cvd').read_bytes() == b'v2'
+
+    # The current snapshot is never pruned.
+    snapshots.switch_current(snapshot_dir, first)
+    assert snapshots.prune_snapshots(snapshot_dir, keep=0) == [second]
+    assert snapshots.list_snapshots(snapshot_dir) == [first]
+
+
+def test_rollback_is_pinned(revert_homedir, tmp_path):
+    ''' after a rollback, new snapshots are created but not served until released '''
+    c = CVDUpdate(config=tmp_path / 'config.json', db_dir=str(tmp_path / 'database'))
+    c.config['snapshots'] = True
+    c.config['snapshot directory'] = str(tmp_path / 'snapshots')
+    c.db_dir.mkdir()
+
+    for content in (b'v1', b'v2'):
+        c._publish_file('daily.cvd', content)
+        c._write_manifest()
+        assert c._publish_snapshot()
+    old, new = snapshots.list_snapshots(c.snapshot_dir)
+    assert c.serve_dir == c.snapshot_dir / snapshots.CURRENT
+
+    # Nothing changed, so no new snapshot.
+    c._write_manifest()
+    c._publish_snapshot()
+    assert len(snapshots.list_snapshots(c.snapshot_dir)) == 2
+
+    assert not c.db_rollback(2)
+    assert c.db_rollback(1)
+    assert snapshots.current_snapshot(c.snapshot_dir) == old
+
+    c._publish_file('daily.cvd', b'v3')
+    c._write_manifest()
+    c._publish_snapshot()
+    assert snapshots.current_snapshot(c.snapshot_dir) == old
+
+    assert c.db_rollback_release()
+    assert (c.serve_dir / 'daily.cvd').read_bytes() == b'v3'
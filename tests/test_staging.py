@@ -0,0 +1,63 @@
+import collections
+
+from tests.fixtures.revert import revert_homedir
+
+from cvdupdate.cvdupdate import CVDUpdate, DbPlan, PlanAction
+
+DiskUsage = collections.namedtuple('DiskUsage', ['total', 'used', 'free'])
+
+
+def new_cvdupdate(tmp_path):
+    c = CVDUpdate(config=tmp_path / 'config.json', db_dir=str(tmp_path / 'database'))
+    c.db_dir.mkdir()
+    return c
+
+
+def test_staged_files_are_moved_in_together(revert_homedir, tmp_path):
+    c = new_cvdupdate(tmp_path)
+    (c.db_dir / 'daily.cvd').write_bytes(b'old')
+
+    assert c._begin_staging()
+    assert c.staging_dir == tmp_path / '.database.staging'
+    assert c._publish_file('daily.cvd', b'new')
+    assert c._publish_file('daily-2.cdiff', b'cdiff')
+
+    # Nothing in the database directory changes until the commit.
+    assert (c.db_dir / 'daily.cvd').read_bytes() == b'old'
+    assert not (c.db_dir / 'daily-2.cdiff').exists()
+    assert c._local_path('daily.cvd').read_bytes() == b'new'
+
+    assert c._commit_staging() == 0
+    assert (c.db_dir / 'daily.cvd').read_bytes() == b'new'
+    assert (c.db_dir / 'daily-2.cdiff').read_bytes() == b'cdiff'
+    assert not c.staging_dir.exists()
+    assert c.staged is None
+    assert {'daily.cvd', 'daily-2.cdiff'} <= c.files_changed
+
+
+def test_discarded_staging_leaves_db_dir_alone(revert_homedir, tmp_path):
+    c = new_cvdupdate(tmp_path)
+    (c.db_dir / 'daily.cvd').write_bytes(b'old')
+
+    assert c._begin_staging()
+    assert c._publish_file('daily.cvd', b'new')
+    c._discard_staging()
+
+    assert (c.db_dir / 'daily.cvd').read_bytes() == b'old'
+    assert not c.staging_dir.exists()
+
+
+def test_not_enough_disk_space(revert_homedir, tmp_path, monkeypatch):
+    c = new_cvdupdate(tmp_path)
+    c.config['min free space'] = 100
+    monkeypatch.setattr('shutil.disk_usage', lambda path: DiskUsage(1000, 800, 200))
+
+    plans = {'main.cvd': DbPlan('main.cvd', PlanAction.UPDATE, estimated_bytes=50)}
+    assert c._preflight_disk_space(plans)
+    plans = {'main.cvd': DbPlan('main.cvd', PlanAction.UPDATE, estimated_bytes=150)}
+    assert not c._preflight_disk_space(plans)
+
+    assert c._publish_file('extra.ndb', b'x' * 100)
+    assert not c._publish_file('big.ndb', b'x' * 101)
+    assert not (c.db_dir / 'big.ndb').exists()
+    assert not (c.db_dir / '.big.ndb.partial').exists()
@@ -0,0 +1,52 @@
+import json
+
+from tests.fixtures.revert import revert_homedir
+
+from cvdupdate.cvdupdate import CVDUpdate
+from cvdupdate.readonly import ReadOnlyView
+from cvdupdate.statecache import StateCache
+
+
+def _updated_mirror(tmp_path):
+    c = CVDUpdate(config=tmp_path / 'config.json', db_dir=str(tmp_path / 'database'))
+    c.db_dir.mkdir()
+    (c.db_dir / 'daily.cvd').write_bytes(b'ClamAV-VDB:01 Jan 2026 00-00 +0000:27000:100:90:abcd:dsig:builder:1'.ljust(512) + b'tar.gz')
+    c.state['dbs']['daily.cvd']['local version'] = 27000
+    c.state['dbs']['daily.cvd']['CDIFFs'] = ['daily-26999.cdiff', 'daily-27000.cdiff']
+    c._save_config()
+    c._write_state_cache()
+    return c
+
+
+def test_state_cache_matches_state(revert_homedir, tmp_path):
+    c = _updated_mirror(tmp_path)
+
+    cache = StateCache.open(c.config_path)
+    assert cache is not None
+    assert list(cache) == list(c._iter_local_databases())
+    assert json.loads(cache.config_text) == c.config
+    assert json.loads(cache.state_text) == c.state
+
+    details, raw_header = cache.find('daily.cvd')
+    assert details['CDIFFs'] == ['daily-26999.cdiff', 'daily-27000.cdiff']
+    assert raw_header.startswith(b'ClamAV-VDB:')
+    assert cache.find('nope.cvd') is None
+
+    view = ReadOnlyView.open(c.config_path)
+    assert view.db_show('daily.cvd')
+    assert not view.db_show('nope.cvd')
+
+
+def test_stale_state_cache_is_ignored(revert_homedir, tmp_path):
+    c = _updated_mirror(tmp_path)
+
+    c.state['dbs']['daily.cvd']['CDIFFs'].append('daily-27001.cdiff')
+    c._save_config()
+    assert StateCache.open(c.config_path) is None
+
+    c._write_state_cache()
+    assert StateCache.open(c.config_path) is not None
+
+    # A new file in the database directory.
+    (c.db_dir / 'extra.ndb').write_bytes(b'signatures')
+    assert StateCache.open(c.config_path) is None
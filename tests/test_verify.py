@@ -0,0 +1,43 @@
+import gzip
+import hashlib
+
+from cvdupdate import cvd, verify
+
+def make_cvd(path, version=5, payload=b"payload" * 100, md5=None):
+    if md5 is None:
+        md5 = hashlib.md5(payload).hexdigest()
+    header = f"ClamAV-VDB:14 Oct 2021 07-15 -0400:{version}:10:90:{md5}:sig:builder:1634210133".encode()
+    path.write_bytes(header.ljust(cvd.CVD_HEADER_SIZE, b" ") + payload)
+    return path
+
+def make_cdiff(path, version=5):
+    path.write_bytes(gzip.compress(f"ClamAV-Diff:{version}:100:\nOPEN daily.ldb\n".encode()) + b":signature")
+    return path
+
+def test_verify_cvd(tmp_path):
+    assert verify.verify_file(make_cvd(tmp_path / "daily.cvd")).ok
+    assert not verify.verify_file(make_cvd(tmp_path / "daily.cvd"), expected_version=6).ok
+    assert not verify.verify_file(make_cvd(tmp_path / "daily.cvd", md5="0" * 32)).ok
+
+def test_verify_cdiff(tmp_path):
+    good = make_cdiff(tmp_path / "daily-5.cdiff")
+    assert verify.verify_file(good).ok
+
+    wrong_version = make_cdiff(tmp_path / "daily-6.cdiff", version=5)
+    assert not verify.verify_file(wrong_version).ok
+
+    truncated = tmp_path / "daily-7.cdiff"
+    truncated.write_bytes(good.read_bytes()[:20])
+    assert not verify.verify_file(truncated).ok
+
+def test_verify_uses_name_for_temporary_files(tmp_path):
+    tmp_file = make_cdiff(tmp_path / ".daily-5.cdiff.partial")
+    result = verify.verify_file(tmp_file, name="daily-5.cdiff")
+    assert result.ok
+    assert result.name == "daily-5.cdiff"
+
+def test_verify_files_in_pool(tmp_path):
+    paths = [make_cvd(tmp_path / "daily.cvd"), make_cdiff(tmp_path / "daily-5.cdiff"), tmp_path / "daily.cvd.sign"]
+    paths[2].write_bytes(b"")
+    results = verify.verify_files(paths, workers=2)
+    assert [result.ok for result in results] == [True, True, False]